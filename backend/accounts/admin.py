@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, PasswordResetCode
+from .models import User, PasswordResetCode, EmailOutbox
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -9,4 +9,10 @@ class UserAdmin(admin.ModelAdmin):
 @admin.register(PasswordResetCode)
 class ResetAdmin(admin.ModelAdmin):
     list_display = ('id','user','code','used','created_at')
-    search_fields = ('user__email','code')
\ No newline at end of file
+    search_fields = ('user__email','code')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id','to','subject','status','attempts','next_attempt_at','sent_at')
+    list_filter = ('status',)
+    search_fields = ('to','subject')
\ No newline at end of file
@@ -0,0 +1,69 @@
+import io
+
+from django.utils.crypto import constant_time_compare, salted_hmac
+from PIL import Image, ImageOps
+
+# Размеры превью аватара (сторона квадрата, px)
+AVATAR_SIZES = (64, 256)
+AVATAR_THUMB_MIME = 'image/webp'
+# Оригинал хранится перекодированным в PNG и не крупнее этого по стороне
+AVATAR_MIME = 'image/png'
+AVATAR_MAX_SIDE = 1024
+# Оригиналы, загруженные до перекодирования, отдаются только с такими типами
+AVATAR_SERVE_MIMES = {'image/png', 'image/jpeg', 'image/webp', 'image/gif'}
+
+
+class InvalidAvatar(ValueError):
+    pass
+
+
+def normalize_avatar(data: bytes) -> bytes:
+    """
+    Загрузка -> PNG, заново закодированный PIL. Тип, присланный клиентом, не
+    используется: что бы ни было в файле, отдаётся только картинка.
+    Не картинка (или слишком большая для разбора) — InvalidAvatar.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        img = ImageOps.exif_transpose(img).convert('RGBA')
+    except Exception as e:
+        raise InvalidAvatar('Аватар должен быть изображением') from e
+    img.thumbnail((AVATAR_MAX_SIDE, AVATAR_MAX_SIDE), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
+
+
+def make_avatar_thumbs(data: bytes) -> dict:
+    """
+    Готовит квадратные превью аватара {размер: bytes} в WebP.
+    Считается один раз при загрузке; если картинку не удалось разобрать —
+    возвращает {} и отдаётся оригинал.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGBA')
+    except Exception:
+        return {}
+
+    out = {}
+    for size in AVATAR_SIZES:
+        thumb = ImageOps.fit(img, (size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        thumb.save(buf, 'WEBP', quality=85, method=4)
+        out[size] = buf.getvalue()
+    return out
+
+
+def avatar_token(pk: int, version: int) -> str:
+    """
+    Неугадываемая часть URL аватара: HMAC от id и версии. Без неё аватар по
+    порядковому id не получить, а со сменой аватара старые ссылки перестают работать.
+    """
+    return salted_hmac('accounts.avatar', f'{pk}:{version}').hexdigest()[:32]
+
+
+def check_avatar_token(pk: int, version: int, token: str) -> bool:
+    return constant_time_compare(avatar_token(pk, version), token or '')
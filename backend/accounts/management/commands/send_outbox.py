@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import send_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправляет письма из EmailOutbox. По умолчанию работает постоянно; '
+        'для локальной проверки: python -m aiosmtpd -n -l localhost:1025 '
+        'и EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend, EMAIL_HOST=localhost, EMAIL_PORT=1025.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Отправить одну пачку и выйти')
+        parser.add_argument('--batch', type=int, default=50, help='Писем за одно соединение')
+        parser.add_argument('--interval', type=float, default=2.0, help='Пауза, если очередь пуста (с)')
+
+    def handle(self, *args, **opts):
+        while True:
+            stats = send_pending(batch_size=opts['batch'])
+            if stats['sent'] or stats['failed']:
+                self.stdout.write(f"outbox: sent={stats['sent']} failed={stats['failed']}")
+            if opts['once']:
+                return
+            # Пачка заполнена — сразу берём следующую
+            if stats['sent'] + stats['failed'] < opts['batch']:
+                time.sleep(opts['interval'])
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:43
+
+from django.db import migrations, models
+
+from accounts.avatars import make_avatar_thumbs
+
+
+def build_thumbs(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    qs = User.objects.exclude(avatar_bin=None).only('id', 'avatar_bin')
+    for u in qs.iterator(chunk_size=100):
+        thumbs = make_avatar_thumbs(bytes(u.avatar_bin))
+        User.objects.filter(pk=u.pk).update(
+            avatar_64=thumbs.get(64),
+            avatar_256=thumbs.get(256),
+            avatar_version=1,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_256',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_64',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(build_thumbs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:46
+
+import accounts.models
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class DuplicateIdentities(RuntimeError):
+    pass
+
+
+def _duplicates(User, field) -> dict:
+    """{значение в нижнем регистре: [id, ...]} для значений field, совпадающих без учёта регистра"""
+    ids = {}
+    for pk, value in User.objects.order_by('id').values_list('id', field).iterator():
+        ids.setdefault((value or '').lower(), []).append(pk)
+    return {value: pks for value, pks in ids.items() if len(pks) > 1}
+
+
+def normalize_identities(apps, schema_editor):
+    """
+    Перед созданием регистронезависимых уникальных индексов email приводим
+    к нижнему регистру. Email и логины, совпадающие без учёта регистра,
+    автоматически не исправить (по ним входят, за учёткой — подписки и
+    выгрузки), поэтому миграция ничего не меняет, а останавливается и
+    перечисляет их: учётки нужно объединить или переименовать вручную.
+    """
+    User = apps.get_model('accounts', 'User')
+
+    conflicts = []
+    for field, title in (('email', 'Email'), ('username', 'Логин')):
+        for value, pks in sorted(_duplicates(User, field).items()):
+            conflicts.append(f'  {title} {value}: id {", ".join(map(str, pks))}')
+    if conflicts:
+        listed = '\n'.join(conflicts)
+        raise DuplicateIdentities(
+            f'Email или логин совпадает без учёта регистра у {len(conflicts)} групп учёток — '
+            f'объедините их или переименуйте и повторите migrate:\n{listed}'
+        )
+
+    for pk, email in User.objects.order_by('id').values_list('id', 'email').iterator():
+        if email and email != email.lower():
+            User.objects.filter(pk=pk).update(email=email.lower())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_lower_prefix_indexes'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', accounts.models.AccountUserManager()),
+            ],
+        ),
+        migrations.RunPython(normalize_identities, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='user_email_ci_unique', violation_error_message='Пользователь с таким email уже существует'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('username'), name='user_username_ci_unique', violation_error_message='Пользователь с таким логином уже существует'),
+        ),
+    ]
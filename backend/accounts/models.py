@@ -1,21 +1,135 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.db.models.lookups import Exact
 from django.utils import timezone
 from datetime import timedelta
 
+from .avatars import AVATAR_MIME, make_avatar_thumbs, normalize_avatar
+
+class UserQuerySet(models.QuerySet):
+    """
+    Поиск по email/логину без учёта регистра: LOWER(col) = LOWER(value).
+    Такие условия обслуживаются уникальными функциональными индексами
+    (см. User.Meta.constraints), в отличие от __iexact (UPPER(...)).
+    """
+
+    def with_email(self, email):
+        return self.filter(Exact(Lower('email'), Lower(Value(email or ''))))
+
+    def with_username(self, username):
+        return self.filter(Exact(Lower('username'), Lower(Value(username or ''))))
+
+    def with_email_or_username(self, email, username):
+        return self.filter(
+            Exact(Lower('email'), Lower(Value(email or '')))
+            | Exact(Lower('username'), Lower(Value(username or '')))
+        )
+
+
+class AccountUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     email = models.EmailField(unique=True)
     avatar_bin = models.BinaryField(null=True, blank=True, editable=True)
     avatar_mime = models.CharField(max_length=100, null=True, blank=True)
+    # Превью аватара (WebP), считаются один раз при загрузке
+    avatar_64 = models.BinaryField(null=True, blank=True)
+    avatar_256 = models.BinaryField(null=True, blank=True)
+    # Растёт при каждой смене аватара — входит в URL, чтобы кэш браузера не устаревал
+    avatar_version = models.PositiveIntegerField(default=0)
+
+    objects = AccountUserManager()
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                Lower('email'), name='user_email_ci_unique',
+                violation_error_message='Пользователь с таким email уже существует',
+            ),
+            models.UniqueConstraint(
+                Lower('username'), name='user_username_ci_unique',
+                violation_error_message='Пользователь с таким логином уже существует',
+            ),
+        ]
+        indexes = [
+            # Поиск по префиксу (LOWER(col) LIKE 'abc%') в админке
+            models.Index(OpClass(Lower('email'), name='text_pattern_ops'), name='user_email_lower_prefix_idx'),
+            models.Index(OpClass(Lower('username'), name='text_pattern_ops'), name='user_username_lower_prefix_idx'),
+        ]
 
     def __str__(self):
         return self.username or self.email
 
+    def set_avatar(self, data: bytes):
+        """Перекодирует загрузку (avatars.normalize_avatar); не картинка — InvalidAvatar"""
+        data = normalize_avatar(data)
+        thumbs = make_avatar_thumbs(data)
+        self.avatar_bin = data
+        self.avatar_mime = AVATAR_MIME
+        self.avatar_64 = thumbs.get(64)
+        self.avatar_256 = thumbs.get(256)
+        self.avatar_version = (self.avatar_version or 0) + 1
+
+    def clear_avatar(self):
+        self.avatar_bin = None
+        self.avatar_mime = None
+        self.avatar_64 = None
+        self.avatar_256 = None
+        self.avatar_version = (self.avatar_version or 0) + 1
+
 class PasswordResetCode(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reset_codes')
     code = models.CharField(max_length=6)
     created_at = models.DateTimeField(auto_now_add=True)
     used = models.BooleanField(default=False)
 
+    TTL = timedelta(minutes=15)
+
+    @property
+    def expires_at(self):
+        return self.created_at + self.TTL
+
     def is_valid(self):
-        return (not self.used) and (timezone.now() - self.created_at < timedelta(minutes=15))
\ No newline at end of file
+        return (not self.used) and timezone.now() < self.expires_at
+
+class EmailOutbox(models.Model):
+    """
+    Исходящие письма. Пишутся в транзакции запроса, отправляются воркером
+    (manage.py send_outbox) пачками через одно SMTP-соединение.
+    У писем в статусе sending next_attempt_at — срок аренды воркера (accounts.outbox).
+    После expires_at письмо бесполезно (например, код сброса пароля истёк) и не
+    отправляется: статус expired.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'pending'),
+        ('sending', 'sending'),
+        ('sent', 'sent'),
+        ('failed', 'failed'),
+        ('expired', 'expired'),
+    ]
+    to = models.EmailField()
+    from_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body_text = models.TextField()
+    body_html = models.TextField(blank=True, default='')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'mail:{self.to}:{self.status}:{self.attempts}'
\ No newline at end of file
@@ -0,0 +1,138 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+# Задержка перед повтором: 30 с, 1 мин, 2 мин, ... но не больше часа
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+
+def enqueue_email(to, subject, text, html='', from_email=None, expires_at=None) -> EmailOutbox:
+    """
+    Кладёт письмо в очередь. Вызывать внутри транзакции запроса —
+    письмо уйдёт, только если транзакция зафиксирована.
+    expires_at — после этого момента письмо не отправляется (код в нём уже не действует).
+    """
+    return EmailOutbox.objects.create(
+        to=to,
+        from_email=from_email or getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@scannyrf'),
+        subject=subject,
+        body_text=text,
+        body_html=html or '',
+        expires_at=expires_at,
+    )
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** max(0, attempts - 1))))
+
+
+# Аренда захваченного письма: если воркер не записал итог за это время
+# (упал посреди пачки), письмо снова берётся в отправку
+LEASE_SECONDS = 600
+
+
+def _claim(batch_size: int) -> list:
+    """
+    Короткой транзакцией переводит пачку готовых писем (и писем с истёкшей
+    арендой) в sending: next_attempt_at становится сроком аренды. Строки
+    выбираются SKIP LOCKED, поэтому воркеры не захватят одно письмо дважды.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        EmailOutbox.objects.filter(
+            status__in=['pending', 'sending'], next_attempt_at__lte=now, expires_at__lte=now,
+        ).update(status='expired')
+        batch = list(
+            EmailOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'sending'], next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        for m in batch:
+            m.status = 'sending'
+            m.attempts += 1
+            m.next_attempt_at = now + timedelta(seconds=LEASE_SECONDS)
+            m.save(update_fields=['status', 'attempts', 'next_attempt_at'])
+    return batch
+
+
+def _owned(m: EmailOutbox):
+    """Письмо всё ещё за этим воркером: аренду не перехватили (attempts тот же)"""
+    return EmailOutbox.objects.filter(pk=m.pk, status='sending', attempts=m.attempts)
+
+
+def send_pending(batch_size=50) -> dict:
+    """
+    Отправляет одну пачку писем через одно соединение с почтовым бэкендом.
+    Письма захватываются короткой транзакцией (_claim), SMTP идёт вне
+    транзакции, итог каждого письма фиксируется отдельно.
+    Письма с истёкшим expires_at не отправляются (статус expired).
+    Возвращает {'sent': n, 'failed': n}.
+    """
+    stats = {'sent': 0, 'failed': 0}
+    batch = _claim(batch_size)
+    if not batch:
+        return stats
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # Сервер недоступен — откладываем всю пачку по backoff
+        logger.warning('Outbox: mail connection failed: %s', e)
+        for m in batch:
+            _mark_failed(m, e)
+            stats['failed'] += 1
+        return stats
+
+    try:
+        for m in batch:
+            if _expired(m):
+                # Истекло, пока шли письма перед ним
+                _owned(m).update(status='expired')
+                continue
+            msg = EmailMultiAlternatives(m.subject, m.body_text, m.from_email, [m.to], connection=connection)
+            if m.body_html:
+                msg.attach_alternative(m.body_html, 'text/html')
+            try:
+                msg.send(fail_silently=False)
+            except Exception as e:
+                logger.warning('Outbox: send to %s failed: %s', m.to, e)
+                _mark_failed(m, e)
+                stats['failed'] += 1
+                continue
+            _owned(m).update(status='sent', sent_at=timezone.now(), last_error='')
+            stats['sent'] += 1
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    return stats
+
+
+def _expired(m: EmailOutbox, at=None) -> bool:
+    return m.expires_at is not None and m.expires_at <= (at or timezone.now())
+
+
+def _mark_failed(m: EmailOutbox, error):
+    next_at = timezone.now() + _backoff(m.attempts)
+    if m.attempts >= MAX_ATTEMPTS:
+        status, next_at = 'failed', m.next_attempt_at
+    elif _expired(m, next_at):
+        # Повтор пришёлся бы на время, когда письмо уже бесполезно
+        status, next_at = 'expired', m.next_attempt_at
+    else:
+        status = 'pending'
+    _owned(m).update(status=status, last_error=str(error)[:2000], next_attempt_at=next_at)
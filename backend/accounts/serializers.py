@@ -1,5 +1,5 @@
-import base64
 from rest_framework import serializers
+from .avatars import avatar_token
 from .models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -11,10 +11,12 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id','username','email','avatar_url','is_staff')
 
     def get_avatar_url(self, obj):
-        if obj.avatar_bin and obj.avatar_mime:
-            b64 = base64.b64encode(obj.avatar_bin).decode('ascii')
-            return f"data:{obj.avatar_mime};base64,{b64}"
-        return None
+        # Только ссылка на /auth/avatar/ — сами байты в ответ не попадают
+        if not obj.avatar_mime:
+            return None
+        url = f"/api/auth/avatar/{obj.pk}/{avatar_token(obj.pk, obj.avatar_version)}/"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
 
 class RegisterSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -1,3 +1,470 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import time
+import socketserver
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.functions import Lower
+from django.db.models.lookups import StartsWith
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from google.auth import crypt, jwt as google_jwt
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core import outbound
+
+from . import outbox
+from .avatars import InvalidAvatar
+from .models import EmailOutbox, User
+from .serializers import UserSerializer
+from .views import ensure_username
+
+ci_migration = importlib.import_module('accounts.migrations.0004_user_ci_unique_constraints')
+
+
+def _png(color='red', size=(300, 200)) -> bytes:
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class AvatarTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ava', 'ava@example.com', 'pw')
+        self.user.set_avatar(_png())
+        self.user.save()
+
+    def _url(self):
+        return UserSerializer(self.user).data['avatar_url']
+
+    def test_served_by_token_url_with_private_cache(self):
+        resp = self.client.get(self._url(), {'size': 64})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'image/webp')
+        self.assertEqual(resp['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(resp['X-Content-Type-Options'], 'nosniff')
+        self.assertEqual(self.client.get(self._url(), {'size': 64}, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 304)
+
+    def test_guessed_or_stale_url_is_not_found(self):
+        self.assertEqual(self.client.get(f'/api/auth/avatar/{self.user.pk}/{"0" * 32}/').status_code, 404)
+        old = self._url()
+        self.user.set_avatar(_png('blue'))
+        self.user.save()
+        self.assertEqual(self.client.get(old).status_code, 404)
+        self.assertEqual(self.client.get(self._url()).status_code, 200)
+
+    def test_upload_is_reencoded(self):
+        self.user.set_avatar(_png(size=(3000, 1000)))
+        self.assertEqual(self.user.avatar_mime, 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(self.user.avatar_bin)).size, (1024, 341))
+
+    def test_non_image_upload_is_rejected(self):
+        with self.assertRaises(InvalidAvatar):
+            self.user.set_avatar(b'<script>alert(1)</script>')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        html = SimpleUploadedFile('a.html', b'<html><script>alert(1)</script></html>', content_type='text/html')
+        resp = client.post('/api/auth/profile/', {'avatar': html}, format='multipart')
+        self.assertEqual(resp.status_code, 400)
+        admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        client.force_authenticate(admin)
+        html.seek(0)
+        resp = client.post('/api/admin/users/', {'username': 'x', 'email': 'x@example.com', 'password': 'secret1',
+                                                 'avatar': html}, format='multipart')
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(User.objects.filter(username='x').exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_mime, 'image/png')
+
+    def test_stored_original_is_served_only_as_image(self):
+        User.objects.filter(pk=self.user.pk).update(avatar_64=None, avatar_256=None)
+        resp = self.client.get(self._url())
+        self.assertEqual((resp.status_code, resp['Content-Type']), (200, 'image/png'))
+        # Оригинал, загруженный до перекодирования с типом клиента
+        User.objects.filter(pk=self.user.pk).update(avatar_mime='text/html', avatar_bin=b'<script>alert(1)</script>')
+        self.assertEqual(self.client.get(self._url()).status_code, 404)
+
+
+class AdminUsersListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'pw'))
+        joined = timezone.now()
+        for name in ('Carol', 'alice', 'Bob', 'dave', 'Erin'):
+            User.objects.create_user(name, f'{name}@Example.com', 'pw', date_joined=joined)
+
+    def _walk(self, **params):
+        resp = self.client.get('/api/admin/users/', {'page_size': 2, **params})
+        names = []
+        while True:
+            self.assertEqual(resp.status_code, 200)
+            body = resp.json()
+            self.assertLessEqual(len(body['results']), 2)
+            names += [u['username'] for u in body['results']]
+            if not body['next']:
+                return names
+            resp = self.client.get(body['next'])
+
+    def test_cursor_pages_follow_sort(self):
+        self.assertEqual(self._walk(sort='username'), ['Bob', 'Carol', 'Erin', 'alice', 'dave', 'root'])
+        self.assertEqual(self._walk(sort='-email'), ['root', 'dave', 'alice', 'Erin', 'Carol', 'Bob'])
+        self.assertEqual(self._walk(sort='bogus'), self._walk(sort='id'))
+        # Одинаковая дата регистрации: порядок добивается id, строки не теряются и не повторяются
+        self.assertEqual(self._walk(sort='-date_joined'), ['Erin', 'dave', 'Bob', 'alice', 'Carol', 'root'])
+
+    def test_search_by_prefix_ignores_case(self):
+        self.assertEqual(self._walk(q='CA'), ['Carol'])
+        self.assertEqual(self._walk(q='erin@example'), ['Erin'])
+        self.assertEqual(self._walk(q='zzz'), [])
+
+
+class CaseInsensitiveIndexTests(TestCase):
+    """Поиск без учёта регистра идёт по функциональным индексам (EXPLAIN)"""
+
+    def setUp(self):
+        for i in range(3):
+            User.objects.create_user(f'User{i}', f'User{i}@Example.com', 'pw')
+        with connection.cursor() as c:
+            # На пустой таблице seq scan дешевле; проверяем, что индекс вообще применим
+            c.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, qs, *names):
+        plan = qs.explain()
+        self.assertNotIn('Seq Scan', plan)
+        for name in names:
+            self.assertRegex(plan, name)
+
+    def test_exact_lookups(self):
+        self.assertUsesIndex(User.objects.with_email('USER1@example.COM'), 'user_email_ci_unique')
+        self.assertUsesIndex(User.objects.with_username('user1'), 'user_username_ci_unique')
+        self.assertUsesIndex(User.objects.with_email_or_username('a@b.c', 'x'),
+                             'user_email_ci_unique', 'user_username_ci_unique')
+        self.assertEqual(User.objects.with_email('USER1@example.COM').get().username, 'User1')
+
+    def test_prefix_lookups(self):
+        # При C-сопоставлении префикс обслуживает и уникальный индекс — годится любой из двух
+        self.assertUsesIndex(User.objects.filter(StartsWith(Lower('username'), 'user')),
+                             r'user_username_(ci_unique|lower_prefix_idx)')
+        self.assertUsesIndex(User.objects.filter(StartsWith(Lower('email'), 'user')),
+                             r'user_email_(ci_unique|lower_prefix_idx)')
+        self.assertEqual(ensure_username('USER'), 'USER')
+        self.assertEqual(ensure_username('user1'), 'user11')
+
+    def test_case_variants_are_rejected(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create_user('other', 'user1@EXAMPLE.com', 'pw')
+
+
+class CaseInsensitiveMigrationTests(TransactionTestCase):
+    before = [('accounts', '0003_user_lower_prefix_indexes')]
+    after = [('accounts', '0004_user_ci_unique_constraints')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        self.addCleanup(lambda: MigrationExecutor(connection).migrate(executor.loader.graph.leaf_nodes()))
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def _migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+
+    def test_lowercases_emails(self):
+        OldUser = self.apps.get_model('accounts', 'User')
+        OldUser.objects.create(username='Bob', email='Bob@Example.com')
+        OldUser.objects.create(username='bob1', email='bob2@example.com')
+        self._migrate()
+        self.assertEqual(sorted(User.objects.values_list('username', 'email')),
+                         [('Bob', 'bob@example.com'), ('bob1', 'bob2@example.com')])
+
+    def test_stops_on_duplicates(self):
+        OldUser = self.apps.get_model('accounts', 'User')
+        a = OldUser.objects.create(username='a', email='Dup@Example.com')
+        b = OldUser.objects.create(username='b', email='dup@example.com')
+        c = OldUser.objects.create(username='Bob', email='c@example.com')
+        d = OldUser.objects.create(username='bob', email='d@example.com')
+        with self.assertRaises(ci_migration.DuplicateIdentities) as ctx:
+            self._migrate()
+        self.assertIn(f'Email dup@example.com: id {a.pk}, {b.pk}', str(ctx.exception))
+        self.assertIn(f'Логин bob: id {c.pk}, {d.pk}', str(ctx.exception))
+        self.assertEqual(OldUser.objects.get(pk=a.pk).email, 'Dup@Example.com')
+        OldUser.objects.filter(pk=b.pk).update(email='other@example.com')
+        OldUser.objects.filter(pk=d.pk).update(username='bob2')
+        self._migrate()
+        self.assertEqual(User.objects.get(pk=a.pk).email, 'dup@example.com')
+        self.assertEqual(User.objects.get(pk=d.pk).username, 'bob2')
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP: принимает письма в server.messages, адреса из server.reject — 550"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 localhost test')
+        rcpt = []
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            cmd = line[:4].upper()
+            if cmd in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif cmd == 'MAIL':
+                rcpt = []
+                self.reply('250 OK')
+            elif cmd == 'RCPT':
+                addr = line.split(':', 1)[1].strip(' <>')
+                if addr in self.server.reject:
+                    self.reply('550 no such user')
+                else:
+                    rcpt.append(addr)
+                    self.reply('250 OK')
+            elif cmd == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                while (chunk := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(chunk)
+                self.server.on_message(rcpt, b''.join(data))
+                self.reply('250 queued')
+            elif cmd == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServerMixin:
+    def setUp(self):
+        super().setUp()
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+        server.daemon_threads = True
+        server.messages, server.reject = [], set()
+        server.on_message = lambda rcpt, data: server.messages.append((rcpt, data))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.smtp = server
+        override = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1],
+            EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class OutboxTests(SMTPServerMixin, TestCase):
+    def test_sends_pending_mail(self):
+        outbox.enqueue_email('a@example.com', 'Код', 'текст', '<b>html</b>')
+        outbox.enqueue_email('b@example.com', 'Код', 'текст')
+        self.assertEqual(outbox.send_pending(), {'sent': 2, 'failed': 0})
+        self.assertEqual(sorted(r for r, _ in self.smtp.messages), [['a@example.com'], ['b@example.com']])
+        self.assertEqual(set(EmailOutbox.objects.values_list('status', 'attempts')), {('sent', 1)})
+        self.assertEqual(outbox.send_pending(), {'sent': 0, 'failed': 0})
+
+    def test_rejected_mail_is_retried_then_failed(self):
+        self.smtp.reject.add('bad@example.com')
+        m = outbox.enqueue_email('bad@example.com', 'Код', 'текст')
+        with self.assertLogs('accounts.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_pending(), {'sent': 0, 'failed': 1})
+        m.refresh_from_db()
+        self.assertEqual((m.status, m.attempts), ('pending', 1))
+        self.assertIn('no such user', m.last_error)
+        self.assertGreater(m.next_attempt_at, timezone.now())
+        self.assertEqual(outbox.send_pending(), {'sent': 0, 'failed': 0})
+
+        EmailOutbox.objects.filter(pk=m.pk).update(attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        with self.assertLogs('accounts.outbox', 'WARNING'):
+            outbox.send_pending()
+        m.refresh_from_db()
+        self.assertEqual((m.status, m.attempts), ('failed', outbox.MAX_ATTEMPTS))
+
+    def test_expired_lease_is_reclaimed(self):
+        m = outbox.enqueue_email('a@example.com', 'Код', 'текст')
+        EmailOutbox.objects.filter(pk=m.pk).update(status='sending', attempts=1,
+                                                   next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(outbox.send_pending(), {'sent': 0, 'failed': 0})
+        EmailOutbox.objects.filter(pk=m.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.send_pending(), {'sent': 1, 'failed': 0})
+        m.refresh_from_db()
+        self.assertEqual((m.status, m.attempts), ('sent', 2))
+
+    def test_expired_mail_is_not_sent(self):
+        m = outbox.enqueue_email('a@example.com', 'Код', 'текст', expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.send_pending(), {'sent': 0, 'failed': 0})
+        self.assertEqual(self.smtp.messages, [])
+        m.refresh_from_db()
+        self.assertEqual(m.status, 'expired')
+
+    def test_retry_after_expiry_is_dropped(self):
+        self.smtp.reject.add('bad@example.com')
+        m = outbox.enqueue_email('bad@example.com', 'Код', 'текст', expires_at=timezone.now() + timedelta(seconds=10))
+        with self.assertLogs('accounts.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_pending(), {'sent': 0, 'failed': 1})
+        m.refresh_from_db()
+        self.assertEqual((m.status, m.attempts), ('expired', 1))
+
+    def test_reset_code_mail_expires_with_code(self):
+        u = User.objects.create_user(username='bob', email='bob@example.com', password='x' * 12)
+        resp = APIClient().post('/api/auth/password/request-code/', {'email': 'bob@example.com'}, format='json')
+        self.assertEqual(resp.status_code, 200)
+        m = EmailOutbox.objects.get()
+        self.assertEqual(m.expires_at, u.reset_codes.get().expires_at)
+
+
+class OutboxTransactionTests(SMTPServerMixin, TransactionTestCase):
+    def test_smtp_runs_outside_transaction(self):
+        outbox.enqueue_email('a@example.com', 'Код', 'текст')
+        outbox.enqueue_email('b@example.com', 'Код', 'текст')
+        seen = []
+
+        def check(rcpt, data):
+            # Другое соединение (поток сервера) видит захват и итог первого письма — они уже зафиксированы
+            seen.append(sorted(EmailOutbox.objects.values_list('status', flat=True)))
+            connection.close()
+
+        self.smtp.on_message = check
+        self.assertEqual(outbox.send_pending(), {'sent': 2, 'failed': 0})
+        self.assertEqual(seen, [['sending', 'sending'], ['sending', 'sent']])
+
+    def test_result_of_lost_lease_is_dropped(self):
+        m = outbox.enqueue_email('a@example.com', 'Код', 'текст')
+
+        def steal(rcpt, data):
+            # Аренду, пока идёт SMTP, перехватил другой воркер
+            EmailOutbox.objects.filter(pk=m.pk).update(attempts=5)
+            connection.close()
+
+        self.smtp.on_message = steal
+        outbox.send_pending()
+        m.refresh_from_db()
+        self.assertEqual((m.status, m.attempts), ('sending', 5))
+
+
+def _rsa_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    public = key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private, public.decode()
+
+
+class _ProviderHandler(BaseHTTPRequestHandler):
+    """Фейковые Google (сертификаты), Facebook Graph и VK API"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        state = self.server.state
+        state['hits'].append(url.path)
+        if url.path == '/google/certs':
+            body, headers = state['certs'], {'Cache-Control': 'public, max-age=3600'}
+        elif url.path == '/fb/debug_token':
+            body, headers = {'data': {'is_valid': q.get('input_token') == 'good'}}, {}
+        elif url.path == '/fb/me':
+            body, headers = {'id': '42', 'name': 'Fb User', 'email': 'FB@example.com'}, {}
+        elif url.path == '/vk/users.get':
+            if q.get('access_token') == 'good':
+                body = {'response': [{'id': 7, 'first_name': 'Вера', 'last_name': 'Кузнецова'}]}
+            else:
+                body = {'error': {'error_code': 5}}
+            headers = {}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class SocialLoginTests(TestCase):
+    """Входы через соцсети против локальных фейковых провайдеров (core.outbound)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.keys = {'k1': _rsa_key(), 'k2': _rsa_key()}
+
+    def setUp(self):
+        cache.clear()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _ProviderHandler)
+        server.daemon_threads = True
+        server.state = {'hits': [], 'certs': {'k1': self.keys['k1'][1]}}
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.provider = server.state
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+        override = override_settings(
+            GOOGLE_CLIENT_ID='cid', GOOGLE_CERTS_URL=f'{base}/google/certs',
+            FACEBOOK_APP_ID='app', FACEBOOK_APP_SECRET='secret', FACEBOOK_GRAPH_URL=f'{base}/fb',
+            VK_API_URL=f'{base}/vk',
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _id_token(self, kid, email='g@example.com'):
+        signer = crypt.RSASigner.from_string(self.keys[kid][0], key_id=kid)
+        now = int(time.time())
+        return google_jwt.encode(signer, {
+            'iss': 'https://accounts.google.com', 'aud': 'cid', 'iat': now, 'exp': now + 600,
+            'email': email, 'name': 'G User',
+        }).decode()
+
+    def _google(self, token):
+        return self.client.post('/api/auth/google/', {'id_token': token}, content_type='application/json')
+
+    def test_google_login_uses_cached_certs(self):
+        for _ in range(2):
+            resp = self._google(self._id_token('k1'))
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['user']['email'], 'g@example.com')
+        self.assertEqual(self.provider['hits'], ['/google/certs'])
+        self.assertEqual(outbound.metrics_snapshot()['google']['errors'], 0)
+
+    def test_google_key_rotation_refetches_certs(self):
+        self.assertEqual(self._google(self._id_token('k1')).status_code, 200)
+        self.provider['certs'] = {'k2': self.keys['k2'][1]}
+        self.assertEqual(self._google(self._id_token('k2')).status_code, 200)
+        self.assertEqual(self.provider['hits'], ['/google/certs'] * 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.assertEqual(self._google(self._id_token('k1')).status_code, 200)
+        for _ in range(3):
+            self.assertEqual(self._google(self._id_token('k2')).status_code, 400)
+        self.assertEqual(self.provider['hits'], ['/google/certs'] * 2)
+
+    def test_facebook_login(self):
+        resp = self.client.post('/api/auth/facebook/', {'access_token': 'good'}, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['user']['email'], 'fb@example.com')
+        resp = self.client.post('/api/auth/facebook/', {'access_token': 'bad'}, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_vk_login(self):
+        resp = self.client.post('/api/auth/vk/', {'access_token': 'good'}, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['user']['email'], 'vk_7@vk.local')
+        resp = self.client.post('/api/auth/vk/', {'access_token': 'bad'}, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
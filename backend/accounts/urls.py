@@ -2,10 +2,10 @@ from django.urls import path
 
 from .views import (
     ApiRootView,
-    RegisterView, LoginView, MeView, ProfileUpdateView,
+    RegisterView, LoginView, MeView, ProfileUpdateView, AvatarView,
     RequestResetCodeView, ConfirmResetCodeView,
     GoogleAuthView, FacebookAuthView, VkAuthView,
-    AdminUsersListCreate, AdminUserDetail, PasswordChangeView,
+    AdminUsersListCreate, AdminUserDetail, AdminOutboundMetricsView, PasswordChangeView,
     SafeTokenRefreshView,  # <— заменили refresh на безопасный
 )
 
@@ -15,6 +15,7 @@ urlpatterns = [
     path('auth/login/', LoginView.as_view()),
     path('auth/me/', MeView.as_view()),
     path('auth/profile/', ProfileUpdateView.as_view()),
+    path('auth/avatar/<int:pk>/<str:token>/', AvatarView.as_view()),
     path('auth/password/change/', PasswordChangeView.as_view()),
     path('auth/password/request-code/', RequestResetCodeView.as_view()),
     path('auth/password/confirm/', ConfirmResetCodeView.as_view()),
@@ -27,4 +28,5 @@ urlpatterns = [
     # админ CRUD
     path('admin/users/', AdminUsersListCreate.as_view()),
     path('admin/users/<int:pk>/', AdminUserDetail.as_view()),
+    path('admin/outbound-metrics/', AdminOutboundMetricsView.as_view()),
 ]
\ No newline at end of file
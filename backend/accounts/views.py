@@ -1,16 +1,18 @@
 import os
 import random
-import requests
 from datetime import timedelta
 
 from django.conf import settings
-from django.db.models import Q
+from django.core.cache import cache
+from django.db.models.functions import Lower
+from django.db.models.lookups import StartsWith
+from django.http import Http404, HttpResponse, HttpResponseNotModified
 from django.utils import timezone
-from django.core.mail import EmailMultiAlternatives
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.contrib.auth import get_user_model
 
 from rest_framework import permissions
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
@@ -19,10 +21,13 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from rest_framework_simplejwt.exceptions import InvalidToken
 
-from google.oauth2 import id_token
-from google.auth.transport import requests as greq
+from google.auth import jwt as google_jwt
 
+from core import outbound
+
+from .avatars import AVATAR_SERVE_MIMES, AVATAR_SIZES, AVATAR_THUMB_MIME, InvalidAvatar, check_avatar_token
 from .models import User, PasswordResetCode
+from .outbox import enqueue_email
 from .serializers import (
     RegisterSerializer, LoginSerializer, UserSerializer, ProfileUpdateSerializer
 )
@@ -34,9 +39,18 @@ def tokens_for_user(user):
 
 
 def ensure_username(base):
+    """
+    Свободный логин на основе base: base, base1, base2, ...
+    Все занятые варианты берём одним запросом по префиксу (индекс LOWER(username)).
+    """
     base = (base or 'user').split('@')[0]
+    taken = set(
+        User.objects.filter(StartsWith(Lower('username'), base.lower()))
+        .annotate(lname=Lower('username'))
+        .values_list('lname', flat=True)
+    )
     u, i = base, 0
-    while User.objects.filter(username=u).exists():
+    while u.lower() in taken:
         i += 1
         u = f"{base}{i}"
     return u
@@ -72,11 +86,11 @@ class RegisterView(APIView):
         email = s.validated_data['email'].lower()
         username = s.validated_data.get('username') or ensure_username(email)
         password = s.validated_data['password']
-        if User.objects.filter(Q(email__iexact=email)|Q(username__iexact=username)).exists():
+        if User.objects.with_email_or_username(email, username).exists():
             return Response({'detail':'Пользователь с таким email/логином уже существует'}, status=400)
         user = User.objects.create(username=username, email=email)
         user.set_password(password); user.save()
-        return Response({'user': UserSerializer(user).data, **tokens_for_user(user)}, status=201)
+        return Response({'user': UserSerializer(user, context={'request': request}).data, **tokens_for_user(user)}, status=201)
 
 
 class LoginView(APIView):
@@ -84,17 +98,17 @@ class LoginView(APIView):
     def post(self, request):
         s = LoginSerializer(data=request.data); s.is_valid(raise_exception=True)
         ident = s.validated_data['identifier']; password = s.validated_data['password']
-        user = User.objects.filter(email__iexact=ident).first() if '@' in ident else None
-        if not user: user = User.objects.filter(username__iexact=ident).first()
+        user = User.objects.with_email(ident).first() if '@' in ident else None
+        if not user: user = User.objects.with_username(ident).first()
         if not user or not user.check_password(password):
             return Response({'detail':'Неверные учетные данные'}, status=400)
-        return Response({'user': UserSerializer(user).data, **tokens_for_user(user)})
+        return Response({'user': UserSerializer(user, context={'request': request}).data, **tokens_for_user(user)})
 
 
 class MeView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        return Response(UserSerializer(request.user).data)
+        return Response(UserSerializer(request.user, context={'request': request}).data)
 
 
 class ProfileUpdateView(APIView):
@@ -105,27 +119,98 @@ class ProfileUpdateView(APIView):
 
         if s.validated_data.get('email'):
             new_email = s.validated_data['email'].strip().lower()
-            if User.objects.exclude(pk=u.pk).filter(email__iexact=new_email).exists():
+            if User.objects.with_email(new_email).exclude(pk=u.pk).exists():
                 return Response({'detail': 'Этот e‑mail уже занят'}, status=400)
             u.email = new_email
 
         if 'username' in s.validated_data:
             new_username = (s.validated_data.get('username') or '').strip()
-            if new_username and User.objects.exclude(pk=u.pk).filter(username__iexact=new_username).exists():
+            if new_username and User.objects.with_username(new_username).exclude(pk=u.pk).exists():
                 return Response({'detail': 'Логин уже занят'}, status=400)
             u.username = new_username
 
         if s.validated_data.get('remove_avatar'):
-            u.avatar_bin = None; u.avatar_mime = None
+            u.clear_avatar()
         if 'avatar' in request.FILES:
-            f = request.FILES['avatar']; u.avatar_bin = f.read(); u.avatar_mime = f.content_type or 'image/png'
+            try:
+                u.set_avatar(request.FILES['avatar'].read())
+            except InvalidAvatar as e:
+                return Response({'detail': str(e)}, status=400)
 
         try:
             u.save()
         except IntegrityError:
             return Response({'detail': 'Нарушение уникальности email/логина'}, status=400)
 
-        return Response(UserSerializer(u).data)
+        return Response(UserSerializer(u, context={'request': request}).data)
+
+
+class AvatarView(APIView):
+    """
+    Аватар пользователя: GET /auth/avatar/<id>/<token>/?size=64|256
+    Отдаёт готовое превью (или оригинал с типом из AVATAR_SERVE_MIMES, если
+    превью нет — иначе 404). Токен — HMAC от id
+    и версии аватара (avatars.avatar_token): ссылку знает только тот, кому её
+    выдал API, и она меняется с аватаром, поэтому ответ кэшируется браузером
+    «навсегда», но только приватно — общие прокси его не хранят.
+    Без авторизации: ссылку открывает <img>, который не шлёт JWT.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def get(self, request, pk, token):
+        try:
+            size = int(request.GET.get('size') or 256)
+        except ValueError:
+            size = 256
+        size = min(AVATAR_SIZES, key=lambda s: abs(s - size))
+        thumb_field = f'avatar_{size}'
+
+        row = (
+            User.objects.filter(pk=pk)
+            .values_list('avatar_version', 'avatar_mime', thumb_field)
+            .first()
+        )
+        if not row or not row[1] or not check_avatar_token(pk, row[0], token):
+            raise Http404
+        version, mime, thumb = row
+
+        etag = f'"{pk}-{version}-{size}"'
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            resp = HttpResponseNotModified()
+        elif thumb:
+            resp = HttpResponse(bytes(thumb), content_type=AVATAR_THUMB_MIME)
+        else:
+            data = User.objects.filter(pk=pk).values_list('avatar_bin', flat=True).first()
+            if not data or mime not in AVATAR_SERVE_MIMES:
+                raise Http404
+            resp = HttpResponse(bytes(data), content_type=mime)
+
+        resp['ETag'] = etag
+        resp['X-Content-Type-Options'] = 'nosniff'
+        resp['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return resp
+
+
+def _reset_code_email(code):
+    subject = 'Код для смены пароля — Сканни.рф'
+    site_name = 'Сканни.рф'
+    text = (
+        f'Здравствуйте!\n\n'
+        f'Ваш код подтверждения: {code}\n'
+        f'Код действителен 15 минут.\n\n'
+        f'Если вы не запрашивали смену пароля на {site_name}, просто проигнорируйте это письмо.'
+    )
+    html = f"""
+    <div style="font-family:system-ui,-apple-system,'Segoe UI',Roboto,Arial,sans-serif;line-height:1.5;">
+      <p>Здравствуйте!</p>
+      <p>Ваш код подтверждения:</p>
+      <p style="font-size:22px;font-weight:800;letter-spacing:2px;">{code}</p>
+      <p>Код действителен 15 минут.</p>
+      <p style="color:#666">Если вы не запрашивали смену пароля на {site_name}, просто проигнорируйте это письмо.</p>
+    </div>
+    """
+    return subject, text, html
 
 
 class RequestResetCodeView(APIView):
@@ -134,42 +219,19 @@ class RequestResetCodeView(APIView):
         email = (request.data.get('email') or '').strip().lower()
         if not email:
             return Response({'detail':'Укажите e‑mail'}, status=400)
-        u = User.objects.filter(email__iexact=email).first()
+        u = User.objects.with_email(email).first()
         if not u:
             return Response({'detail':'Пользователь не найден'}, status=404)
 
-        last = PasswordResetCode.objects.filter(user=u, used=False).order_by('-created_at').first()
-        if last and (timezone.now() - last.created_at) < timedelta(seconds=60):
-            code = last.code
-        else:
-            code = f"{random.randint(0,999999):06d}"
-            PasswordResetCode.objects.create(user=u, code=code)
-
-        subject = 'Код для смены пароля — Сканни.рф'
-        from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@scannyrf')
-        site_name = 'Сканни.рф'
-        text = (
-            f'Здравствуйте!\n\n'
-            f'Ваш код подтверждения: {code}\n'
-            f'Код действителен 15 минут.\n\n'
-            f'Если вы не запрашивали смену пароля на {site_name}, просто проигнорируйте это письмо.'
-        )
-        html = f"""
-        <div style="font-family:system-ui,-apple-system,'Segoe UI',Roboto,Arial,sans-serif;line-height:1.5;">
-          <p>Здравствуйте!</p>
-          <p>Ваш код подтверждения:</p>
-          <p style="font-size:22px;font-weight:800;letter-spacing:2px;">{code}</p>
-          <p>Код действителен 15 минут.</p>
-          <p style="color:#666">Если вы не запрашивали смену пароля на {site_name}, просто проигнорируйте это письмо.</p>
-        </div>
-        """
-        try:
-            msg = EmailMultiAlternatives(subject, text, from_email, [email])
-            msg.attach_alternative(html, "text/html")
-            msg.send(fail_silently=False)
-            return Response({'ok': True})
-        except Exception as e:
-            return Response({'detail': f'Не удалось отправить письмо: {e}'}, status=500)
+        with transaction.atomic():
+            rc = PasswordResetCode.objects.filter(user=u, used=False).order_by('-created_at').first()
+            if not rc or (timezone.now() - rc.created_at) >= timedelta(seconds=60):
+                rc = PasswordResetCode.objects.create(user=u, code=f"{random.randint(0,999999):06d}")
+
+            subject, text, html = _reset_code_email(rc.code)
+            # Письмо уходит воркером send_outbox, запрос не ждёт SMTP; с истёкшим кодом — не уходит
+            enqueue_email(email, subject, text, html, expires_at=rc.expires_at)
+        return Response({'ok': True})
 
 
 class ConfirmResetCodeView(APIView):
@@ -185,7 +247,7 @@ class ConfirmResetCodeView(APIView):
         if len(new_password)<6:
             return Response({'detail':'Пароль должен быть не менее 6 символов'}, status=400)
 
-        u = User.objects.filter(email__iexact=email).first()
+        u = User.objects.with_email(email).first()
         if not u: return Response({'detail':'Пользователь не найден'}, status=404)
         rec = PasswordResetCode.objects.filter(user=u, code=code, used=False).order_by('-created_at').first()
         if not rec or not rec.is_valid(): return Response({'detail':'Код недействителен'}, status=400)
@@ -196,6 +258,38 @@ class ConfirmResetCodeView(APIView):
 
 
 # Быстрые входы — теперь читаем ключи/секреты из settings, а не os.getenv
+_GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+
+# Не чаще раза в это время сертификаты перечитываются из-за незнакомого kid
+GOOGLE_CERTS_REFETCH_INTERVAL = 60
+
+
+def _google_certs(kid):
+    """
+    Сертификаты Google из кэша. Если kid токена в них нет, Google мог сменить
+    ключи раньше, чем истёк кэш, — перечитываем мимо кэша, но не чаще
+    GOOGLE_CERTS_REFETCH_INTERVAL: токены с выдуманным kid не должны
+    превращаться в запросы к Google.
+    """
+    certs = outbound.get_json_cached('google', settings.GOOGLE_CERTS_URL)
+    if kid and kid not in certs and cache.add('accounts:google_certs_refetch', 1, GOOGLE_CERTS_REFETCH_INTERVAL):
+        certs = outbound.get_json_cached('google', settings.GOOGLE_CERTS_URL, refresh=True)
+    return certs
+
+
+def _verify_google_id_token(token, client_id):
+    """
+    Аналог google.oauth2.id_token.verify_oauth2_token, но сертификаты Google
+    берутся из кэша (TTL по Cache-Control), а не скачиваются на каждый вход.
+    """
+    certs = _google_certs(google_jwt.decode_header(token).get('kid'))
+    info = google_jwt.decode(token, certs=certs, audience=client_id)
+    if info.get('iss') not in _GOOGLE_ISSUERS:
+        raise ValueError('Wrong issuer')
+    return info
+
+
 class GoogleAuthView(APIView):
     permission_classes = [permissions.AllowAny]
     def post(self, request):
@@ -204,12 +298,12 @@ class GoogleAuthView(APIView):
         if not token or not client_id:
             return Response({'detail':'Отсутствуют данные Google'}, status=400)
         try:
-            info = id_token.verify_oauth2_token(token, greq.Request(), client_id)
+            info = _verify_google_id_token(token, client_id)
             email = (info.get('email') or '').lower(); name = info.get('name') or ''
             if not email: return Response({'detail':'Не удалось подтвердить email Google'}, status=400)
-            u = User.objects.filter(email__iexact=email).first()
+            u = User.objects.with_email(email).first()
             if not u: u = User.objects.create(username=ensure_username(email or name), email=email); u.set_unusable_password(); u.save()
-            return Response({'user': UserSerializer(u).data, **tokens_for_user(u)})
+            return Response({'user': UserSerializer(u, context={'request': request}).data, **tokens_for_user(u)})
         except Exception:
             return Response({'detail':'Идентификатор Google недействителен'}, status=400)
 
@@ -223,16 +317,17 @@ class FacebookAuthView(APIView):
         if not token or not app_id or not app_secret:
             return Response({'detail':'Отсутствуют параметры Facebook'}, status=400)
         try:
-            dbg = requests.get("https://graph.facebook.com/debug_token",
-                               params={'input_token':token,'access_token':f"{app_id}|{app_secret}"}, timeout=10).json()
+            graph = settings.FACEBOOK_GRAPH_URL
+            dbg = outbound.get_json('facebook', f"{graph}/debug_token",
+                                    params={'input_token':token,'access_token':f"{app_id}|{app_secret}"})
             if not dbg.get('data',{}).get('is_valid'): return Response({'detail':'Токен Facebook недействителен'}, status=400)
-            me = requests.get("https://graph.facebook.com/me",
-                              params={'fields':'id,name,email','access_token':token}, timeout=10).json()
+            me = outbound.get_json('facebook', f"{graph}/me",
+                                   params={'fields':'id,name,email','access_token':token})
             fid = me.get('id'); name = me.get('name') or ''; email = (me.get('email') or f'fb_{fid}@facebook.local').lower()
             if not fid: return Response({'detail':'Не удалось получить профиль Facebook'}, status=400)
-            u = User.objects.filter(email__iexact=email).first()
+            u = User.objects.with_email(email).first()
             if not u: u = User.objects.create(username=ensure_username(name or email), email=email); u.set_unusable_password(); u.save()
-            return Response({'user': UserSerializer(u).data, **tokens_for_user(u)})
+            return Response({'user': UserSerializer(u, context={'request': request}).data, **tokens_for_user(u)})
         except Exception:
             return Response({'detail':'Ошибка Facebook'}, status=400)
 
@@ -243,28 +338,59 @@ class VkAuthView(APIView):
         token = request.data.get('access_token'); email = (request.data.get('email') or '').lower()
         if not token: return Response({'detail':'Нет access_token VK'}, status=400)
         try:
-            resp = requests.get('https://api.vk.com/method/users.get',
-                                params={'access_token':token,'v':'5.131','fields':'first_name,last_name'}, timeout=10).json()
+            resp = outbound.get_json('vk', f"{settings.VK_API_URL}/users.get",
+                                     params={'access_token':token,'v':'5.131','fields':'first_name,last_name'})
             if 'error' in resp: return Response({'detail':'Токен VK недействителен'}, status=400)
             info = (resp.get('response') or [{}])[0]
             vid = info.get('id'); first = info.get('first_name',''); last = info.get('last_name','')
             if not vid: return Response({'detail':'Не удалось получить профиль VK'}, status=400)
             if not email: email = f'vk_{vid}@vk.local'
             name = f"{first} {last}".strip()
-            u = User.objects.filter(email__iexact=email).first()
+            u = User.objects.with_email(email).first()
             if not u: u = User.objects.create(username=ensure_username(name or email), email=email); u.set_unusable_password(); u.save()
-            return Response({'user': UserSerializer(u).data, **tokens_for_user(u)})
+            return Response({'user': UserSerializer(u, context={'request': request}).data, **tokens_for_user(u)})
         except Exception:
             return Response({'detail':'Ошибка VK'}, status=400)
 
 
 # Админ — CRUD пользователей
+class AdminUsersPagination(CursorPagination):
+    """
+    Курсорная пагинация списка пользователей.
+    ?sort=id|email|username|date_joined (с '-' — по убыванию), ?page_size=<=200
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = 'id'
+    sort_fields = ('id', 'email', 'username', 'date_joined')
+
+    def get_ordering(self, request, queryset, view):
+        sort = (request.query_params.get('sort') or 'id').strip()
+        if sort.lstrip('-') not in self.sort_fields:
+            sort = 'id'
+        if sort.lstrip('-') == 'date_joined':
+            # неуникальное поле — добиваем id, чтобы порядок был стабильным
+            return (sort, '-id' if sort.startswith('-') else 'id')
+        return (sort,)
+
+
 class AdminUsersListCreate(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
-        qs = User.objects.all().order_by('id')
-        return Response([UserSerializer(u).data for u in qs])
+        """
+        Страница пользователей: ?q=<префикс email/логина>&sort=...&cursor=...
+        Бинарные колонки (аватар и превью) из БД не читаются.
+        """
+        qs = User.objects.only('id', 'username', 'email', 'is_staff', 'date_joined', 'avatar_mime', 'avatar_version')
+        q = (request.query_params.get('q') or '').strip().lower()
+        if q:
+            qs = qs.filter(StartsWith(Lower('email'), q) | StartsWith(Lower('username'), q))
+        paginator = AdminUsersPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        data = [UserSerializer(u, context={'request': request}).data for u in page]
+        return paginator.get_paginated_response(data)
 
     def post(self, request):
         email = (request.data.get('email') or '').strip().lower()
@@ -274,7 +400,7 @@ class AdminUsersListCreate(APIView):
         if not email:
             return Response({'detail': 'email обязателен'}, status=400)
 
-        if User.objects.filter(Q(email__iexact=email) | Q(username__iexact=username)).exists():
+        if User.objects.with_email_or_username(email, username).exists():
             return Response({'detail': 'Пользователь уже существует (email или логин)'}, status=400)
 
         # Пароль обязателен и не меньше 6 символов
@@ -283,20 +409,23 @@ class AdminUsersListCreate(APIView):
         if len(password) < 6:
             return Response({'detail': 'Пароль должен быть не менее 6 символов'}, status=400)
 
-        u = User.objects.create(username=username, email=email, is_staff=False)
+        u = User(username=username, email=email, is_staff=False)
         u.set_password(password)
 
         if request.data.get('remove_avatar'):
-            u.avatar_bin = None; u.avatar_mime = None
+            u.clear_avatar()
         elif 'avatar' in request.FILES:
-            f = request.FILES['avatar']; u.avatar_bin = f.read(); u.avatar_mime = f.content_type or 'image/png'
+            try:
+                u.set_avatar(request.FILES['avatar'].read())
+            except InvalidAvatar as e:
+                return Response({'detail': str(e)}, status=400)
 
         try:
             u.save()
         except IntegrityError:
             return Response({'detail':'Нарушение уникальности email/логина'}, status=400)
 
-        return Response(UserSerializer(u).data, status=201)
+        return Response(UserSerializer(u, context={'request': request}).data, status=201)
 
 
 class AdminUserDetail(APIView):
@@ -304,13 +433,13 @@ class AdminUserDetail(APIView):
     def get_obj(self, pk):
         return User.objects.get(pk=pk)
     def get(self, request, pk):
-        return Response(UserSerializer(self.get_obj(pk)).data)
+        return Response(UserSerializer(self.get_obj(pk), context={'request': request}).data)
     def put(self, request, pk):
         u = self.get_obj(pk)
         email = (request.data.get('email') or u.email).strip().lower()
         username = (request.data.get('username') or '').strip()
 
-        if User.objects.exclude(pk=u.pk).filter(Q(email__iexact=email) | Q(username__iexact=username)).exists():
+        if User.objects.with_email_or_username(email, username).exclude(pk=u.pk).exists():
             return Response({'detail':'email/логин заняты'}, status=400)
 
         u.email = email
@@ -323,16 +452,19 @@ class AdminUserDetail(APIView):
             u.set_password(pwd)
 
         if request.data.get('remove_avatar'):
-            u.avatar_bin = None; u.avatar_mime = None
+            u.clear_avatar()
         elif 'avatar' in request.FILES:
-            f = request.FILES['avatar']; u.avatar_bin = f.read(); u.avatar_mime = f.content_type or 'image/png'
+            try:
+                u.set_avatar(request.FILES['avatar'].read())
+            except InvalidAvatar as e:
+                return Response({'detail': str(e)}, status=400)
 
         try:
             u.save()
         except IntegrityError:
             return Response({'detail':'Нарушение уникальности email/логина'}, status=400)
 
-        return Response(UserSerializer(u).data)
+        return Response(UserSerializer(u, context={'request': request}).data)
     def delete(self, request, pk):
         if request.user and request.user.pk == int(pk):
             return Response({'detail':'Нельзя удалить свой аккаунт'}, status=400)
@@ -340,6 +472,13 @@ class AdminUserDetail(APIView):
         return Response(status=204)
 
 
+class AdminOutboundMetricsView(APIView):
+    """Задержки/ошибки исходящих запросов к провайдерам (по текущему процессу)"""
+    permission_classes = [permissions.IsAdminUser]
+    def get(self, request):
+        return Response(outbound.metrics_snapshot())
+
+
 class PasswordChangeView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     def post(self, request):
@@ -1,3 +1,14 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import FAQQuestion, LegalPage
+
+
+@admin.register(FAQQuestion)
+class FAQQuestionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'title', 'updated_at')
+    search_fields = ('title',)
+
+
+@admin.register(LegalPage)
+class LegalPageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'slug', 'title', 'updated_at')
@@ -1,4 +1,7 @@
 from django.apps import AppConfig
 class CmsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'cms'
\ No newline at end of file
+    name = 'cms'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -1,13 +1,39 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.db.models import F, Func, Value
+
+# Конфигурация полнотекстового поиска PostgreSQL (стемминг русского языка)
+SEARCH_CONFIG = 'russian'
+
+
+def html_text(field):
+    """Текст HTML-поля без тегов (SQL-выражение)"""
+    # regexp_replace иммутабелен — можно использовать в генерируемой колонке
+    return Func(
+        F(field), Value('<[^>]+>'), Value(' '), Value('g'),
+        function='REGEXP_REPLACE', output_field=models.TextField(),
+    )
+
 
 class FAQQuestion(models.Model):
     title = models.CharField(max_length=400)
     body = models.TextField()  # HTML
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Поисковый вектор считает сама БД: заголовок весит больше текста ответа
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', config=SEARCH_CONFIG, weight='A')
+            + SearchVector(html_text('body'), config=SEARCH_CONFIG, weight='B')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     class Meta:
         ordering = ['id']
+        indexes = [GinIndex(fields=['search_vector'], name='faq_search_vector_gin')]
 
     def __str__(self):
         return self.title
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FAQQuestion, LegalPage
+
+
+@receiver(post_save, sender=FAQQuestion)
+@receiver(post_delete, sender=FAQQuestion)
+@receiver(post_save, sender=LegalPage)
+@receiver(post_delete, sender=LegalPage)
+def _reset_cms_cache(sender, **kwargs):
+    """Правки через API, админку или shell сбрасывают закэшированные ответы"""
+    from .views import invalidate_cms_cache
+    invalidate_cms_cache(sender)
@@ -1,3 +1,79 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from . import views
+from .models import FAQQuestion
+
+
+class CMSCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.faq = FAQQuestion.objects.create(title='Как подписать?', body='<p>Так</p>')
+
+    def _titles(self):
+        return [q['title'] for q in self.client.get('/api/cms/faq/').json()]
+
+    def test_save_invalidates_cache(self):
+        self.assertEqual(self._titles(), ['Как подписать?'])
+        self.faq.title = 'Как поставить печать?'
+        self.faq.save()
+        self.assertEqual(self._titles(), ['Как поставить печать?'])
+
+    def test_local_cache_expires_quickly(self):
+        self.assertEqual(self._titles(), ['Как подписать?'])
+        # Правка в другом процессе: сброс версии до нашего LocMemCache не дошёл
+        FAQQuestion.objects.filter(pk=self.faq.pk).update(title='Как поставить печать?')
+        self.assertEqual(self._titles(), ['Как подписать?'])
+        later = time.time() + views.CMS_LOCAL_CACHE_TTL + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertEqual(self._titles(), ['Как поставить печать?'])
+
+    def test_shared_cache_keeps_long_ttl(self):
+        self.assertEqual(views._cache_ttl(), views.CMS_LOCAL_CACHE_TTL)
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://x'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(views._cache_ttl(), views.CMS_CACHE_TTL)
+
+
+class FAQSearchTests(TestCase):
+    def setUp(self):
+        self.sign = FAQQuestion.objects.create(title='Как подписать документ?', body='<p>Загрузите <b>подпись</b> и перетащите её на документ.</p>')
+        self.seal = FAQQuestion.objects.create(title='Как поставить печать?', body='<p>Печать ставится на каждый документ отдельно.</p>')
+        FAQQuestion.objects.create(title='Оплата', body='<p>Картой или через СБП.</p>')
+
+    def _search(self, q, **params):
+        resp = self.client.get('/api/cms/faq/search/', {'q': q, **params})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_stemmed_match_ranked_and_highlighted(self):
+        body = self._search('документы')
+        # Совпадение в заголовке весит больше, чем в тексте ответа
+        self.assertEqual([r['id'] for r in body['results']], [self.sign.pk, self.seal.pk])
+        self.assertIn('<mark>', body['results'][0]['title_hl'])
+        self.assertIn('<mark>документ</mark>', body['results'][1]['snippet'])
+        self.assertNotIn('<b>', body['results'][0]['snippet'])
+
+    def test_last_word_is_prefix_and_all_words_required(self):
+        self.assertEqual([r['id'] for r in self._search('печ')['results']], [self.seal.pk])
+        self.assertEqual([r['id'] for r in self._search('документ печать')['results']], [self.seal.pk])
+        self.assertEqual(self._search('документ дрон')['count'], 0)
+
+    def test_empty_or_symbolic_query(self):
+        self.assertEqual(self._search('')['results'], [])
+        self.assertEqual(self._search("'&|!:*()")['count'], 0)
+
+    def test_pagination(self):
+        body = self._search('документ', page_size=1)
+        self.assertEqual((body['count'], len(body['results'])), (2, 1))
+        self.assertIsNotNone(body['next'])
+
+    def test_uses_gin_index(self):
+        with connection.cursor() as c:
+            c.execute('SET LOCAL enable_seqscan = off')
+        plan = FAQQuestion.objects.filter(search_vector=views.SearchQuery('документ', config='russian')).explain()
+        self.assertIn('faq_search_vector_gin', plan)
@@ -1,19 +1,153 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import viewsets, permissions
-from .models import FAQQuestion, LegalPage
+from rest_framework.decorators import action
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .models import FAQQuestion, LegalPage, SEARCH_CONFIG, html_text
 from .serializers import FAQSerializer, LegalSerializer
 
+# Отрендеренные ответы живут до первой правки (версия в ключе), TTL — страховка
+CMS_CACHE_TTL = 24 * 3600
+# Без Redis у каждого процесса свой LocMemCache и новая версия видна только
+# процессу, где сохранили правку: остальные перечитывают БД не реже этого
+CMS_LOCAL_CACHE_TTL = 60
+
+
+def _cache_ttl():
+    backend = settings.CACHES['default']['BACKEND']
+    shared = not backend.endswith(('.LocMemCache', '.DummyCache'))
+    return CMS_CACHE_TTL if shared else CMS_LOCAL_CACHE_TTL
+
+
+def _version_key(model):
+    return f'cms:ver:{model._meta.label_lower}'
+
+
+def _cache_version(model):
+    ver = cache.get(_version_key(model))
+    if ver is None:
+        ver = 1
+        cache.add(_version_key(model), ver, None)
+    return ver
+
+
+def invalidate_cms_cache(model):
+    """Новая версия — все закэшированные list/detail ответы модели устаревают разом"""
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
 class IsAdminOrReadOnly(permissions.BasePermission):
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
             return True
         return request.user and request.user.is_staff
 
-class FAQViewSet(viewsets.ModelViewSet):
-    queryset = FAQQuestion.objects.all()
+
+class CachedReadMixin:
+    """
+    list/retrieve отдаются готовыми байтами из кэша, без запросов к БД.
+    ETag и Last-Modified считаются по updated_at, поэтому повторный
+    запрос браузера с If-None-Match/If-Modified-Since получает 304.
+    """
+
+    def _cached(self, request, name, load):
+        model = self.get_queryset().model
+        key = f'cms:{model._meta.label_lower}:v{_cache_version(model)}:{name}'
+        entry = cache.get(key)
+        if entry is None:
+            objs, many = load()
+            data = self.get_serializer(objs if many else objs[0], many=many).data
+            stamps = [(o.pk, o.updated_at.isoformat()) for o in objs]
+            entry = {
+                'body': JSONRenderer().render(data),
+                'etag': '"%s"' % hashlib.sha1(repr(stamps).encode()).hexdigest()[:20],
+                'last_modified': max((int(o.updated_at.timestamp()) for o in objs), default=None),
+            }
+            cache.set(key, entry, _cache_ttl())
+
+        resp = HttpResponse(entry['body'], content_type='application/json')
+        resp['ETag'] = entry['etag']
+        if entry['last_modified']:
+            resp['Last-Modified'] = http_date(entry['last_modified'])
+        # Браузер каждый раз переспрашивает сервер, но обычно получает 304
+        resp['Cache-Control'] = 'no-cache'
+        return get_conditional_response(
+            request, etag=entry['etag'], last_modified=entry['last_modified'], response=resp,
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(request, 'list', lambda: (list(self.filter_queryset(self.get_queryset())), True))
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')
+        return self._cached(request, f'detail:{pk}', lambda: ([self.get_object()], False))
+
+
+class FAQSearchPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+def _prefix_tsquery(q: str) -> str:
+    """
+    «подпис документ» -> «подпис & документ:*»: все слова обязательны,
+    последнее — префикс, чтобы поиск работал по мере набора.
+    """
+    words = re.findall(r'\w+', q.lower())[:10]
+    if not words:
+        return ''
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+class FAQViewSet(CachedReadMixin, viewsets.ModelViewSet):
+    queryset = FAQQuestion.objects.defer('search_vector')
     serializer_class = FAQSerializer
     permission_classes = [IsAdminOrReadOnly]
 
-class LegalViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], pagination_class=FAQSearchPagination)
+    def search(self, request):
+        """
+        GET /cms/faq/search/?q=...&page=N — полнотекстовый поиск по заголовку и тексту
+        (GIN-индекс по search_vector). Результаты отсортированы по релевантности,
+        совпадения выделены <mark>.
+        """
+        raw = _prefix_tsquery((request.query_params.get('q') or '')[:200])
+        if not raw:
+            return Response({'count': 0, 'next': None, 'previous': None, 'results': []})
+        query = SearchQuery(raw, config=SEARCH_CONFIG, search_type='raw')
+        mark = {'config': SEARCH_CONFIG, 'start_sel': '<mark>', 'stop_sel': '</mark>'}
+        qs = (
+            FAQQuestion.objects
+            .filter(search_vector=query)
+            .annotate(
+                rank=SearchRank(F('search_vector'), query),
+                title_hl=SearchHeadline('title', query, highlight_all=True, **mark),
+                snippet=SearchHeadline(html_text('body'), query, max_words=35, min_words=15, max_fragments=2, **mark),
+            )
+            .order_by('-rank', 'id')
+            .values('id', 'title', 'title_hl', 'snippet', 'rank', 'updated_at')
+        )
+        page = self.paginate_queryset(qs)
+        for row in page:
+            row['rank'] = round(row['rank'], 4)
+        return self.get_paginated_response(page)
+
+class LegalViewSet(CachedReadMixin, viewsets.ModelViewSet):
     queryset = LegalPage.objects.all()
     serializer_class = LegalSerializer
-    permission_classes = [IsAdminOrReadOnly]
\ No newline at end of file
+    permission_classes = [IsAdminOrReadOnly]
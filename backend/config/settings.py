@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 import os
 from datetime import timedelta
@@ -27,6 +28,7 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'django.contrib.postgres',  # OpClass/функциональные индексы, полнотекстовый поиск
 
     # WhiteNoise для статики в DEBUG=False
     'whitenoise.runserver_nostatic',
@@ -184,6 +186,55 @@ FACEBOOK_APP_ID = config('FACEBOOK_APP_ID', default='')
 FACEBOOK_APP_SECRET = config('FACEBOOK_APP_SECRET', default='')
 VK_SERVICE_KEY = config('VK_SERVICE_KEY', default='')
 
+# Адреса провайдеров (можно подменить на локальный фейковый сервер)
+GOOGLE_CERTS_URL = config('GOOGLE_CERTS_URL', default='https://www.googleapis.com/oauth2/v1/certs')
+FACEBOOK_GRAPH_URL = config('FACEBOOK_GRAPH_URL', default='https://graph.facebook.com')
+VK_API_URL = config('VK_API_URL', default='https://api.vk.com/method')
+
+# Ключевая ставка ЦБ: текущая (JSON) и история (SOAP-сервис DailyInfo)
+CBR_KEY_RATE_URL = config('CBR_KEY_RATE_URL', default='https://www.cbr-xml-daily.ru/key-rate.json')
+CBR_DAILY_INFO_URL = config('CBR_DAILY_INFO_URL', default='https://www.cbr.ru/DailyInfoWebServ/DailyInfo.asmx')
+
+# --- Серверный рендеринг/экспорт документов ---
+# Пул процессов для рендеринга страниц: 0 — считать в текущем процессе
+RENDER_WORKERS = config('RENDER_WORKERS', default=max(1, (os.cpu_count() or 2) - 1), cast=int)
+# Процесс пула перезапускается после N задач (страховка от утечек памяти в Pillow)
+RENDER_TASKS_PER_CHILD = config('RENDER_TASKS_PER_CHILD', default=200, cast=int)
+# Шрифты для текстовых слоёв: бандл фронтенда + системные
+EXPORT_FONT_DIRS = [
+    str(ROOT_DIR / 'frontend' / 'src' / 'assets' / 'fonts'),
+    str(ROOT_DIR / 'Materials'),
+    '/usr/share/fonts',
+]
+EXPORT_MAX_PAGES = config('EXPORT_MAX_PAGES', default=300, cast=int)
+# Исходные PDF для векторного экспорта: лимит размера и сколько последних хранить
+SOURCE_MAX_BYTES = config('SOURCE_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+SOURCE_KEEP_PER_USER = config('SOURCE_KEEP_PER_USER', default=10, cast=int)
+# Фоновые выгрузки (manage.py run_export_jobs): каталог результатов должен
+# быть общим у веб-процесса и воркера
+EXPORT_JOB_DIR = config('EXPORT_JOB_DIR', default=os.path.join(tempfile.gettempdir(), 'scannyrf-exports'))
+EXPORT_JOB_TTL_HOURS = config('EXPORT_JOB_TTL_HOURS', default=2, cast=int)
+EXPORT_JOBS_PER_USER = config('EXPORT_JOBS_PER_USER', default=2, cast=int)
+# Кэш готовых выгрузок по хэшу содержимого (LRU по размеру каталога)
+EXPORT_CACHE_DIR = config('EXPORT_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'scannyrf-export-cache'))
+EXPORT_CACHE_MAX_BYTES = config('EXPORT_CACHE_MAX_BYTES', default=2 * 1024 ** 3, cast=int)
+# Растровые страницы загруженных документов (content-addressed), удаляются
+# через PAGE_BLOB_TTL_DAYS без обращений
+PAGE_BLOB_DIR = config('PAGE_BLOB_DIR', default=os.path.join(tempfile.gettempdir(), 'scannyrf-blobs'))
+PAGE_BLOB_TTL_DAYS = config('PAGE_BLOB_TTL_DAYS', default=30, cast=int)
+
+# Конвертация DOCX/XLS/XLSX: тёплые экземпляры LibreOffice на процесс
+OFFICE_BINARY = config('OFFICE_BINARY', default='')
+OFFICE_POOL_SIZE = config('OFFICE_POOL_SIZE', default=2, cast=int)
+OFFICE_JOB_TIMEOUT = config('OFFICE_JOB_TIMEOUT', default=60, cast=int)
+OFFICE_QUEUE_TIMEOUT = config('OFFICE_QUEUE_TIMEOUT', default=30, cast=int)
+OFFICE_JOBS_PER_INSTANCE = config('OFFICE_JOBS_PER_INSTANCE', default=200, cast=int)
+
+# Распознавание текста для PDF с поиском (core.ocr): tesseract и его языки
+OCR_BINARY = config('OCR_BINARY', default='')
+OCR_LANGS = config('OCR_LANGS', default='rus+eng')
+OCR_TIMEOUT = config('OCR_TIMEOUT', default=60, cast=int)
+
 # --- Channels (WebSockets) ---
 # По умолчанию InMemoryChannelLayer (для одного инстанса).
 # Для продакшена рекомендуем Redis:
@@ -207,6 +258,23 @@ else:
         "default": { "BACKEND": "channels.layers.InMemoryChannelLayer" }
     }
 
+# --- Кэш ---
+# С Redis кэш общий для всех воркеров, иначе — локальный в каждом процессе.
+if os.environ.get('REDIS_URL') or config('REDIS_URL', default=''):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get('REDIS_URL') or config('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "scannyrf",
+        }
+    }
+
 # ==============================================================================
 # НАСТРОЙКИ СПЕЦИАЛЬНО ДЛЯ ПРОДАКШЕНА (OnRender)
 # ==============================================================================
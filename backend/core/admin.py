@@ -10,6 +10,7 @@ from .models import (
     Upload,
     DocumentDraft,
     DraftEvent,  # <- добавили
+    KeyRate,
 )
 
 
@@ -102,4 +103,10 @@ class DraftEventAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'client_id', 'kind', 'created_at')
     list_filter = ('kind',)
     search_fields = ('user__email', 'user__username', 'client_id', 'kind')
-    ordering = ('-created_at',)
\ No newline at end of file
+    ordering = ('-created_at',)
+
+
+@admin.register(KeyRate)
+class KeyRateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'date', 'rate', 'fetched_at')
+    ordering = ('-date',)
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+Поиск листа на фотографии и выравнивание перспективы (в процессах core.workers).
+
+Анализ идёт на копии не больше ANALYSIS_SIDE пикселей: яркость, порог
+Оцу (лист обычно светлее стола), связная область в центре кадра, её
+контур, углы — крайние точки контура по x+y и x−y, уточнённые по прямым,
+подогнанным к сторонам.
+Найденный четырёхугольник проверяется по площади, выпуклости и по силе
+перепада яркости вдоль сторон — иначе страница не трогается.
+Перспектива исправляется одним преобразованием Pillow в полном
+разрешении, результат — прямоугольник с пропорциями A4.
+Модуль не зависит от Django.
+"""
+import numpy as np
+from PIL import Image, ImageFilter
+
+ANALYSIS_SIDE = 512
+A4_RATIO = 297 / 210
+# Лист должен занимать хотя бы эту долю кадра
+MIN_AREA_SHARE = 0.2
+# Углы ближе этой доли стороны к углам кадра — листа на фото не видно (скан, скриншот)
+FRAME_MARGIN = 0.02
+# Средний перепад яркости вдоль сторон относительно среднего по кадру
+MIN_EDGE_CONTRAST = 1.5
+
+
+def _otsu(gray: np.ndarray) -> int:
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    w0 = np.cumsum(hist)
+    m0 = np.cumsum(hist * np.arange(256))
+    w1 = total - w0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = np.nan_to_num((m0[-1] * w0 - m0 * total) ** 2 / (w0 * w1))
+    return int(np.argmax(between[:-1]))
+
+
+def _gradient(gray: np.ndarray) -> np.ndarray:
+    g = gray.astype(np.float32)
+    gx = np.zeros_like(g)
+    gy = np.zeros_like(g)
+    gx[:, 1:-1] = g[:, 2:] - g[:, :-2]
+    gy[1:-1, :] = g[2:, :] - g[:-2, :]
+    return np.hypot(gx, gy)
+
+
+def _runs_fill(mask: np.ndarray, seed: np.ndarray) -> np.ndarray:
+    """Отрезки mask в строках, задетые seed, целиком"""
+    flat = mask.ravel()
+    start = flat.copy()
+    start[1:] &= ~flat[:-1]
+    start[::mask.shape[1]] = flat[::mask.shape[1]]
+    run = np.cumsum(start)
+    hit = np.bincount(run[flat & seed.ravel()], minlength=run[-1] + 1) > 0
+    hit[0] = False
+    return (flat & hit[run]).reshape(mask.shape)
+
+
+def _component(mask: np.ndarray, y: int, x: int) -> np.ndarray:
+    """
+    Связная область mask с точкой (y, x): заливка отрезками поочерёдно по
+    строкам и столбцам, пока область растёт. Для листа бумаги хватает
+    нескольких проходов, каждый — пара операций над всем массивом.
+    """
+    region = np.zeros_like(mask)
+    region[y, x] = mask[y, x]
+    size = -1
+    while region.sum() != size:
+        size = region.sum()
+        region = _runs_fill(mask, region)
+        region = _runs_fill(mask.T.copy(), region.T.copy()).T
+    return region
+
+
+def _edge_strength(grad: np.ndarray, quad: np.ndarray) -> float:
+    """Средний градиент вдоль сторон четырёхугольника"""
+    h, w = grad.shape
+    t = np.linspace(0, 1, 64)[:, None]
+    pts = np.concatenate([quad[i] + (quad[(i + 1) % 4] - quad[i]) * t for i in range(4)])
+    xs = np.clip(np.round(pts[:, 0]).astype(int), 0, w - 1)
+    ys = np.clip(np.round(pts[:, 1]).astype(int), 0, h - 1)
+    # Граница после порога может сместиться на пиксель-другой: берём максимум в окрестности
+    best = np.zeros(len(xs), dtype=np.float32)
+    for dy in (-2, -1, 0, 1, 2):
+        for dx in (-2, -1, 0, 1, 2):
+            best = np.maximum(best, grad[np.clip(ys + dy, 0, h - 1), np.clip(xs + dx, 0, w - 1)])
+    return float(best.mean())
+
+
+def _area(quad: np.ndarray) -> float:
+    x, y = quad[:, 0], quad[:, 1]
+    return 0.5 * abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+
+
+def _convex(quad: np.ndarray) -> bool:
+    d1 = np.roll(quad, -1, axis=0) - quad
+    d2 = np.roll(quad, -2, axis=0) - np.roll(quad, -1, axis=0)
+    cross = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+    return bool(np.all(cross > 0) or np.all(cross < 0))
+
+
+def _refine(quad: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Углы как пересечения прямых, подогнанных к точкам контура у каждой
+    стороны: крайние точки дрожат на скруглённых порогом углах, прямые — нет.
+    """
+    pts = np.stack([xs, ys], axis=1).astype(np.float64)
+    lines = []
+    for i in range(4):
+        a, b = quad[i], quad[(i + 1) % 4]
+        d = b - a
+        length = float(np.hypot(*d))
+        if length < 8:
+            return quad
+        n = np.array([-d[1], d[0]]) / length
+        t = (pts - a) @ d / (length * length)
+        dist = np.abs((pts - a) @ n)
+        # Середина стороны, без углов; допуск — несколько пикселей от хорды
+        near = pts[(t > 0.1) & (t < 0.9) & (dist < max(3.0, length * 0.02))]
+        if len(near) < 8:
+            return quad
+        c = near.mean(axis=0)
+        # Направление прямой — главная ось облака точек
+        _, _, vt = np.linalg.svd(near - c, full_matrices=False)
+        lines.append((c, vt[0]))
+    out = []
+    for i in range(4):
+        (c1, d1), (c2, d2) = lines[i - 1], lines[i]
+        m = np.array([d1, -d2]).T
+        if abs(np.linalg.det(m)) < 1e-6:
+            return quad
+        t = np.linalg.solve(m, c2 - c1)
+        out.append(c1 + d1 * t[0])
+    out = np.array(out)
+    # Уточнение не должно уводить углы далеко от найденных
+    if np.abs(out - quad).max() > 0.05 * max(np.ptp(quad[:, 0]), np.ptp(quad[:, 1])):
+        return quad
+    return out
+
+
+def find_quad(img: Image.Image):
+    """
+    Углы листа [tl, tr, br, bl] в пикселях исходной картинки или None
+    """
+    k = ANALYSIS_SIDE / max(img.size)
+    small = img.convert('L')
+    if k < 1:
+        small = small.resize((max(1, round(img.width * k)), max(1, round(img.height * k))), Image.BILINEAR)
+    else:
+        k = 1.0
+    small = small.filter(ImageFilter.GaussianBlur(1))
+    gray = np.asarray(small)
+    h, w = gray.shape
+
+    mask = Image.fromarray(np.where(gray > _otsu(gray), 255, 0).astype(np.uint8), 'L')
+    # Размыкание убирает блики и тонкие перемычки между листом и светлыми предметами
+    mask = np.asarray(mask.filter(ImageFilter.MinFilter(5)).filter(ImageFilter.MaxFilter(5))) == 255
+    if not mask[h // 2, w // 2]:
+        return None
+    region = _component(mask, h // 2, w // 2)
+    if region.mean() < MIN_AREA_SHARE:
+        return None
+
+    # Контур области: пиксели, у которых есть сосед вне её
+    inner = region.copy()
+    inner[1:, :] &= region[:-1, :]
+    inner[:-1, :] &= region[1:, :]
+    inner[:, 1:] &= region[:, :-1]
+    inner[:, :-1] &= region[:, 1:]
+    ys, xs = np.nonzero(region & ~inner)
+    if len(xs) < 4:
+        return None
+    s, d = xs + ys, xs - ys
+    quad = np.array([
+        (xs[s.argmin()], ys[s.argmin()]),
+        (xs[d.argmax()], ys[d.argmax()]),
+        (xs[s.argmax()], ys[s.argmax()]),
+        (xs[d.argmin()], ys[d.argmin()]),
+    ], dtype=np.float64)
+    quad = _refine(quad, xs, ys)
+
+    if not _convex(quad) or _area(quad) < MIN_AREA_SHARE * w * h:
+        return None
+    frame = np.array([(0, 0), (w - 1, 0), (w - 1, h - 1), (0, h - 1)], dtype=np.float64)
+    if np.all(np.abs(quad - frame) <= FRAME_MARGIN * max(w, h)):
+        return None
+    grad = _gradient(gray)
+    if _edge_strength(grad, quad) < MIN_EDGE_CONTRAST * float(grad.mean()) + 1e-6:
+        return None
+    return quad / k
+
+
+def _perspective_coeffs(dst_size, quad: np.ndarray):
+    """Коэффициенты Image.PERSPECTIVE: точка результата -> точка исходника"""
+    w, h = dst_size
+    dst = [(0, 0), (w, 0), (w, h), (0, h)]
+    rows, rhs = [], []
+    for (x, y), (u, v) in zip(dst, quad):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        rhs.extend([u, v])
+    return np.linalg.solve(np.array(rows, dtype=np.float64), np.array(rhs, dtype=np.float64)).tolist()
+
+
+def warp(img: Image.Image, quad: np.ndarray) -> Image.Image:
+    """Четырёхугольник -> прямоугольник A4 (книжный или альбомный по сторонам листа)"""
+    side = lambda a, b: float(np.hypot(*(quad[a] - quad[b])))
+    width = max(side(0, 1), side(3, 2))
+    height = max(side(0, 3), side(1, 2))
+    if height >= width:
+        out_h = round(height)
+        out_w = round(out_h / A4_RATIO)
+    else:
+        out_w = round(width)
+        out_h = round(out_w / A4_RATIO)
+    return img.transform((out_w, out_h), Image.PERSPECTIVE, _perspective_coeffs((out_w, out_h), quad),
+                         Image.BILINEAR, fillcolor='white' if img.mode == 'RGB' else 255)
+
+
+def crop(img: Image.Image):
+    """(картинка, углы или None): лист не найден — картинка без изменений"""
+    quad = find_quad(img)
+    if quad is None:
+        return img, None
+    return warp(img, quad), quad
@@ -0,0 +1,79 @@
+"""
+Хранилище растровых страниц (фонов) на диске: PAGE_BLOB_DIR/<sha[:2]>/<sha>.<ext>.
+
+Файлы адресуются sha256 содержимого и неизменяемы, в черновике хранится
+ссылка /docs/blobs/<sha>.<ext>. mtime обновляется при каждом обращении —
+по нему prune() удаляет давно не используемые страницы.
+"""
+import hashlib
+import os
+import re
+import time
+import uuid
+
+from django.conf import settings
+
+BLOB_URL_RE = re.compile(r'/docs/blobs/([0-9a-f]{64})\.(jpg|png)$')
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+
+def path_for(sha: str, ext: str) -> str:
+    return os.path.join(settings.PAGE_BLOB_DIR, sha[:2], f'{sha}.{ext}')
+
+
+def put(data: bytes, ext: str) -> str:
+    sha = hashlib.sha256(data).hexdigest()
+    path = path_for(sha, ext)
+    if os.path.exists(path):
+        os.utime(path)
+        return sha
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{uuid.uuid4().hex}.part'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return sha
+
+
+def parse_url(src):
+    """(sha, ext) для ссылки на blob в bg_src или None"""
+    m = BLOB_URL_RE.search(src) if isinstance(src, str) and not src.startswith('data:') else None
+    return (m.group(1), m.group(2)) if m else None
+
+
+def resolve_page(page: dict) -> dict:
+    """
+    Страница для рендеринга: фон-blob передаётся путём к файлу (render читает
+    его сам). bg_path из черновика не доверяем — его присылает клиент; путь
+    ставится только по ссылке на blob и только внутри PAGE_BLOB_DIR.
+    """
+    page = {k: v for k, v in page.items() if k != 'bg_path'}
+    ref = parse_url(page.get('bg_src'))
+    if not ref:
+        return page
+    path = path_for(*ref)
+    root = os.path.realpath(settings.PAGE_BLOB_DIR)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        return page
+    try:
+        os.utime(path)
+    except OSError:
+        return page
+    return dict(page, bg_path=path)
+
+
+def prune(max_age_days=None) -> int:
+    """Удаляет blob-ы, к которым не обращались дольше PAGE_BLOB_TTL_DAYS"""
+    days = settings.PAGE_BLOB_TTL_DAYS if max_age_days is None else max_age_days
+    cutoff = time.time() - days * 86400
+    removed = 0
+    for dirpath, _, files in os.walk(settings.PAGE_BLOB_DIR):
+        for f in files:
+            p = os.path.join(dirpath, f)
+            try:
+                if os.stat(p).st_mtime < cutoff:
+                    os.remove(p)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    return removed
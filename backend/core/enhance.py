@@ -0,0 +1,212 @@
+"""
+Улучшение сканов страниц (в процессах core.workers).
+
+Режимы применяются в фиксированном порядке, независимо от порядка в запросе:
+
+- crop          — поиск листа на фото и выравнивание перспективы (core.autocrop);
+- deskew        — выравнивание наклона строк (до ±MAX_SKEW градусов);
+- shadows       — деление на оценку фона: убирает тени и неравномерный свет;
+- auto_contrast — растяжение яркости по перцентилям, оттенки сохраняются;
+- binarize      — адаптивная бинаризация Sauvola для текста (1 бит);
+- blank         — только проверка: почти нет «чернил» — страница пустая.
+
+Все операции — над массивом NumPy или фильтрами Pillow на всю страницу,
+без циклов по пикселям. Размеры страницы меняет только crop — вызывающий
+код пересчитывает по ним оверлеи. Модуль не зависит от Django.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+from . import autocrop, transcode
+
+MODES = ('crop', 'deskew', 'shadows', 'auto_contrast', 'binarize', 'blank')
+# Режимы, которые только проверяют страницу, не меняя её
+CHECKS = {'blank'}
+
+MAX_SKEW = 5.0
+# Ширина копии для оценки наклона и пустоты страницы
+ANALYSIS_WIDTH = 1000
+# Окно Sauvola — доля ширины страницы; k и R — параметры порога
+SAUVOLA_WINDOW = 1 / 40
+SAUVOLA_K = 0.2
+SAUVOLA_R = 128.0
+STATS_SCALE = 4
+# Доля тёмных пикселей (без полей), ниже которой страница пустая
+BLANK_INK_SHARE = 0.002
+BLANK_MARGIN = 0.05
+CONTRAST_CUTOFF = (0.5, 99.5)
+
+
+def normalize_modes(modes) -> list:
+    """Известные режимы в порядке применения"""
+    if not isinstance(modes, (list, tuple)):
+        return []
+    return [m for m in MODES if m in modes]
+
+
+def _small(img: Image.Image) -> Image.Image:
+    g = img.convert('L')
+    if g.width > ANALYSIS_WIDTH:
+        g = g.resize((ANALYSIS_WIDTH, max(1, round(g.height * ANALYSIS_WIDTH / g.width))), Image.BILINEAR)
+    return g
+
+
+def _box_stats(g: np.ndarray, r: int):
+    """Среднее и СКО в окне (2r+1)^2 через интегральные суммы"""
+    h, w = g.shape
+    pad = np.pad(g.astype(np.float64), r + 1, mode='edge')
+    s1 = pad.cumsum(0).cumsum(1)
+    s2 = (pad * pad).cumsum(0).cumsum(1)
+    y0, y1 = slice(0, h), slice(2 * r + 1, 2 * r + 1 + h)
+    x0, x1 = slice(0, w), slice(2 * r + 1, 2 * r + 1 + w)
+    n = float((2 * r + 1) ** 2)
+    mean = (s1[y1, x1] - s1[y0, x1] - s1[y1, x0] + s1[y0, x0]) / n
+    sq = (s2[y1, x1] - s2[y0, x1] - s2[y1, x0] + s2[y0, x0]) / n
+    return mean, np.sqrt(np.maximum(sq - mean * mean, 0))
+
+
+def _sauvola(gray: np.ndarray, window: int) -> np.ndarray:
+    """
+    Маска «чернил» (True — тёмный пиксель) по порогу Sauvola. Среднее и СКО
+    в окне меняются плавно, поэтому считаются на копии в STATS_SCALE раз
+    меньше и растягиваются обратно — порог сравнивается в полном разрешении.
+    """
+    h, w = gray.shape
+    k = STATS_SCALE if min(h, w) >= STATS_SCALE * 64 else 1
+    small = gray if k == 1 else np.asarray(Image.fromarray(gray).resize((w // k, h // k), Image.BOX))
+    mean, std = _box_stats(small, max(1, window // (2 * k)))
+    thr = (mean * (1 + SAUVOLA_K * (std / SAUVOLA_R - 1))).astype(np.float32)
+    if k > 1:
+        thr = np.asarray(Image.fromarray(thr, 'F').resize((w, h), Image.BILINEAR))
+    return gray < thr
+
+
+def skew_angle(img: Image.Image) -> float:
+    """
+    Наклон строк в градусах (положительный — против часовой): угол, при
+    котором горизонтальная проекция «чернил» самая контрастная.
+    """
+    small = np.asarray(_small(img))
+    ink = _sauvola(small, max(15, int(small.shape[1] * SAUVOLA_WINDOW)))
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > 200_000:
+        pick = np.random.default_rng(0).choice(len(ys), 200_000, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    ys = ys.astype(np.float64)
+    xs = xs.astype(np.float64) - small.shape[1] / 2
+
+    def score(angle):
+        t = np.deg2rad(angle)
+        rows = np.round(ys * np.cos(t) + xs * np.sin(t)).astype(np.int64)
+        rows -= rows.min()
+        hist = np.bincount(rows)
+        return float((hist.astype(np.float64) ** 2).sum())
+
+    best = max(np.arange(-MAX_SKEW, MAX_SKEW + 1e-9, 0.5), key=score)
+    best = max(np.arange(best - 0.5, best + 0.5 + 1e-9, 0.1), key=score)
+    return round(float(best), 2)
+
+
+def deskew(img: Image.Image, angle: float) -> Image.Image:
+    if abs(angle) < 0.1:
+        return img
+    fill = 255 if img.mode == 'L' else (255, 255, 255)
+    return img.rotate(-angle, Image.BILINEAR, expand=False, fillcolor=fill)
+
+
+def _divide_lut() -> np.ndarray:
+    """Таблица (пиксель << 8 | фон) -> пиксель / фон * 255"""
+    v = np.arange(256, dtype=np.float32)
+    return np.clip(v[:, None] * 255.0 / np.maximum(v[None, :], 1.0), 0, 255).astype(np.uint8).ravel()
+
+
+_DIVIDE_LUT = _divide_lut()
+
+
+def remove_shadows(img: Image.Image) -> Image.Image:
+    """Фон = размытый максимум (текст «закрашивается» бумагой); страница делится на фон"""
+    w, h = img.size
+    k = max(1, min(w, h) // 64)
+    bg = img.resize((max(1, w // k), max(1, h // k)), Image.BOX)
+    bg = bg.filter(ImageFilter.MaxFilter(7)).filter(ImageFilter.GaussianBlur(3))
+    bg = np.asarray(bg.resize((w, h), Image.BILINEAR), dtype=np.uint16)
+    idx = (np.asarray(img, dtype=np.uint16) << 8) | bg
+    return Image.fromarray(np.take(_DIVIDE_LUT, idx), img.mode)
+
+
+def auto_contrast(img: Image.Image) -> Image.Image:
+    """Один линейный сдвиг для всех каналов по перцентилям яркости"""
+    lo, hi = np.percentile(np.asarray(_small(img)), CONTRAST_CUTOFF)
+    if hi - lo < 8:
+        return img
+    lut = np.clip((np.arange(256, dtype=np.float32) - lo) * 255.0 / (hi - lo), 0, 255).astype(np.uint8)
+    return img.point(lut.tolist() * len(img.getbands()))
+
+
+def binarize(img: Image.Image) -> Image.Image:
+    gray = np.asarray(img.convert('L'))
+    ink = _sauvola(gray, max(15, int(gray.shape[1] * SAUVOLA_WINDOW)))
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), 'L').convert('1')
+
+
+def is_blank(img: Image.Image) -> bool:
+    small = np.asarray(_small(img))
+    h, w = small.shape
+    my, mx = int(h * BLANK_MARGIN), int(w * BLANK_MARGIN)
+    core = small[my:h - my, mx:w - mx]
+    # Тёмным считается то, что и ниже локального порога, и заметно темнее бумаги
+    ink = _sauvola(core, max(15, int(w * SAUVOLA_WINDOW))) & (core < np.percentile(core, 90) - 40)
+    return float(ink.mean()) < BLANK_INK_SHARE
+
+
+def apply(img: Image.Image, modes) -> tuple:
+    """
+    (картинка, info): info — {"crop": углы листа или None, "skew": градусы,
+    "blank": bool} для запрошенных режимов
+    """
+    modes = normalize_modes(modes)
+    info = {}
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGBA')
+        white = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(white, img).convert('RGB')
+    if 'crop' in modes:
+        img, quad = autocrop.crop(img)
+        info['crop'] = None if quad is None else [[round(float(x)), round(float(y))] for x, y in quad]
+    if 'deskew' in modes:
+        info['skew'] = skew_angle(img)
+        img = deskew(img, info['skew'])
+    if 'shadows' in modes:
+        img = remove_shadows(img)
+    if 'auto_contrast' in modes:
+        img = auto_contrast(img)
+    if 'blank' in modes:
+        info['blank'] = is_blank(img)
+    if 'binarize' in modes:
+        img = binarize(img)
+    return img, info
+
+
+def page(args):
+    """
+    args = (data, modes, quality) — закодированный фон страницы ->
+    (width, height, data, ext, info) или None, если это не картинка
+    """
+    data, modes, quality = args
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None
+    fmt = img.format
+    img, info = apply(img, modes)
+    if not set(normalize_modes(modes)) - CHECKS and fmt in ('JPEG', 'PNG'):
+        # Только проверки — фон не менялся, перекодировать нечего
+        return img.width, img.height, data, 'jpg' if fmt == 'JPEG' else 'png', info
+    out, ext, _ = transcode.encode(img, quality)
+    return img.width, img.height, out, ext, info
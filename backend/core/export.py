@@ -0,0 +1,281 @@
+"""
+Серверный экспорт черновика (DocumentDraft) в PDF и ZIP с JPG.
+
+Страницы рендерятся в пуле процессов (core.workers) по порядку. Если в
+черновике нет исходных PDF, файл пишется потоком прямо в ответ (память не
+зависит от числа страниц). Страницы с src_pdf берутся из исходного PDF как
+есть — с текстовым слоем и векторной графикой, а оверлеи дописываются
+поверх отдельным слоем. Бесплатные выгрузки (watermarked=True) рендерятся
+задачами core.watermark — со знаком поверх страницы. PDF с поиском
+(searchable=True) получает невидимый текст распознанных фонов (core.ocr);
+результат распознавания кэшируется по хэшу фона.
+"""
+import hashlib
+import io
+import itertools
+import shutil
+import tempfile
+import time
+import zipfile
+
+from django.conf import settings
+from django.core.cache import cache
+from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf.generic import RectangleObject
+
+from . import blobs, ocr, render, watermark, workers
+from .models import SourceDocument
+from .pdfwriter import PdfStreamWriter, single_page_pdf
+
+JPG_DPI_RANGE = (72, 300)
+JPG_QUALITY_RANGE = (50, 95)
+# Допустимое расхождение пропорций исходной страницы и фона в редакторе
+SOURCE_ASPECT_TOLERANCE = 0.02
+STREAM_CHUNK = 256 * 1024
+
+
+def draft_snapshot(user):
+    """Актуальный snapshot черновика пользователя или None"""
+    d = getattr(user, 'document_draft', None)
+    if not d or d.is_expired():
+        return None
+    data = d.data or {}
+    return data if isinstance(data.get('pages'), list) else None
+
+
+def font_dirs() -> tuple:
+    return tuple(str(p) for p in getattr(settings, 'EXPORT_FONT_DIRS', ()))
+
+
+def _source_ref(page: dict):
+    ref = page.get('src_pdf')
+    if not isinstance(ref, dict) or not ref.get('sha'):
+        return None
+    try:
+        return str(ref['sha']), int(ref.get('index') or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class SourceError(ValueError):
+    pass
+
+
+def save_source(user, data: bytes, name='') -> SourceDocument:
+    """
+    Сохраняет исходный PDF пользователя (повторная загрузка того же файла —
+    та же запись). Хранятся только последние SOURCE_KEEP_PER_USER файлов.
+    """
+    sha = hashlib.sha256(data).hexdigest()
+    obj = SourceDocument.objects.filter(user=user, sha256=sha).defer('data').first()
+    if obj:
+        return obj
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        if reader.is_encrypted and not reader.decrypt(''):
+            raise SourceError('PDF защищён паролем')
+        pages = len(reader.pages)
+    except SourceError:
+        raise
+    except Exception:
+        raise SourceError('Файл не похож на PDF')
+    if not pages:
+        raise SourceError('В PDF нет страниц')
+
+    obj, _ = SourceDocument.objects.get_or_create(
+        user=user, sha256=sha,
+        defaults={'name': name[:200], 'size': len(data), 'pages': pages, 'data': data},
+    )
+    keep = SourceDocument.objects.filter(user=user).values_list('id', flat=True)[:settings.SOURCE_KEEP_PER_USER]
+    SourceDocument.objects.filter(user=user).exclude(id__in=list(keep)).delete()
+    return obj
+
+
+def source_shas(user, snapshot: dict) -> set:
+    """sha256 исходных PDF пользователя, на которые ссылаются страницы (без загрузки данных)"""
+    shas = {r[0] for r in (_source_ref(p) for p in snapshot['pages']) if r}
+    if not shas:
+        return set()
+    return set(SourceDocument.objects.filter(user=user, sha256__in=shas).values_list('sha256', flat=True))
+
+
+def load_sources(user, snapshot: dict) -> dict:
+    """{sha: PdfReader} для исходных PDF, на которые ссылаются страницы"""
+    shas = {r[0] for r in (_source_ref(p) for p in snapshot['pages']) if r}
+    if not shas:
+        return {}
+    rows = SourceDocument.objects.filter(user=user, sha256__in=shas).values_list('sha256', 'data')
+    out = {}
+    for sha, data in rows:
+        try:
+            reader = PdfReader(io.BytesIO(bytes(data)))
+            if reader.is_encrypted:
+                reader.decrypt('')
+        except Exception:
+            continue
+        out[sha] = reader
+    return out
+
+
+def _source_page(page: dict, sources: dict):
+    """Исходная страница PDF для страницы черновика, если её можно использовать"""
+    ref = _source_ref(page)
+    reader = sources.get(ref[0]) if ref else None
+    if reader is None or not 0 <= ref[1] < len(reader.pages):
+        return None
+    src = reader.pages[ref[1]]
+    box = src.cropbox
+    w, h = float(box.width), float(box.height)
+    if (src.rotation or 0) % 180:
+        w, h = h, w
+    doc_w, doc_h = render.number(page.get('docWidth'), 0, 0), render.number(page.get('docHeight'), 0, 0)
+    if w <= 0 or h <= 0 or doc_w <= 0 or doc_h <= 0:
+        return None
+    # Фон в редакторе — эта же страница при PDF_RENDER_SCALE; иначе страницу подменили
+    if abs((doc_w / doc_h) / (w / h) - 1) > SOURCE_ASPECT_TOLERANCE:
+        return None
+    return src, doc_w / w
+
+
+def _noop(done):
+    pass
+
+
+def ocr_binary():
+    return settings.OCR_BINARY or shutil.which('tesseract')
+
+
+def _ocr_key(page: dict):
+    """Ключ кэша распознавания: хэш фона (для blob-а — из ссылки, без чтения файла)"""
+    src = page.get('bg_src')
+    if not isinstance(src, str) or not src:
+        return None
+    ref = blobs.parse_url(src)
+    sha = ref[0] if ref else hashlib.sha256(src.encode('utf-8')).hexdigest()
+    return f'ocr:{sha}:{settings.OCR_LANGS}'
+
+
+def _ocr_results(pages: list, skip=()):
+    """
+    Результаты core.ocr.recognize по порядку страниц (None — без текста).
+    Из кэша берутся сразу, остальные фоны распознаются в пуле параллельно
+    с рендерингом страниц.
+    """
+    keys = [None if i in skip else _ocr_key(p) for i, p in enumerate(pages)]
+    done = cache.get_many([k for k in keys if k])
+    binary, langs, timeout = ocr_binary(), settings.OCR_LANGS, settings.OCR_TIMEOUT
+    fresh = workers.imap(ocr.recognize, (
+        (blobs.resolve_page(p), binary, langs, timeout)
+        for p, k in zip(pages, keys) if k and k not in done
+    ))
+    ttl = settings.PAGE_BLOB_TTL_DAYS * 86400
+    for key in keys:
+        if not key:
+            yield None
+        elif key in done:
+            yield done[key]
+        else:
+            res = next(fresh)
+            if res is not None:
+                cache.set(key, res, ttl)
+            yield res
+
+
+def iter_pdf(snapshot: dict, title='', sources=None, progress=_noop, watermarked=False, searchable=False):
+    """Генератор кусков PDF-файла; progress(n) — после каждой готовой страницы"""
+    page_job = watermark.pdf_page if watermarked else render.pdf_page
+    if sources:
+        yield from _iter_pdf_stamped(snapshot, title, sources, progress, page_job, searchable)
+        return
+    writer = PdfStreamWriter(title)
+    yield writer.header()
+    fonts = font_dirs()
+    pages = snapshot['pages']
+    jobs = ((blobs.resolve_page(p), fonts, {}) for p in pages)
+    texts = _ocr_results(pages) if searchable else itertools.repeat(None)
+    for i, (page, spec, text) in enumerate(zip(pages, workers.imap(page_job, jobs), texts), 1):
+        yield writer.add_page(ocr.apply(spec, text, page))
+        progress(i)
+    yield writer.close()
+
+
+def _iter_pdf_stamped(snapshot: dict, title: str, sources: dict, progress=_noop, page_job=render.pdf_page,
+                      searchable=False):
+    fonts = font_dirs()
+    pages = snapshot['pages']
+    srcs = [_source_page(p, sources) for p in pages]
+    jobs = (
+        (blobs.resolve_page(p), fonts, {'background': False, 'px_per_pt': s[1]} if s else {})
+        for p, s in zip(pages, srcs)
+    )
+    # Исходные страницы PDF остаются со своим текстом — распознаются только растровые
+    skip = {i for i, s in enumerate(srcs) if s}
+    texts = _ocr_results(pages, skip) if searchable else itertools.repeat(None)
+    writer = PdfWriter()
+    for i, (page, src, spec, text) in enumerate(zip(pages, srcs, workers.imap(page_job, jobs), texts), 1):
+        progress(i)
+        spec = ocr.apply(spec, text, page)
+        layer = PdfReader(io.BytesIO(single_page_pdf(spec))).pages[0]
+        if src is None:
+            writer.add_page(layer)
+            continue
+        out = writer.add_page(src[0])
+        out.transfer_rotation_to_content()
+        box = out.cropbox
+        k = src[1]
+        _, _, page_w, _, left, _ = render.page_box(page)
+        # Поворот страницы в редакторе меняет ширину листа относительно центра
+        llx, lly = float(box.left) + left / k, float(box.bottom)
+        if page_w != render.number(page.get('docWidth'), 0, 0):
+            out.mediabox = out.cropbox = RectangleObject([llx, lly, llx + page_w / k, float(box.top)])
+        if spec.images:
+            out.merge_transformed_page(layer, Transformation().translate(llx, lly))
+    writer.add_metadata({'/Title': title, '/Producer': 'ScannyRF'})
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as f:
+        writer.write(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+class _ZipSink:
+    """Поток только на запись: zipfile пишет в него, генератор забирает готовые байты"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        out = b''.join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def iter_jpg_zip(snapshot: dict, name: str, dpi=200, quality=85, progress=_noop, watermarked=False):
+    """
+    Генератор кусков ZIP со страницами в JPEG. Страницы рендерятся в пуле
+    и пишутся в архив по порядку, как только готовы (без сжатия — JPEG уже сжат).
+    """
+    scale = dpi / (72 * render.PX_PER_PT)
+    fonts = font_dirs()
+    jobs = ((blobs.resolve_page(p), fonts, scale, quality) for p in snapshot['pages'])
+    sink = _ZipSink()
+    stamp = time.localtime()[:6]
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+        page_job = watermark.jpg_page if watermarked else render.jpg_page
+        for i, data in enumerate(workers.imap(page_job, jobs), 1):
+            zf.writestr(zipfile.ZipInfo(f'{name}-p{i}.jpg', stamp), data)
+            yield sink.take()
+            progress(i)
+    yield sink.take()
@@ -0,0 +1,122 @@
+"""
+Кэш готовых выгрузок на локальном диске.
+
+Ключ — sha256 от содержимого страниц черновика, имени файла, формата и
+параметров экспорта (и хэшей исходных PDF): повторная выгрузка того же
+документа отдаётся файлом без рендеринга. Размер каталога ограничен
+EXPORT_CACHE_MAX_BYTES, вытесняются давно не читанные файлы (mtime
+обновляется при каждом попадании).
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+# Меняется вместе с форматом результата рендеринга — старые файлы перестают совпадать
+CACHE_VERSION = 1
+TOKEN_SALT = 'core.export_cache'
+TOKEN_MAX_AGE = 24 * 3600
+EXTENSIONS = {'pdf': 'pdf', 'jpg': 'zip'}
+
+
+def _dir() -> str:
+    return settings.EXPORT_CACHE_DIR
+
+
+def cache_key(kind: str, snapshot: dict, name: str, params=None, source_shas=()) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(
+        [CACHE_VERSION, kind, name, params or {}, sorted(source_shas)],
+        sort_keys=True, ensure_ascii=False,
+    ).encode('utf-8'))
+    for page in snapshot.get('pages') or []:
+        h.update(json.dumps(page, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    return h.hexdigest()
+
+
+def path_for(key: str, kind: str) -> str:
+    return os.path.join(_dir(), f'{key}.{EXTENSIONS[kind]}')
+
+
+def lookup(key: str, kind: str):
+    """Путь к файлу из кэша или None; попадание продлевает жизнь файла"""
+    path = path_for(key, kind)
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+
+def iter_store(key: str, kind: str, chunks):
+    """
+    Пропускает куски выгрузки насквозь, параллельно записывая их в кэш.
+    Файл появляется в кэше, только если генератор дочитан до конца.
+    """
+    os.makedirs(_dir(), exist_ok=True)
+    path = path_for(key, kind)
+    tmp = f'{path}.{uuid.uuid4().hex}.part'
+    done = False
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp, path)
+        done = True
+    finally:
+        if not done and os.path.exists(tmp):
+            os.remove(tmp)
+    evict()
+
+
+def evict(max_bytes=None) -> int:
+    """Удаляет самые давние файлы, пока каталог больше лимита; возвращает число удалённых"""
+    limit = settings.EXPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        entries = [e for e in os.scandir(_dir()) if e.is_file() and not e.name.endswith('.part')]
+    except FileNotFoundError:
+        return 0
+    stats = []
+    for e in entries:
+        try:
+            st = e.stat()
+        except FileNotFoundError:
+            continue
+        stats.append((st.st_mtime, st.st_size, e.path))
+    total = sum(s for _, s, _ in stats)
+    removed = 0
+    for _, size, path in sorted(stats):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.info('Export cache: evicted %d files', removed)
+    return removed
+
+
+def download_token(user, key: str, kind: str, name: str) -> str:
+    """Подписанная ссылка на файл из кэша для докачки (Range) этим пользователем"""
+    return signing.dumps({'u': user.pk, 'k': key, 't': kind, 'n': name}, salt=TOKEN_SALT, compress=True)
+
+
+def parse_token(user, token: str):
+    """(key, kind, name) или None, если подпись неверна, устарела или ссылка чужая"""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if data.get('u') != user.pk or data.get('t') not in EXTENSIONS:
+        return None
+    return data['k'], data['t'], data.get('n') or 'document'
@@ -0,0 +1,245 @@
+"""
+Очередь фоновых выгрузок (ExportJob).
+
+Веб-процесс только ставит задачу (квота списывается сразу), воркер
+manage.py run_export_jobs забирает задачи под SKIP LOCKED и рендерит их
+в пуле core.workers — одновременно задач не больше, чем запущено воркеров.
+Прогресс уходит в группу channels пользователя (EditorConsumer отправляет
+клиенту export_progress / export_done); без Redis-слоя события до
+браузера не дойдут, остаётся опрос GET /export/jobs/<id>/.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import export, export_cache
+from .models import ExportJob, Operation, Subscription
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = ('queued', 'running')
+MAX_ATTEMPTS = 3
+# Задача running без пульса дольше этого — воркер умер, задача возвращается в очередь
+STALE_AFTER = timedelta(minutes=5)
+# Не чаще одного события прогресса за интервал (с)
+PROGRESS_INTERVAL = 0.5
+# Пульс running-задачи независимо от прогресса (с), заметно чаще STALE_AFTER
+HEARTBEAT_INTERVAL = 30
+
+
+def user_group(user_id) -> str:
+    return f'export_user_{user_id}'
+
+
+def _notify(user_id, message: dict):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(user_group(user_id), message)
+    except Exception as e:
+        logger.warning('Export job notify failed: %s', e)
+
+
+def job_dict(job: ExportJob) -> dict:
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'pages': job.pages,
+        'done_pages': job.done_pages,
+        'size': job.size,
+        'error': job.error,
+        'doc_name': job.doc_name,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'download_url': f'/export/jobs/{job.id}/download/' if job.status == 'done' else None,
+    }
+
+
+def active_count(user) -> int:
+    return ExportJob.objects.filter(user=user, status__in=ACTIVE).count()
+
+
+def file_name(job: ExportJob) -> str:
+    return f"{job.doc_name or 'document'}.{'zip' if job.kind == 'jpg' else 'pdf'}"
+
+
+def refund(operation_id, subscription_id):
+    """Возврат списания (core.views._charge_download) за невыполненную выгрузку"""
+    if operation_id:
+        Operation.objects.filter(pk=operation_id).delete()
+    if subscription_id:
+        Subscription.objects.filter(pk=subscription_id).update(downloads_left=F('downloads_left') + 1)
+
+
+def _refund(job: ExportJob):
+    refund(job.operation_id, job.subscription_id)
+    job.operation = job.subscription = None
+
+
+def _owned(job: ExportJob):
+    """
+    Задача всё ещё за этим воркером: running с тем же номером попытки. Если её
+    успели вернуть в очередь и взять заново, attempts уже другой.
+    """
+    return ExportJob.objects.filter(pk=job.pk, status='running', attempts=job.attempts)
+
+
+def _finish(job: ExportJob, status: str, error='') -> bool:
+    """Сохраняет итог задачи; False — задачу перехватил другой воркер, итог отброшен"""
+    fields = ['status', 'error', 'finished_at', 'snapshot', 'done_pages', 'size', 'file_path', 'expires_at']
+    with transaction.atomic():
+        if not _owned(job).select_for_update().exists():
+            logger.warning('Export job %s: attempt %s lost its lease, result dropped', job.id, job.attempts)
+            return False
+        job.status = status
+        job.error = error[:2000]
+        job.finished_at = timezone.now()
+        job.snapshot = {}
+        if status == 'failed':
+            _refund(job)
+            fields += ['operation', 'subscription']
+        job.save(update_fields=fields)
+    _notify(job.user_id, {'type': 'export.done', 'job': job_dict(job)})
+    return True
+
+
+def claim():
+    """Следующая задача из очереди (помечается running) или None"""
+    with transaction.atomic():
+        job = (
+            ExportJob.objects.select_for_update(skip_locked=True)
+            .filter(status='queued').order_by('created_at', 'id').first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.heartbeat_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'heartbeat_at'])
+    return job
+
+
+def _heartbeat(job: ExportJob, stop: threading.Event):
+    """
+    Пульс задачи, пока идёт process: сборка PDF с исходными страницами
+    (compress_identical_objects, write) после последней страницы может идти
+    дольше STALE_AFTER, а прогресса в это время нет.
+    """
+    try:
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            _owned(job).update(heartbeat_at=timezone.now())
+    finally:
+        connection.close()
+
+
+def _render(job: ExportJob, tmp: str, progress):
+    snap, name = job.snapshot, job.doc_name or 'document'
+    key = export_cache.cache_key(job.kind, snap, name, job.params, export.source_shas(job.user, snap))
+    cached = export_cache.lookup(key, job.kind)
+    if cached:
+        try:
+            shutil.copyfile(cached, tmp)
+            return
+        except FileNotFoundError:
+            # Вытеснен из кэша после lookup — рендерим заново
+            pass
+    watermarked = bool(job.params.get('watermark'))
+    if job.kind == 'jpg':
+        chunks = export.iter_jpg_zip(
+            snap, name, job.params.get('dpi') or 200, job.params.get('quality') or 85,
+            progress=progress, watermarked=watermarked,
+        )
+    else:
+        chunks = export.iter_pdf(
+            snap, name, export.load_sources(job.user, snap), progress=progress, watermarked=watermarked,
+            searchable=bool(job.params.get('searchable')),
+        )
+    with open(tmp, 'wb') as f:
+        for chunk in export_cache.iter_store(key, job.kind, chunks):
+            f.write(chunk)
+
+
+def process(job: ExportJob):
+    """Рендерит задачу в файл EXPORT_JOB_DIR/<id>.<ext>"""
+    os.makedirs(settings.EXPORT_JOB_DIR, exist_ok=True)
+    ext = 'zip' if job.kind == 'jpg' else 'pdf'
+    path = os.path.join(settings.EXPORT_JOB_DIR, f'{job.id}.{ext}')
+    # У каждой попытки свой временный файл: перехваченная задача не портит чужой
+    tmp = f'{path}.{uuid.uuid4().hex}.part'
+    last = [0.0]
+
+    def progress(done):
+        job.done_pages = done
+        now = time.monotonic()
+        if now - last[0] < PROGRESS_INTERVAL and done < job.pages:
+            return
+        last[0] = now
+        _owned(job).update(done_pages=done, heartbeat_at=timezone.now())
+        _notify(job.user_id, {'type': 'export.progress', 'job': job.id, 'done': done, 'total': job.pages})
+
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job, stop), daemon=True)
+    beat.start()
+    try:
+        _render(job, tmp, progress)
+    except Exception as e:
+        logger.exception('Export job %s failed', job.id)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _finish(job, 'failed', str(e) or e.__class__.__name__)
+        return
+    finally:
+        stop.set()
+        beat.join()
+
+    # Файл той же задачи: если попытку перехватили, победитель перезапишет его таким же
+    os.replace(tmp, path)
+    job.file_path = path
+    job.size = os.path.getsize(path)
+    job.done_pages = job.pages
+    job.expires_at = timezone.now() + timedelta(hours=settings.EXPORT_JOB_TTL_HOURS)
+    _finish(job, 'done')
+
+
+def requeue_stale() -> int:
+    """Возвращает в очередь задачи упавших воркеров (или завершает их ошибкой)"""
+    n = 0
+    cutoff = timezone.now() - STALE_AFTER
+    with transaction.atomic():
+        stale = list(
+            ExportJob.objects.select_for_update(skip_locked=True)
+            .filter(status='running', heartbeat_at__lt=cutoff)
+        )
+    for job in stale:
+        if job.attempts >= MAX_ATTEMPTS:
+            _finish(job, 'failed', 'Выгрузка прервана')
+        else:
+            _owned(job).filter(heartbeat_at__lt=cutoff).update(status='queued')
+        n += 1
+    return n
+
+
+def cleanup() -> int:
+    """Удаляет файлы просроченных выгрузок"""
+    n = 0
+    for job in ExportJob.objects.filter(status='done', expires_at__lt=timezone.now()):
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+        job.status = 'expired'
+        job.file_path = ''
+        job.save(update_fields=['status', 'file_path'])
+        n += 1
+    return n
@@ -0,0 +1,262 @@
+"""
+Загрузка документов в редактор через сервер.
+
+Исходный файл сохраняется один раз (PDF — в SourceDocument для векторного
+экспорта), страницы растрируются в пуле core.workers и кладутся в хранилище
+blob-ов на диске (PAGE_BLOB_DIR) по sha256 содержимого. В черновик
+попадают ссылки /docs/blobs/<sha>.<ext>, а не data URL: клиент не
+пересылает декодированные страницы обратно на сервер. DOCX/XLS/XLSX
+сначала конвертируются в PDF пулом LibreOffice (core.office).
+
+Страницы, разобранные в браузере, приходят при сохранении черновика как
+PNG data URL — offload_backgrounds перекодирует их (core.transcode) и
+тоже переносит в blob-ы. apply_enhancements строит улучшенные фоны
+(core.enhance) по режимам, запрошенным в page["enhance"]["modes"].
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs, enhance, export, office, rasterize, render, transcode, workers
+from .models import DocumentDraft
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png')
+
+
+class IngestError(ValueError):
+    pass
+
+
+def _page(width, height, sha, ext, base_url, src_pdf=None) -> dict:
+    return {
+        'id': f'p_{uuid.uuid4().hex[:16]}',
+        'docWidth': width,
+        'docHeight': height,
+        'rotation': 0,
+        'bg_src': f'{base_url}/docs/blobs/{sha}.{ext}',
+        'src_pdf': src_pdf,
+        'overlays': [],
+    }
+
+
+def _pdf_pages(user, data: bytes, name: str, base_url: str):
+    src = export.save_source(user, data, name)
+    if src.pages > settings.EXPORT_MAX_PAGES:
+        raise IngestError(f'Не больше {settings.EXPORT_MAX_PAGES} страниц в документе')
+    # Процессы пула читают PDF с диска, а не получают его копию на каждую страницу
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+        f.write(data)
+        f.flush()
+        jobs = ((f.name, i, rasterize.PDF_RENDER_SCALE, rasterize.JPEG_QUALITY) for i in range(src.pages))
+        pages = []
+        try:
+            for i, (w, h, out, ext) in enumerate(workers.imap(rasterize.pdf_page, jobs)):
+                pages.append(_page(w, h, blobs.put(out, ext), ext, base_url, {'sha': src.sha256, 'index': i}))
+        except rasterize.PageTooLarge:
+            raise IngestError('Слишком большой размер страницы PDF')
+    return pages
+
+
+def _image_pages(data: bytes, base_url: str):
+    try:
+        w, h, out, ext = workers.run(rasterize.image, (data, rasterize.JPEG_QUALITY))
+    except Exception:
+        raise IngestError('Не удалось прочитать изображение')
+    return [_page(w, h, blobs.put(out, ext), ext, base_url)]
+
+
+def _append_to_draft(user, pages: list, client_id: str, name: str, ttl_hours: int) -> int:
+    with transaction.atomic():
+        draft = DocumentDraft.objects.select_for_update().filter(user=user).first()
+        data = (draft.data if draft and not draft.is_expired() else None) or {}
+        if not isinstance(data.get('pages'), list):
+            data = {'client_id': client_id, 'name': name, 'pages': []}
+        data['pages'].extend(pages)
+        data.setdefault('client_id', client_id)
+        if not data.get('name'):
+            data['name'] = name
+        DocumentDraft.objects.update_or_create(
+            user=user, defaults={'data': data, 'expires_at': timezone.now() + timedelta(hours=ttl_hours)},
+        )
+    return len(data['pages'])
+
+
+def ingest(user, upload, base_url: str, client_id='', name='', ttl_hours=24, enhance_modes=()) -> dict:
+    """
+    Загруженный файл -> новые страницы в конце черновика пользователя
+    (черновик продлевается на ttl_hours), с улучшением enhance_modes.
+    Возвращает {"pages": [...], "total": n} — n страниц в черновике.
+    """
+    ext = os.path.splitext(upload.name or '')[1].lower().lstrip('.')
+    if upload.size > settings.SOURCE_MAX_BYTES:
+        raise IngestError('Файл слишком большой')
+    data = upload.read()
+    name = (name or os.path.splitext(upload.name or '')[0] or 'document')[:200]
+    if ext == 'pdf':
+        try:
+            pages = _pdf_pages(user, data, upload.name or '', base_url)
+        except export.SourceError as e:
+            raise IngestError(str(e))
+    elif ext in office.OFFICE_EXTENSIONS:
+        try:
+            pdf = office.to_pdf(data, ext)
+            pages = _pdf_pages(user, pdf, f'{name}.pdf', base_url)
+        except (office.ConversionError, export.SourceError) as e:
+            raise IngestError(str(e))
+    elif ext in IMAGE_EXTENSIONS:
+        pages = _image_pages(data, base_url)
+    else:
+        raise IngestError('Поддерживаются PDF, DOCX, XLS, XLSX, JPG и PNG')
+    modes = enhance.normalize_modes(list(enhance_modes))
+    if modes:
+        for page in pages:
+            page['enhance'] = {'modes': modes}
+        apply_enhancements(pages, base_url)
+    total = _append_to_draft(user, pages, client_id, name, ttl_hours)
+    return {'pages': pages, 'total': total}
+
+
+def offload_backgrounds(pages: list, base_url: str) -> dict:
+    """
+    data URL фонов -> blob-ы в формате по содержимому, bg_src заменяется ссылкой
+    (страницы меняются на месте). Возвращает отчёт:
+    {"pages": [{"id", "kind", "before", "after"}], "bytes_before", "bytes_after", "urls": {id: url}}
+    """
+    report = {'pages': [], 'bytes_before': 0, 'bytes_after': 0, 'urls': {}}
+    todo = []
+    for page in pages:
+        data = render.decode_data_url(page.get('bg_src')) if isinstance(page, dict) else None
+        if data:
+            todo.append((page, data, 'bg:' + hashlib.sha256(data).hexdigest()))
+    if not todo:
+        return report
+
+    # Клиент шлёт те же data URL при каждом сохранении, пока не подставит ссылки:
+    # готовый результат находится по хэшу входа без перекодирования
+    done = cache.get_many([key for _, _, key in todo])
+    fresh = [(page, data, key) for page, data, key in todo
+             if key not in done or not os.path.exists(blobs.path_for(*done[key][:2]))]
+    jobs = ((data, transcode.PHOTO_QUALITY) for _, data, _ in fresh)
+    ttl = settings.PAGE_BLOB_TTL_DAYS * 86400
+    for (page, data, key), res in zip(fresh, workers.imap(transcode.page, jobs)):
+        if res is None:
+            continue
+        _, _, out, ext, kind = res
+        done[key] = (blobs.put(out, ext), ext, kind, len(out))
+        cache.set(key, done[key], ttl)
+
+    for page, data, key in todo:
+        if key not in done:
+            continue
+        sha, ext, kind, size = done[key]
+        page['bg_src'] = f'{base_url}/docs/blobs/{sha}.{ext}'
+        report['urls'][page.get('id')] = page['bg_src']
+        report['pages'].append({'id': page.get('id'), 'kind': kind, 'before': len(data), 'after': size})
+        report['bytes_before'] += len(data)
+        report['bytes_after'] += size
+    if report['pages']:
+        logger.info('Draft backgrounds offloaded: %d pages, %d -> %d bytes',
+                    len(report['pages']), report['bytes_before'], report['bytes_after'])
+    return report
+
+
+def _size(value):
+    """[w, h] из черновика (клиентские данные) или None, если это не два положительных числа"""
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        return None
+    w, h = (render.number(v, 0, 0) for v in value)
+    return [w, h] if w > 0 and h > 0 else None
+
+
+def _resize_page(page: dict, width, height):
+    """Новые размеры документа страницы; центры оверлеев сдвигаются пропорционально"""
+    old_w = render.number(page.get('docWidth'), 0, 0) or width
+    old_h = render.number(page.get('docHeight'), 0, 0) or height
+    for ov in page.get('overlays') or []:
+        if isinstance(ov, dict):
+            ov['cx'] = render.number(ov.get('cx')) * width / old_w
+            ov['cy'] = render.number(ov.get('cy')) * height / old_h
+    page['docWidth'], page['docHeight'] = width, height
+
+
+def apply_enhancements(pages: list, base_url: str) -> dict:
+    """
+    Страницы, у которых запрошенные режимы page["enhance"]["modes"] отличаются
+    от применённых ("applied"), получают фон, пересчитанный из исходного
+    ("orig"); пустой список режимов возвращает исходный фон. Результат
+    кэшируется по хэшу исходного фона и режимам. Если фон сменил размер
+    (crop), исходный размер хранится в "orig_size" и возвращается вместе
+    с фоном. Страницы меняются на месте, возвращает {id: page} изменённых.
+    Состояние присылает клиент: applied и orig_size неверной формы отбрасываются.
+    """
+    changed, todo = {}, []
+    for page in pages:
+        state = page.get('enhance') if isinstance(page, dict) else None
+        if not isinstance(state, dict):
+            continue
+        modes = enhance.normalize_modes(state.get('modes'))
+        applied = enhance.normalize_modes(state.get('applied'))
+        orig_size = _size(state.get('orig_size'))
+        # Клиент мог прислать старый фон вместе с уже применённым состоянием
+        stale = bool(set(applied) - enhance.CHECKS) and page.get('bg_src') == state.get('orig')
+        if modes == applied and not stale:
+            continue
+        orig = state.get('orig') or page.get('bg_src')
+        if not modes:
+            # Возврат к исходнику, в том числе к векторной странице PDF
+            page['bg_src'] = orig
+            page['src_pdf'] = state.get('src_pdf') or page.get('src_pdf')
+            if orig_size:
+                _resize_page(page, *orig_size)
+            page['enhance'] = {'modes': []}
+            changed[page.get('id')] = page
+            continue
+        data = render.page_background(blobs.resolve_page({'bg_src': orig}))
+        if data:
+            key = f'enhance:{hashlib.sha256(data).hexdigest()}:{",".join(modes)}'
+            todo.append((page, state, orig, orig_size, modes, data, key))
+    if not todo:
+        return changed
+
+    done = cache.get_many([t[-1] for t in todo])
+    fresh = [t for t in todo if t[-1] not in done or not os.path.exists(blobs.path_for(*done[t[-1]][:2]))]
+    jobs = ((data, modes, transcode.PHOTO_QUALITY) for *_, modes, data, _ in fresh)
+    ttl = settings.PAGE_BLOB_TTL_DAYS * 86400
+    for t, res in zip(fresh, workers.imap(enhance.page, jobs)):
+        if res is None:
+            continue
+        w, h, out, ext, info = res
+        done[t[-1]] = (blobs.put(out, ext), ext, info, w, h)
+        cache.set(t[-1], done[t[-1]], ttl)
+
+    for page, state, orig, orig_size, modes, data, key in todo:
+        if key not in done:
+            continue
+        sha, ext, info, w, h = done[key]
+        src_pdf = state.get('src_pdf') or page.get('src_pdf')
+        page['bg_src'] = f'{base_url}/docs/blobs/{sha}.{ext}'
+        page['enhance'] = {'modes': modes, 'applied': modes, 'orig': orig, **info}
+        if info.get('crop'):
+            # Размер исходного фона — до первого изменения, повторные режимы считаются от него же
+            size = orig_size or _size([page.get('docWidth'), page.get('docHeight')])
+            if size:
+                page['enhance']['orig_size'] = size
+            _resize_page(page, w, h)
+        elif orig_size:
+            _resize_page(page, *orig_size)
+        if set(modes) - enhance.CHECKS:
+            # Фон изменён: экспорт должен брать его, а не исходную векторную страницу
+            page['enhance']['src_pdf'] = src_pdf
+            page['src_pdf'] = None
+        changed[page.get('id')] = page
+    return changed
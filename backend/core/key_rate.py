@@ -0,0 +1,195 @@
+"""
+Ключевая ставка ЦБ: хранение истории в БД, фоновое обновление и чтение из кэша.
+
+Запросы пользователей (KeyRateView) никогда не ходят в сеть: читают кэш/БД,
+а устаревшие данные обновляются в фоне. Одновременно ЦБ опрашивает только
+один процесс (флаг в кэше), запись в БД идёт под advisory-lock PostgreSQL.
+"""
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import outbound
+from .models import KeyRate
+
+logger = logging.getLogger(__name__)
+
+# Ставка действует с 13.09.2013 — раньше истории нет
+HISTORY_START = date(2013, 9, 13)
+FALLBACK_RATE = 16.0
+# Через сколько данные считаются устаревшими и запускается фоновое обновление
+STALE_AFTER = timedelta(hours=6)
+LATEST_CACHE_KEY = 'core:key_rate:latest'
+LATEST_CACHE_TTL = 300
+HISTORY_CACHE_KEY = 'core:key_rate:history'
+HISTORY_CACHE_TTL = 3600
+_LOCK_ID = 0x4B455952  # 'KEYR' — ключ advisory-lock
+REFRESH_LOCK_KEY = 'core:key_rate:refreshing'
+# С запасом на оба запроса к ЦБ (таймаут чтения 30 с); флаг снимается и раньше
+REFRESH_LOCK_TTL = 120
+
+_bg_lock = threading.Lock()
+_bg_running = False
+
+
+def _parse_date(s: str) -> date:
+    return datetime.fromisoformat(s.strip()[:10]).date()
+
+
+def fetch_current():
+    """Текущая ставка из JSON-фида: (date, Decimal)"""
+    j = outbound.get_json('cbr', settings.CBR_KEY_RATE_URL)
+    return _parse_date(j.get('date') or timezone.localdate().isoformat()), Decimal(str(j['keyRate']))
+
+
+def fetch_history(start: date, end: date):
+    """Дневные значения ставки за период из SOAP-сервиса ЦБ: [(date, Decimal), ...] по возрастанию"""
+    body = (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+        '<KeyRateXML xmlns="http://web.cbr.ru/">'
+        f'<fromDate>{start:%Y-%m-%d}T00:00:00</fromDate><ToDate>{end:%Y-%m-%d}T00:00:00</ToDate>'
+        '</KeyRateXML></soap:Body></soap:Envelope>'
+    )
+    resp = outbound.request(
+        'cbr', 'POST', settings.CBR_DAILY_INFO_URL, data=body.encode('utf-8'),
+        headers={'Content-Type': 'text/xml; charset=utf-8', 'SOAPAction': '"http://web.cbr.ru/KeyRateXML"'},
+        timeout=(3.05, 30),
+    )
+    if resp.status_code != 200:
+        raise outbound.OutboundError(f'cbr: HTTP {resp.status_code}')
+    out = []
+    for el in ET.fromstring(resp.content).iter():
+        if el.tag.rsplit('}', 1)[-1] != 'KR':
+            continue
+        dt = rate = None
+        for ch in el:
+            tag = ch.tag.rsplit('}', 1)[-1]
+            if tag == 'DT':
+                dt = _parse_date(ch.text or '')
+            elif tag == 'Rate':
+                rate = Decimal((ch.text or '').strip())
+        if dt and rate is not None:
+            out.append((dt, rate))
+    out.sort()
+    return out
+
+
+def _store(points):
+    """
+    Сохраняет точки (date, rate) по возрастанию даты, оставляя только смены
+    ставки. Последняя известная запись всегда «трогается» (fetched_at).
+    """
+    if not points:
+        return
+    prev = (
+        KeyRate.objects.filter(date__lt=points[0][0]).order_by('-date')
+        .values_list('rate', flat=True).first()
+    )
+    for dt, rate in points:
+        if prev is not None and rate == prev:
+            continue
+        KeyRate.objects.update_or_create(date=dt, defaults={'rate': rate})
+        prev = rate
+    latest = KeyRate.objects.order_by('-date').first()
+    if latest:
+        latest.save(update_fields=['fetched_at'])
+
+
+def refresh(with_history=False) -> bool:
+    """
+    Обновляет историю ставки. Возвращает False, если обновление уже идёт
+    в другом процессе (single-flight) или источник недоступен.
+
+    Запросы к ЦБ идут вне транзакции: флаг REFRESH_LOCK_KEY в кэше не даёт
+    двум процессам ходить в сеть одновременно, advisory-lock берётся только
+    на короткую запись.
+    """
+    if not cache.add(REFRESH_LOCK_KEY, 1, REFRESH_LOCK_TTL):
+        return False
+    try:
+        last = KeyRate.objects.order_by('-date').values_list('date', flat=True).first()
+        start = HISTORY_START if (with_history or last is None) else last
+        batches = []
+        # История за период с последней известной смены — не пропустим
+        # промежуточные изменения, если воркер долго не работал
+        try:
+            batches.append(fetch_history(start, timezone.localdate()))
+        except Exception as e:
+            logger.warning('Key rate history refresh failed: %s', e)
+        try:
+            batches.append([fetch_current()])
+        except Exception as e:
+            logger.warning('Key rate refresh failed: %s', e)
+        if not batches:
+            return False
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                cur.execute('SELECT pg_advisory_xact_lock(%s)', [_LOCK_ID])
+            for points in batches:
+                _store(points)
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+    cache.delete_many([LATEST_CACHE_KEY, HISTORY_CACHE_KEY])
+    return True
+
+
+def _refresh_in_background():
+    global _bg_running
+    with _bg_lock:
+        if _bg_running:
+            return
+        _bg_running = True
+
+    def run():
+        global _bg_running
+        try:
+            refresh()
+        finally:
+            connection.close()
+            with _bg_lock:
+                _bg_running = False
+
+    threading.Thread(target=run, name='key-rate-refresh', daemon=True).start()
+
+
+def latest() -> dict:
+    """
+    Текущая ставка {"keyRate": float, "date": "YYYY-MM-DD"} без обращения к сети.
+    Если данных нет или они устарели — запускает фоновое обновление.
+    """
+    data = cache.get(LATEST_CACHE_KEY)
+    if data is not None:
+        return data
+    row = KeyRate.objects.order_by('-date').values('date', 'rate', 'fetched_at').first()
+    if not row or timezone.now() - row['fetched_at'] > STALE_AFTER:
+        _refresh_in_background()
+    if not row:
+        return {'keyRate': FALLBACK_RATE, 'date': ''}
+    data = {'keyRate': float(row['rate']), 'date': row['date'].isoformat()}
+    cache.set(LATEST_CACHE_KEY, data, LATEST_CACHE_TTL)
+    return data
+
+
+def rate_on(day: date):
+    """Ставка, действовавшая на дату: {"keyRate", "date"} или None, если истории нет"""
+    row = KeyRate.objects.filter(date__lte=day).order_by('-date').values('date', 'rate').first()
+    if not row:
+        return None
+    return {'keyRate': float(row['rate']), 'date': row['date'].isoformat()}
+
+
+def history():
+    """Периоды действия ставки [(date, float), ...] по возрастанию (из кэша)"""
+    data = cache.get(HISTORY_CACHE_KEY)
+    if data is None:
+        data = [(d, float(r)) for d, r in KeyRate.objects.order_by('date').values_list('date', 'rate')]
+        cache.set(HISTORY_CACHE_KEY, data, HISTORY_CACHE_TTL)
+    return data
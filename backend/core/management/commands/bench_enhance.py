@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+import pypdfium2
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from core import enhance
+
+from .bench_export import _sample_pdf
+
+
+def _sample_scan(dpi: int) -> Image.Image:
+    """Текстовая страница A4, повёрнутая на 2.3° и с тенью слева — как снимок телефоном"""
+    doc = pypdfium2.PdfDocument(_sample_pdf(1))
+    try:
+        page = doc[0].render(scale=dpi / 72, fill_color=(255, 255, 255, 255)).to_pil().convert('RGB')
+    finally:
+        doc.close()
+    page = page.rotate(2.3, Image.BILINEAR, fillcolor=(255, 255, 255))
+    x = np.linspace(0.55, 1.0, page.width, dtype=np.float32)[None, :, None]
+    return Image.fromarray((np.asarray(page, dtype=np.float32) * x * np.array([1.0, 0.97, 0.9])).astype(np.uint8))
+
+
+def _sample_photo(page: Image.Image) -> Image.Image:
+    """Тот же лист, снятый под углом на тёмном столе: 12 Мп, перспектива"""
+    w, h = 3000, 4000
+    quad = [(420, 520), (2560, 380), (2720, 3700), (300, 3520)]
+    rect = [(0, 0), (page.width, 0), (page.width, page.height), (0, page.height)]
+    rows, rhs = [], []
+    for (x, y), (u, v) in zip(quad, rect):
+        rows += [[x, y, 1, 0, 0, 0, -u * x, -u * y], [0, 0, 0, x, y, 1, -v * x, -v * y]]
+        rhs += [u, v]
+    coeffs = np.linalg.solve(np.array(rows, dtype=np.float64), np.array(rhs, dtype=np.float64)).tolist()
+    mask = Image.new('L', (w, h), 0)
+    ImageDraw.Draw(mask).polygon(quad, fill=255)
+    photo = Image.new('RGB', (w, h), (90, 70, 55))
+    photo.paste(page.transform((w, h), Image.PERSPECTIVE, coeffs, Image.BILINEAR), (0, 0), mask)
+    noise = np.random.default_rng(0).normal(0, 12, (h, w, 1)).astype(np.float32)
+    return Image.fromarray(np.clip(np.asarray(photo, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+
+
+class Command(BaseCommand):
+    help = 'Время фильтров улучшения скана на одной странице A4 (одно ядро).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dpi', type=int, default=300)
+        parser.add_argument('--runs', type=int, default=3)
+
+    def handle(self, *args, **opts):
+        img = _sample_scan(opts['dpi'])
+        photo = _sample_photo(_sample_scan(150))
+        self.stdout.write(f'page {img.width}x{img.height}, photo {photo.width}x{photo.height}')
+        for modes in [[m] for m in enhance.MODES] + [list(enhance.MODES)]:
+            # Обрезку есть смысл мерить только на фото: на скане лист не найдётся
+            src = photo if 'crop' in modes else img
+            best, info = None, {}
+            for _ in range(opts['runs']):
+                t0 = time.perf_counter()
+                out, info = enhance.apply(src, modes)
+                dt = time.perf_counter() - t0
+                best = dt if best is None else min(best, dt)
+            self.stdout.write(f'{"+".join(modes)}: {best * 1000:.0f} ms -> {out.width}x{out.height} {info or ""}')
@@ -0,0 +1,102 @@
+import base64
+import io
+import json
+import time
+
+import pypdfium2
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+from pypdf import PdfReader
+
+from core import export
+
+RASTER_SCALE = 3  # PDF_RENDER_SCALE редактора
+
+
+def _sample_pdf(pages: int) -> bytes:
+    """Текстовый PDF A4 со строками Helvetica — типичный договор/счёт"""
+    objs = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for p in range(pages):
+        lines = ''.join(
+            f'BT /F1 11 Tf 56 {800 - i * 16} Td (Page {p + 1}, line {i + 1}: lorem ipsum dolor sit amet, '
+            f'consectetur adipiscing elit, sed do eiusmod tempor) Tj ET\n'
+            for i in range(46)
+        ).encode('ascii')
+        objs.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(lines), lines))
+        objs.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                    b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (len(objs)))
+        kids.append(len(objs))
+    objs[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % k for k in kids), pages)
+    out, offsets = [b'%PDF-1.7\n'], []
+    pos = len(out[0])
+    for n, body in enumerate(objs, 1):
+        chunk = b'%d 0 obj\n%s\nendobj\n' % (n, body)
+        offsets.append(pos)
+        out.append(chunk)
+        pos += len(chunk)
+    out.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objs) + 1))
+    out.extend(b'%010d 00000 n \n' % o for o in offsets)
+    out.append(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objs) + 1, pos))
+    return b''.join(out)
+
+
+def _data_url(img: Image.Image) -> str:
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+class Command(BaseCommand):
+    help = ('Сравнение экспорта PDF-документа: растровые фоны (как рендерит редактор) '
+            'против наложения оверлеев на исходные векторные страницы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pdf', help='исходный PDF (по умолчанию — сгенерированный текстовый)')
+        parser.add_argument('--pages', type=int, default=10)
+        parser.add_argument('--out', help='каталог для сохранения результатов')
+
+    def handle(self, *args, **opts):
+        data = open(opts['pdf'], 'rb').read() if opts['pdf'] else _sample_pdf(opts['pages'])
+        sha = 'bench'
+        sig = Image.new('RGBA', (400, 200), (0, 0, 0, 0))
+        ImageDraw.Draw(sig).ellipse((10, 10, 390, 190), outline=(0, 0, 200, 255), width=12)
+        sig_src = _data_url(sig)
+
+        t0 = time.perf_counter()
+        doc = pypdfium2.PdfDocument(data)
+        raster, vector = [], []
+        for i in range(len(doc)):
+            bitmap = doc[i].render(scale=RASTER_SCALE).to_pil()
+            w, h = bitmap.size
+            overlays = [
+                {'id': 's', 'type': 'image', 'cx': w * 0.7, 'cy': h * 0.85, 'w': 400, 'h': 200,
+                 'scaleX': 1, 'scaleY': 1, 'angleRad': 0.2, 'data': {'src': sig_src}},
+                {'id': 't', 'type': 'text', 'cx': w * 0.3, 'cy': h * 0.9, 'w': 800, 'h': 80,
+                 'scaleX': 1, 'scaleY': 1, 'angleRad': 0,
+                 'data': {'text': 'Иванов И.И.', 'fontSize': 48, 'fontFamily': 'Arial', 'fill': '#000'}},
+            ]
+            base = {'id': f'p{i}', 'docWidth': w, 'docHeight': h, 'rotation': 0, 'overlays': overlays}
+            raster.append(dict(base, bg_src=_data_url(bitmap)))
+            vector.append(dict(base, bg_src='', src_pdf={'sha': sha, 'index': i}))
+        doc.close()
+        t_prep = time.perf_counter() - t0
+        sources = {sha: PdfReader(io.BytesIO(data))}
+
+        results = {}
+        for label, snap, src in (('raster', {'pages': raster}, None), ('vector', {'pages': vector}, sources)):
+            t0 = time.perf_counter()
+            out = b''.join(export.iter_pdf(snap, 'bench', src))
+            results[label] = (time.perf_counter() - t0, out)
+            if opts['out']:
+                with open(f"{opts['out']}/bench_{label}.pdf", 'wb') as f:
+                    f.write(out)
+
+        text = PdfReader(io.BytesIO(results['vector'][1])).pages[0].extract_text()
+        self.stdout.write(f'pages={len(raster)} source={len(data) / 1024:.0f} KiB '
+                          f'(snapshot payload raster={len(json.dumps(raster)) / 1024:.0f} KiB, '
+                          f'pdf.js-like rasterize {t_prep * 1000:.0f} ms)')
+        for label, (t, out) in results.items():
+            self.stdout.write(f'{label}: {t * 1000:.0f} ms, {len(out) / 1024:.0f} KiB')
+        self.stdout.write(f'vector text layer kept: {bool(text.strip())}')
@@ -0,0 +1,102 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import office
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/></Relationships>'
+)
+
+
+def _sample_docx(paragraphs: int) -> bytes:
+    """Минимальный DOCX с текстовыми абзацами — типичный договор"""
+    body = ''.join(
+        f'<w:p><w:r><w:t>{escape(f"{i + 1}. Стороны договорились о нижеследующем: lorem ipsum dolor sit amet.")}'
+        f'</w:t></w:r></w:p>'
+        for i in range(paragraphs)
+    )
+    doc = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        z.writestr('_rels/.rels', _RELS)
+        z.writestr('word/document.xml', doc)
+    return buf.getvalue()
+
+
+class Command(BaseCommand):
+    help = ('Документов в минуту при конвертации DOCX/XLSX в PDF: новый soffice '
+            'с чистым профилем на каждый файл против пула тёплых экземпляров.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='DOCX/XLS/XLSX (по умолчанию — сгенерированный DOCX)')
+        parser.add_argument('--docs', type=int, default=12, help='сколько конвертаций в каждом режиме')
+        parser.add_argument('--pool', type=int, default=2, help='размер пула тёплых экземпляров')
+
+    def handle(self, *args, **opts):
+        binary = office.office_binary()
+        if not binary:
+            raise CommandError('LibreOffice (soffice) не найден')
+        if opts['files']:
+            inputs = [(open(p, 'rb').read(), os.path.splitext(p)[1].lower().lstrip('.')) for p in opts['files']]
+        else:
+            inputs = [(_sample_docx(120), 'docx')]
+        jobs = [inputs[i % len(inputs)] for i in range(opts['docs'])]
+        self.stdout.write(f'soffice={binary} uno={"yes" if office.uno else "no"} docs={len(jobs)}')
+
+        # Холодный запуск: как «soffice --convert-to» на каждый файл, профиль каждый раз новый
+        t0 = time.perf_counter()
+        for data, ext in jobs:
+            with tempfile.TemporaryDirectory() as tmp:
+                src = os.path.join(tmp, f'input.{ext}')
+                with open(src, 'wb') as f:
+                    f.write(data)
+                subprocess.run(
+                    [binary, '--headless', '--norestore', f'-env:UserInstallation=file://{tmp}/profile',
+                     '--convert-to', 'pdf', '--outdir', tmp, src],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True,
+                )
+        cold = time.perf_counter() - t0
+        self.stdout.write(f'cold: {cold:.1f} s, {len(jobs) / cold * 60:.1f} docs/min')
+
+        root = tempfile.mkdtemp(prefix='scannyrf-office-bench-')
+        pool = office.OfficePool(opts['pool'], binary, root)
+        try:
+            t0 = time.perf_counter()
+            pool.warm()
+            self.stdout.write(f'warm-up of {opts["pool"]} instances: {time.perf_counter() - t0:.1f} s')
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(opts['pool']) as ex:
+                sizes = list(ex.map(lambda j: len(pool.convert(j[0], j[1], timeout=120, wait=600)), jobs))
+            warm = time.perf_counter() - t0
+        finally:
+            pool.close()
+            shutil.rmtree(root, ignore_errors=True)
+        self.stdout.write(f'warm pool: {warm:.1f} s, {len(jobs) / warm * 60:.1f} docs/min '
+                          f'(pdf {sum(sizes) / len(sizes) / 1024:.0f} KiB avg)')
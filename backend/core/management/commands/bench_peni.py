@@ -0,0 +1,74 @@
+import io
+import random
+import time
+from datetime import date
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core import key_rate, peni
+
+
+class Command(BaseCommand):
+    help = 'Замер пакетного расчёта пени на случайных строках (векторный расчёт и потоковый CSV).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--mode', default='tax', choices=peni.MODES)
+        parser.add_argument('--entity', default='org', choices=peni.ENTITIES)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **opts):
+        n, mode, entity = opts['rows'], opts['mode'], opts['entity']
+        rnd = np.random.default_rng(opts['seed'])
+        first = date(2014, 1, 1).toordinal()
+        last = date.today().toordinal()
+        due = rnd.integers(first, last, n)
+        pay = np.minimum(due + rnd.integers(0, 1500, n), last)
+        amounts = np.round(rnd.uniform(100, 1_000_000, n), 2)
+        hist = key_rate.history()
+
+        t0 = time.perf_counter()
+        _, res = peni.compute(amounts, due, pay, mode, entity, hist)
+        t_vec = time.perf_counter() - t0
+
+        # Построчный расчёт по тем же правилам — эталон для сверки и сравнения скорости
+        sample = random.Random(opts['seed']).sample(range(n), min(n, 2000))
+        rates = {}
+        t0 = time.perf_counter()
+        for i in sample:
+            ref = self._naive(float(amounts[i]), int(due[i]), int(pay[i]), mode, entity, hist, rates)
+            if abs(ref - res[i]) > 0.011:
+                self.stderr.write(f'mismatch row {i}: vector={res[i]} naive={ref}')
+        t_naive = (time.perf_counter() - t0) / len(sample) * n if sample else 0.0
+
+        lines = ['amount;due;pay']
+        for a, d, p in zip(amounts.tolist(), due.tolist(), pay.tolist()):
+            lines.append(f'{a:.2f};{date.fromordinal(d):%d.%m.%Y};{date.fromordinal(p).isoformat()}')
+        raw = io.BytesIO(('\n'.join(lines) + '\n').encode('utf-8'))
+        t0 = time.perf_counter()
+        size = sum(len(part) for part in peni.iter_csv(raw, mode, entity))
+        t_csv = time.perf_counter() - t0
+
+        self.stdout.write(f'rows={n} mode={mode}/{entity} rate periods={len(hist)}')
+        self.stdout.write(f'vectorized compute: {t_vec * 1000:.1f} ms')
+        self.stdout.write(f'naive per-day loop (extrapolated): {t_naive * 1000:.1f} ms')
+        self.stdout.write(f'CSV parse+compute+write: {t_csv * 1000:.1f} ms, {size / 1024:.0f} KiB out')
+
+    @staticmethod
+    def _naive(amount, due, pay, mode, entity, hist, rates):
+        segs = peni.segments_for(mode, entity)
+        total = 0.0
+        for k, day in enumerate(range(due + 1, pay + 1)):
+            denom = next(dn for lo, hi, dn in segs if k >= lo and (hi is None or k < hi))
+            if not denom:
+                continue
+            if day not in rates:
+                d = date.fromordinal(day)
+                r = hist[0][1] if hist else key_rate.FALLBACK_RATE
+                for start, rate in hist:
+                    if start <= d:
+                        r = rate
+                rates[day] = r
+            total += rates[day] / 100.0 / denom
+        return round(amount * total + 1e-9, 2)
@@ -0,0 +1,68 @@
+import gzip
+import io
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from core import signature, vectorize
+from core.models import GlobalSignImage, SignImage
+
+
+def _sample_signature() -> bytes:
+    """Росчерк синей ручкой на сфотографированном листе -> PNG после core.signature"""
+    w, h = 3000, 2000
+    paper = np.linspace(150, 215, w, dtype=np.float32)[None, :, None] * np.array([1.0, 0.98, 0.93])
+    img = Image.fromarray(np.broadcast_to(paper, (h, w, 3)).astype(np.uint8))
+    t = np.linspace(0, 6 * np.pi, 400)
+    ImageDraw.Draw(img).line(list(zip(900 + t * 70 + 120 * np.sin(t * 1.3), 1000 + 200 * np.sin(t))),
+                             fill=(30, 45, 120), width=14)
+    noise = np.random.default_rng(0).normal(0, 5, (h, w, 3))
+    img = Image.fromarray(np.clip(np.asarray(img, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=88)
+    return signature.extract((buf.getvalue(), ''))[0]
+
+
+class Command(BaseCommand):
+    help = ('Векторизация подписей: время трассировки, размер SVG против PNG '
+            'и совпадение растра SVG с исходной маской.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='PNG/JPEG подписей (по умолчанию — сгенерированная)')
+        parser.add_argument('--library', type=int, default=0, help='взять N последних подписей из библиотек')
+
+    def handle(self, *args, **opts):
+        inputs = [(p, open(p, 'rb').read()) for p in opts['files']]
+        if opts['library']:
+            for model in (SignImage, GlobalSignImage):
+                inputs += [(f'{model.__name__}#{pk}', bytes(data))
+                           for pk, data in model.objects.values_list('id', 'data')[:opts['library']]]
+        if not inputs:
+            inputs = [('sample', _sample_signature())]
+
+        total_png = total_svg = 0
+        for name, data in inputs:
+            t0 = time.perf_counter()
+            res = vectorize.trace(data)
+            dt = time.perf_counter() - t0
+            if res is None:
+                self.stdout.write(f'{name}: нет чернил')
+                continue
+            svg, info = res
+            src = Image.open(io.BytesIO(data))
+            vec = vectorize.parse(svg)
+            mask, _ = vectorize._ink_mask(src)
+            traced = np.asarray(vectorize.rasterize(vec, *src.size))[..., 3] >= vectorize.INK_ALPHA
+            iou = (mask & traced).sum() / max(1, (mask | traced).sum())
+            size = len(svg.encode('utf-8'))
+            total_png += len(data)
+            total_svg += size
+            self.stdout.write(
+                f'{name}: {src.width}x{src.height}, trace {dt * 1000:.0f} ms, {info["paths"]} paths / '
+                f'{info["points"]} points, png {len(data) / 1024:.1f} KiB -> svg {size / 1024:.1f} KiB '
+                f'(gzip {len(gzip.compress(svg.encode("utf-8"))) / 1024:.1f} KiB), IoU {iou:.3f}'
+            )
+        if total_png:
+            self.stdout.write(f'total: png {total_png / 1024:.1f} KiB -> svg {total_svg / 1024:.1f} KiB')
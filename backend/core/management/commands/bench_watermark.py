@@ -0,0 +1,84 @@
+import base64
+import io
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from PIL import Image, ImageDraw
+
+from core import export, render, watermark
+from core.pdfwriter import single_page_pdf
+
+
+def _sample_page() -> dict:
+    """Страница A4 как в редакторе (3 px/pt): скан-фон в JPEG и подпись поверх"""
+    w, h = 1786, 2526
+    rng = np.random.default_rng(0)
+    bg = Image.fromarray(np.clip(rng.normal(235, 8, (h, w)), 0, 255).astype(np.uint8)).convert('RGB')
+    draw = ImageDraw.Draw(bg)
+    for i in range(60):
+        draw.line((170, 200 + i * 36, w - 170 - (i % 7) * 90, 200 + i * 36), fill=(40, 40, 40), width=6)
+    buf = io.BytesIO()
+    bg.save(buf, 'JPEG', quality=88)
+    sig = Image.new('RGBA', (400, 200), (0, 0, 0, 0))
+    ImageDraw.Draw(sig).ellipse((10, 10, 390, 190), outline=(0, 0, 200, 255), width=12)
+    sig_buf = io.BytesIO()
+    sig.save(sig_buf, 'PNG')
+
+    def data_url(mime, data):
+        return f'data:{mime};base64,' + base64.b64encode(data).decode('ascii')
+
+    return {
+        'id': 'p', 'docWidth': w, 'docHeight': h, 'rotation': 0,
+        'bg_src': data_url('image/jpeg', buf.getvalue()),
+        'overlays': [{'id': 's', 'type': 'image', 'cx': w * 0.7, 'cy': h * 0.85, 'w': 400, 'h': 200,
+                      'scaleX': 1, 'scaleY': 1, 'angleRad': 0.2,
+                      'data': {'src': data_url('image/png', sig_buf.getvalue())}}],
+    }
+
+
+def _ms(fn, repeat):
+    fn()  # прогрев: шрифты, плитка и маска страницы попадают в кэш процесса
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - t0) / repeat * 1000, out
+
+
+class Command(BaseCommand):
+    help = ('Водяной знак бесплатных выгрузок: время страницы JPG и PDF со знаком и без '
+            '(в одном процессе, без пула) и отдельно время наложения знака.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dpi', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--out', help='каталог для сохранения страниц со знаком')
+
+    def handle(self, *args, **opts):
+        page, fonts, n = _sample_page(), export.font_dirs(), opts['repeat']
+        scale = render.raster_scale(page, opts['dpi'] / (72 * render.PX_PER_PT))
+        job = (page, fonts, scale, 85)
+
+        jpg_plain, _ = _ms(lambda: render.jpg_page(job), n)
+        jpg_marked, jpg = _ms(lambda: watermark.jpg_page(job), n)
+        canvas = render.raster_page(page, fonts, scale)
+        blend, _ = _ms(lambda: watermark.apply(canvas, fonts), n)
+        self.stdout.write(
+            f'jpg {canvas.width}x{canvas.height} @ {opts["dpi"]} dpi: {jpg_plain:.0f} ms -> {jpg_marked:.0f} ms '
+            f'per page (blend {blend:.1f} ms, {blend / jpg_plain * 100:.1f}% of render)'
+        )
+
+        pdf_job = (page, fonts, {})
+        pdf_plain, plain = _ms(lambda: single_page_pdf(render.pdf_page(pdf_job)), n)
+        pdf_marked, marked = _ms(lambda: single_page_pdf(watermark.pdf_page(pdf_job)), n)
+        tile = len(watermark.pdf_image(fonts).data) + len(watermark.pdf_image(fonts).smask.data)
+        self.stdout.write(
+            f'pdf: {pdf_plain:.0f} ms -> {pdf_marked:.0f} ms per page, '
+            f'{len(plain) / 1024:.0f} KiB -> {len(marked) / 1024:.0f} KiB '
+            f'(tile {tile / 1024:.1f} KiB, embedded once per file)'
+        )
+        if opts['out']:
+            with open(f"{opts['out']}/bench_watermark.jpg", 'wb') as f:
+                f.write(jpg)
+            with open(f"{opts['out']}/bench_watermark.pdf", 'wb') as f:
+                f.write(marked)
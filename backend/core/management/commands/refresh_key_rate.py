@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import key_rate
+
+
+class Command(BaseCommand):
+    help = 'Обновляет историю ключевой ставки ЦБ (однократно или периодически с --loop).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', action='store_true', help='Перезагрузить всю историю с 2013 года')
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно')
+        parser.add_argument('--interval', type=int, default=3600, help='Период обновления в режиме --loop (с)')
+
+    def handle(self, *args, **opts):
+        with_history = opts['history']
+        while True:
+            ok = key_rate.refresh(with_history=with_history)
+            self.stdout.write(f"key rate: {'updated' if ok else 'skipped'} {key_rate.latest()}")
+            with_history = False
+            if not opts['loop']:
+                return
+            time.sleep(opts['interval'])
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import blobs, export_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет фоновые выгрузки (ExportJob) по одной; страницы рендерятся в пуле '
+        'RENDER_WORKERS. Сколько процессов запущено — столько выгрузок идёт одновременно.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить очередь и выйти')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза, если очередь пуста (с)')
+
+    def handle(self, *args, **opts):
+        last_maintenance = last_prune = 0.0
+        while True:
+            if time.monotonic() - last_maintenance > 60:
+                requeued, expired = export_jobs.requeue_stale(), export_jobs.cleanup()
+                if requeued or expired:
+                    self.stdout.write(f'export jobs: requeued={requeued} expired={expired}')
+                last_maintenance = time.monotonic()
+            if time.monotonic() - last_prune > 3600:
+                pruned = blobs.prune()
+                if pruned:
+                    self.stdout.write(f'page blobs: pruned={pruned}')
+                last_prune = time.monotonic()
+
+            job = export_jobs.claim()
+            if job is None:
+                if opts['once']:
+                    return
+                time.sleep(opts['interval'])
+                continue
+            t0 = time.monotonic()
+            export_jobs.process(job)
+            self.stdout.write(
+                f'export job {job.id}: {job.status} {job.kind} {job.pages} pages '
+                f'{job.size / 1024:.0f} KiB in {time.monotonic() - t0:.1f}s'
+            )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core import vectorize, workers
+from core.models import GlobalSignImage, SignImage
+from core.views import invalidate_default_signs_cache
+
+
+class Command(BaseCommand):
+    help = 'Строит SVG-копии (core.vectorize) подписям и печатям библиотек, у которых их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='перестроить и существующие')
+
+    def handle(self, *args, **opts):
+        for model in (SignImage, GlobalSignImage):
+            qs = model.objects.all() if opts['force'] else model.objects.filter(svg='')
+            ids = list(qs.values_list('id', flat=True))
+            done = 0
+            for i in range(0, len(ids), 50):
+                rows = list(model.objects.filter(id__in=ids[i:i + 50]).only('id', 'data'))
+                for obj, res in zip(rows, workers.imap(vectorize.trace, (bytes(r.data) for r in rows))):
+                    if res is None:
+                        continue
+                    model.objects.filter(id=obj.id).update(svg=res[0])
+                    done += 1
+            self.stdout.write(f'{model.__name__}: {done} of {len(ids)} vectorized')
+        # Глобальная библиотека кэшируется сериализованной, а update() сигналов не шлёт
+        invalidate_default_signs_cache()
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_subscription_downloads_left_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('rate', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalsignimage',
+            name='svg',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='signimage',
+            name='svg',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -106,6 +106,7 @@ class SignImage(models.Model):
     kind = models.CharField(max_length=16, choices=TYPE_CHOICES, default='signature')
     mime = models.CharField(max_length=100, default='image/png')
     data = models.BinaryField()  # PNG/JPEG
+    svg = models.TextField(blank=True, default='')  # векторная копия (core.vectorize), если строилась
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -127,6 +128,7 @@ class GlobalSignImage(models.Model):
     kind = models.CharField(max_length=16, choices=TYPE_CHOICES, default='signature')
     mime = models.CharField(max_length=100, default='image/png')
     data = models.BinaryField()  # PNG/JPEG
+    svg = models.TextField(blank=True, default='')  # векторная копия (core.vectorize), если строилась
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -213,4 +215,91 @@ class DraftEvent(models.Model):
         ordering = ['-created_at']
 
     def __str__(self) -> str:
-        return f'event:{self.user_id}:{self.client_id}:{self.kind}:{self.created_at:%H:%M:%S}'
\ No newline at end of file
+        return f'event:{self.user_id}:{self.client_id}:{self.kind}:{self.created_at:%H:%M:%S}'
+
+
+class KeyRate(models.Model):
+    """
+    История ключевой ставки ЦБ. Запись — точка изменения: ставка действует
+    с date до даты следующей записи. Обновляется фоновой задачей (refresh_key_rate).
+    """
+    date = models.DateField(unique=True)
+    rate = models.DecimalField(max_digits=5, decimal_places=2)
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+
+    def __str__(self) -> str:
+        return f'key_rate:{self.date:%Y-%m-%d}:{self.rate}'
+
+
+class SourceDocument(models.Model):
+    """
+    Исходный файл, загруженный в редактор (PDF). Страницы черновика ссылаются
+    на него полем src_pdf = {"sha": ..., "index": n}: экспорт дописывает подписи
+    и текст поверх оригинальной векторной страницы, а не её растровой копии.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='source_docs')
+    sha256 = models.CharField(max_length=64)
+    name = models.CharField(max_length=200, blank=True, default='')
+    mime = models.CharField(max_length=100, default='application/pdf')
+    size = models.PositiveIntegerField(default=0)
+    pages = models.PositiveIntegerField(default=0)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'sha256'], name='source_doc_user_sha_unique'),
+        ]
+
+    def __str__(self) -> str:
+        return f'source:{self.user_id}:{self.name}:{self.pages}:{self.sha256[:12]}'
+
+
+class ExportJob(models.Model):
+    """
+    Фоновая выгрузка черновика (manage.py run_export_jobs). Снимок черновика
+    фиксируется при постановке в очередь, квота списывается там же; при
+    ошибке списание возвращается.
+    """
+    KIND_CHOICES = [
+        ('pdf', 'pdf'),
+        ('jpg', 'jpg'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'queued'),
+        ('running', 'running'),
+        ('done', 'done'),
+        ('failed', 'failed'),
+        ('expired', 'expired'),
+    ]
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='export_jobs')
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued')
+    params = models.JSONField(default=dict, blank=True)  # dpi, quality
+    snapshot = models.JSONField(default=dict, blank=True)
+    doc_name = models.CharField(max_length=200, blank=True, default='')
+    operation = models.ForeignKey(Operation, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    subscription = models.ForeignKey(Subscription, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    pages = models.PositiveIntegerField(default=0)
+    done_pages = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True, default='')
+    size = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self) -> str:
+        return f'export:{self.user_id}:{self.kind}:{self.status}:{self.done_pages}/{self.pages}'
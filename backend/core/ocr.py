@@ -0,0 +1,139 @@
+"""
+Распознавание текста фонов страниц для PDF с поиском (в процессах core.workers).
+
+recognize() прогоняет фон страницы через tesseract (TSV со словами и их
+рамками) и возвращает строки слов в пикселях картинки. Результат
+зависит только от фона, поэтому кэшируется по его хэшу (core.export):
+перенос подписи или правка текста поверх не требуют повторного
+распознавания. text_ops() превращает слова в невидимый текст (режим 3)
+шрифтом pdfwriter.TEXT_FONT: каждое слово растягивается по ширине своей
+рамки, поэтому выделение совпадает с растром. Модуль не зависит от Django.
+"""
+import csv
+import io
+import logging
+import subprocess
+
+from PIL import Image
+
+from . import render
+from .pdfwriter import TEXT_FONT, TEXT_FONT_WIDTH, num
+
+logger = logging.getLogger(__name__)
+
+# Слова с меньшей уверенностью tesseract (0..100) — как правило, шум скана
+MIN_CONF = 30
+# Больше этого по длинной стороне tesseract не даёт прибавки в качестве, только время
+MAX_SIDE = 5000
+# Базовая линия от верха рамки слова, в долях её высоты
+BASELINE = 0.8
+
+
+class OcrError(RuntimeError):
+    pass
+
+
+def _image(data: bytes) -> Image.Image:
+    img = render.open_image(data)
+    if 'A' in img.getbands():
+        bg = Image.new('RGBA', img.size, 'white')
+        bg.alpha_composite(img.convert('RGBA'))
+        img = bg
+    img = img.convert('L')
+    k = MAX_SIDE / max(img.size)
+    if k < 1:
+        img = img.resize((max(1, round(img.width * k)), max(1, round(img.height * k))), Image.LANCZOS)
+    return img
+
+
+def _parse_tsv(text: str) -> list:
+    """TSV tesseract -> [[[left, top, width, height, word], ...] по строкам]"""
+    lines = {}
+    for row in csv.DictReader(io.StringIO(text), delimiter='\t', quoting=csv.QUOTE_NONE):
+        word = (row.get('text') or '').strip()
+        try:
+            if row['level'] != '5' or not word or float(row['conf']) < MIN_CONF:
+                continue
+            box = [int(row[k]) for k in ('left', 'top', 'width', 'height')]
+            key = (int(row['block_num']), int(row['par_num']), int(row['line_num']))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if box[2] > 0 and box[3] > 0:
+            lines.setdefault(key, []).append(box + [word])
+    return [lines[k] for k in sorted(lines)]
+
+
+def run_tesseract(img: Image.Image, binary: str, langs: str, timeout: float) -> str:
+    buf = io.BytesIO()
+    img.save(buf, 'PPM')
+    try:
+        proc = subprocess.run(
+            [binary, 'stdin', 'stdout', '-l', langs, '--psm', '3', 'tsv'],
+            input=buf.getvalue(), capture_output=True, timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise OcrError('tesseract: timeout')
+    except OSError as e:
+        raise OcrError(f'tesseract: {e}')
+    if proc.returncode:
+        raise OcrError(f'tesseract: {proc.stderr.decode("utf-8", "replace").strip()[-300:]}')
+    return proc.stdout.decode('utf-8', 'replace')
+
+
+def recognize(args):
+    """
+    args = (page, binary, langs, timeout) -> {"size": [w, h], "lines": [...]}
+    для фона страницы; None — фона нет или распознать не удалось (такой
+    результат не кэшируется, страница выгружается без текста).
+    """
+    page, binary, langs, timeout = args
+    data = render.page_background(page)
+    if not data:
+        return None
+    try:
+        img = _image(data)
+        lines = _parse_tsv(run_tesseract(img, binary, langs, timeout))
+    except Exception as e:
+        logger.warning('OCR failed: %s', e)
+        return None
+    return {'size': list(img.size), 'lines': lines}
+
+
+def _hex(text: str) -> str:
+    # Коды шрифта — UTF-16 символов; вне BMP в шрифте Identity-H их не передать
+    return ''.join(f'{ord(c):04x}' for c in text if ord(c) < 0x10000)
+
+
+def text_ops(result: dict, doc_w: float, doc_h: float) -> str:
+    """
+    Невидимый текст в координатах документа (ось Y вниз, как в render.pdf_page):
+    фон растянут на docWidth x docHeight, слова — пропорционально.
+    """
+    w, h = result['size']
+    sx, sy = doc_w / max(1, w), doc_h / max(1, h)
+    ops = [f'BT 3 Tr /{TEXT_FONT} 1 Tf\n']
+    for line in result['lines']:
+        for i, (left, top, width, height, word) in enumerate(line):
+            code = _hex(word)
+            if not code:
+                continue
+            size = height * sy
+            # Рамку слова заполняют его символы; пробел после слова уходит в промежуток до следующего
+            stretch = width * sx / (len(code) // 4 * TEXT_FONT_WIDTH)
+            space = '0020' if i < len(line) - 1 else ''
+            ops.append(
+                f'{num(stretch)} 0 0 {num(-size)} {num(left * sx)} {num((top + height * BASELINE) * sy)} Tm '
+                f'<{code}{space}> Tj\n'
+            )
+    ops.append('ET\n')
+    return ''.join(ops)
+
+
+def apply(spec, result: dict, page: dict):
+    """Дописывает текстовый слой в PageSpec страницы (в главном процессе — это быстро)"""
+    if not result or not result['lines']:
+        return spec
+    doc_w, doc_h, *_ = render.page_box(page)
+    spec.content += text_ops(result, doc_w, doc_h).encode('ascii')
+    spec.text_layer = True
+    return spec
@@ -0,0 +1,311 @@
+"""
+Конвертация DOCX/XLS/XLSX в PDF через LibreOffice без интерфейса.
+
+Запуск soffice на каждый файл стоит секунды (старт процесса, а при
+пустом профиле — ещё и его создание). Поэтому процесс держит небольшой
+пул «тёплых» экземпляров: у каждого свой профиль, и он не завершается
+между задачами. Если доступен модуль uno (python3-uno), документы
+открываются через UNO в уже запущенном soffice. Без uno (обычный venv)
+тёплого пула нет: каждый файл — холодный запуск soffice --convert-to,
+заранее готов только профиль экземпляра (это экономит его создание, но
+не старт процесса). Для тёплой конвертации нужен python3-uno.
+
+Одновременно на экземпляре идёт одна задача, остальные ждут в очереди
+не дольше OFFICE_QUEUE_TIMEOUT. Зависший экземпляр убивается по
+OFFICE_JOB_TIMEOUT и перезапускается; после OFFICE_JOBS_PER_INSTANCE
+задач он перезапускается сам, чтобы не копить утечки памяти.
+"""
+import atexit
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+OFFICE_EXTENSIONS = ('docx', 'xls', 'xlsx')
+PDF_FILTERS = {'docx': 'writer_pdf_Export', 'xls': 'calc_pdf_Export', 'xlsx': 'calc_pdf_Export'}
+# Сколько ждать, пока запущенный soffice начнёт принимать UNO-соединения (с)
+START_TIMEOUT = 30
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
+
+
+class OfficeError(RuntimeError):
+    pass
+
+
+class OfficeUnavailable(OfficeError):
+    """LibreOffice не установлен"""
+
+
+class OfficeBusy(OfficeError):
+    """Все экземпляры заняты дольше OFFICE_QUEUE_TIMEOUT"""
+
+
+class ConversionError(OfficeError):
+    """Документ не удалось сконвертировать (повреждён или не уложился в таймаут)"""
+
+
+def office_binary():
+    return settings.OFFICE_BINARY or shutil.which('soffice') or shutil.which('libreoffice')
+
+
+def _kill_group(proc):
+    # soffice — скрипт-обёртка над oosplash/soffice.bin: убивается вся группа
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def _run(args, timeout):
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        return proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        _kill_group(proc)
+        raise
+
+
+def _props(**kw):
+    out = []
+    for k, v in kw.items():
+        p = PropertyValue()
+        p.Name, p.Value = k, v
+        out.append(p)
+    return tuple(out)
+
+
+class _Instance:
+    """Один soffice со своим профилем"""
+
+    def __init__(self, binary: str, root: str):
+        self.binary = binary
+        self.profile = os.path.join(root, f'profile-{uuid.uuid4().hex[:8]}')
+        self.pipe = f'scannyrf_office_{os.getpid()}_{uuid.uuid4().hex[:8]}'
+        self.proc = None
+        self.desktop = None
+        self.started = False
+        self.jobs = 0
+
+    def _base_args(self):
+        return [
+            self.binary, '--headless', '--invisible', '--nologo', '--norestore',
+            '--nodefault', '--nolockcheck',
+            f'-env:UserInstallation=file://{self.profile}',
+        ]
+
+    def start(self):
+        if uno is None:
+            # Без UNO «прогревается» только профиль: первый запуск его создаёт
+            try:
+                code = _run(self._base_args() + ['--terminate_after_init'], START_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                raise OfficeError('soffice не запустился')
+            except OSError as e:
+                raise OfficeUnavailable(f'Конвертер документов не запускается: {e}')
+            if code:
+                raise OfficeError('soffice не запустился')
+            self.started = True
+            return
+        try:
+            self.proc = subprocess.Popen(
+                self._base_args() + [f'--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+            )
+        except OSError as e:
+            raise OfficeUnavailable(f'Конвертер документов не запускается: {e}')
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(f'uno:pipe,name={self.pipe};urp;StarOffice.ComponentContext')
+                break
+            except Exception:
+                if self.proc.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise OfficeError('soffice не запустился')
+                time.sleep(0.2)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+        self.started = True
+
+    def stop(self):
+        self.started = False
+        self.desktop = None
+        if self.proc and self.proc.poll() is None:
+            _kill_group(self.proc)
+        self.proc = None
+
+    def alive(self) -> bool:
+        if uno is None:
+            return self.started
+        return self.started and self.proc is not None and self.proc.poll() is None
+
+    def _convert_uno(self, src: str, dst: str, ext: str):
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(src), '_blank', 0, _props(Hidden=True, ReadOnly=True),
+        )
+        if doc is None:
+            raise ConversionError('Не удалось открыть документ')
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(dst), _props(FilterName=PDF_FILTERS[ext]))
+        finally:
+            doc.close(True)
+
+    def convert(self, src: str, dst: str, ext: str, timeout: float):
+        self.jobs += 1
+        if uno is None:
+            outdir = os.path.dirname(dst)
+            try:
+                code = _run(self._base_args() + ['--convert-to', 'pdf', '--outdir', outdir, src], timeout)
+            except subprocess.TimeoutExpired:
+                raise ConversionError('Конвертация не уложилась в отведённое время')
+            except OSError as e:
+                self.stop()
+                raise OfficeUnavailable(f'Конвертер документов не запускается: {e}')
+            if code:
+                raise ConversionError('Не удалось сконвертировать документ')
+            produced = os.path.join(outdir, os.path.splitext(os.path.basename(src))[0] + '.pdf')
+            if produced != dst and os.path.exists(produced):
+                os.replace(produced, dst)
+            return
+
+        # Вызов UNO не прерывается сам: по таймауту soffice убивается,
+        # и ждущий поток получает DisposedException
+        error = []
+
+        def target():
+            try:
+                self._convert_uno(src, dst, ext)
+            except Exception as e:
+                error.append(e)
+
+        t = threading.Thread(target=target, daemon=True)
+        t.start()
+        t.join(timeout)
+        if t.is_alive():
+            logger.warning('Office conversion timed out, killing instance %s', self.pipe)
+            self.stop()
+            t.join(5)
+            raise ConversionError('Конвертация не уложилась в отведённое время')
+        if error:
+            if isinstance(error[0], OfficeError):
+                raise error[0]
+            if not self.alive():
+                raise ConversionError('Конвертер аварийно завершился')
+            raise ConversionError('Не удалось сконвертировать документ')
+
+    def remove(self):
+        self.stop()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+
+class OfficePool:
+    def __init__(self, size: int, binary: str, root: str):
+        self.size = max(1, size)
+        self.binary = binary
+        self.root = root
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._all = []
+
+    def _acquire(self, wait: float) -> _Instance:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                inst = _Instance(self.binary, self.root)
+                self._all.append(inst)
+                return inst
+        try:
+            return self._idle.get(timeout=wait)
+        except queue.Empty:
+            raise OfficeBusy('Конвертер документов занят, попробуйте позже')
+
+    def convert(self, data: bytes, ext: str, timeout: float, wait: float) -> bytes:
+        inst = self._acquire(wait)
+        try:
+            if inst.jobs >= settings.OFFICE_JOBS_PER_INSTANCE:
+                inst.stop()
+                inst.jobs = 0
+            if not inst.alive():
+                inst.stop()
+                inst.start()
+            with tempfile.TemporaryDirectory(dir=self.root) as tmp:
+                src = os.path.join(tmp, f'input.{ext}')
+                dst = os.path.join(tmp, 'input.pdf')
+                with open(src, 'wb') as f:
+                    f.write(data)
+                inst.convert(src, dst, ext, timeout)
+                if not os.path.exists(dst):
+                    raise ConversionError('Не удалось сконвертировать документ')
+                with open(dst, 'rb') as f:
+                    return f.read()
+        finally:
+            self._idle.put(inst)
+
+    def warm(self):
+        """Запускает все экземпляры заранее (бенчмарк, старт воркера)"""
+        insts = [self._acquire(START_TIMEOUT) for _ in range(self.size)]
+        try:
+            for inst in insts:
+                if not inst.alive():
+                    inst.stop()
+                    inst.start()
+        finally:
+            for inst in insts:
+                self._idle.put(inst)
+
+    def close(self):
+        for inst in self._all:
+            inst.remove()
+        self._all = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> OfficePool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                binary = office_binary()
+                if not binary:
+                    raise OfficeUnavailable('Конвертер документов не установлен')
+                root = os.path.join(tempfile.gettempdir(), f'scannyrf-office-{os.getpid()}')
+                os.makedirs(root, exist_ok=True)
+                _pool = OfficePool(settings.OFFICE_POOL_SIZE, binary, root)
+                atexit.register(_pool.close)
+    return _pool
+
+
+def to_pdf(data: bytes, ext: str) -> bytes:
+    """DOCX/XLS/XLSX -> PDF на тёплом экземпляре пула"""
+    if ext not in OFFICE_EXTENSIONS:
+        raise ConversionError('Формат не поддерживается')
+    return get_pool().convert(
+        data, ext,
+        timeout=settings.OFFICE_JOB_TIMEOUT,
+        wait=settings.OFFICE_QUEUE_TIMEOUT,
+    )
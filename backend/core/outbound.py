@@ -0,0 +1,146 @@
+"""
+Общий HTTP-клиент для исходящих запросов (OAuth-провайдеры, внешние API).
+
+- одна requests.Session на процесс: keep-alive пулы соединений по хостам;
+- кэш ответов с ключами/сертификатами по Cache-Control/Expires апстрима;
+- счётчики запросов, ошибок и задержек по провайдерам (metrics_snapshot()).
+
+Базовые URL провайдеров задаются в settings, поэтому в тестах/локально их
+можно направить на фейковый сервер.
+"""
+import email.utils
+import logging
+import re
+import threading
+import time
+
+import requests
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) — вместо прежних 10 с на любой запрос
+DEFAULT_TIMEOUT = (3.05, 6)
+POOL_CONNECTIONS = 10   # хостов в пуле
+POOL_MAXSIZE = 20       # соединений на хост
+KEYS_DEFAULT_TTL = 3600
+KEYS_MAX_TTL = 24 * 3600
+
+_session = None
+_session_lock = threading.Lock()
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class OutboundError(Exception):
+    pass
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                # Повторяем только сбои установки соединения — они безопасны
+                retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+                s.mount('https://', adapter)
+                s.mount('http://', adapter)
+                s.headers['User-Agent'] = 'ScannyRF/1.0'
+                _session = s
+    return _session
+
+
+def _record(provider: str, elapsed_ms: float, ok: bool):
+    with _metrics_lock:
+        m = _metrics.setdefault(provider, {
+            'requests': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0,
+        })
+        m['requests'] += 1
+        if not ok:
+            m['errors'] += 1
+        m['total_ms'] += elapsed_ms
+        m['last_ms'] = elapsed_ms
+        m['max_ms'] = max(m['max_ms'], elapsed_ms)
+
+
+def metrics_snapshot() -> dict:
+    """Метрики текущего процесса: {provider: {requests, errors, avg_ms, max_ms, last_ms}}"""
+    with _metrics_lock:
+        out = {}
+        for name, m in _metrics.items():
+            out[name] = {
+                'requests': m['requests'],
+                'errors': m['errors'],
+                'avg_ms': round(m['total_ms'] / m['requests'], 1) if m['requests'] else 0.0,
+                'max_ms': round(m['max_ms'], 1),
+                'last_ms': round(m['last_ms'], 1),
+            }
+        return out
+
+
+def request(provider: str, method: str, url: str, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        resp = get_session().request(method, url, timeout=timeout, **kwargs)
+        ok = resp.status_code < 500
+        return resp
+    except requests.RequestException as e:
+        logger.warning('Outbound %s %s failed: %s', provider, url, e)
+        raise OutboundError(str(e)) from e
+    finally:
+        _record(provider, (time.perf_counter() - t0) * 1000.0, ok)
+
+
+def get_json(provider: str, url: str, params=None, timeout=DEFAULT_TIMEOUT) -> dict:
+    resp = request(provider, 'GET', url, params=params, timeout=timeout)
+    try:
+        return resp.json() if resp.content else {}
+    except ValueError as e:
+        raise OutboundError(f'{provider}: invalid JSON') from e
+
+
+def _ttl_from_headers(resp: requests.Response, default: int) -> int:
+    cc = resp.headers.get('Cache-Control', '')
+    if 'no-store' in cc or 'no-cache' in cc:
+        return 0
+    m = re.search(r'max-age=(\d+)', cc)
+    if m:
+        ttl = int(m.group(1)) - int(resp.headers.get('Age', '0') or 0)
+        return max(0, min(ttl, KEYS_MAX_TTL))
+    exp = resp.headers.get('Expires')
+    if exp:
+        try:
+            ttl = int(email.utils.parsedate_to_datetime(exp).timestamp() - time.time())
+            return max(0, min(ttl, KEYS_MAX_TTL))
+        except (TypeError, ValueError):
+            pass
+    return default
+
+
+def get_json_cached(provider: str, url: str, default_ttl=KEYS_DEFAULT_TTL, refresh=False) -> dict:
+    """
+    GET c кэшированием (для сертификатов/JWKS провайдеров): хранит JSON
+    столько, сколько разрешает апстрим, и не ходит в сеть до истечения.
+    refresh=True — перечитать из сети мимо кэша (провайдер сменил ключи раньше срока).
+    """
+    key = f'outbound:json:{url}'
+    data = None if refresh else cache.get(key)
+    if data is not None:
+        return data
+    resp = request(provider, 'GET', url)
+    if resp.status_code != 200:
+        raise OutboundError(f'{provider}: HTTP {resp.status_code}')
+    try:
+        data = resp.json()
+    except ValueError as e:
+        raise OutboundError(f'{provider}: invalid JSON') from e
+    ttl = _ttl_from_headers(resp, default_ttl)
+    if ttl > 0:
+        cache.set(key, data, ttl)
+    return data
@@ -0,0 +1,175 @@
+"""
+Минимальный потоковый writer PDF для экспорта.
+
+Страница записывается в выходной поток сразу, как только готова: в памяти
+держатся только смещения объектов для xref. Одинаковые картинки (подпись,
+вставленная на все страницы) встраиваются один раз и переиспользуются.
+Модуль без зависимостей от Django — PageSpec/ImageSpec собираются в
+процессах пула (core/render.py).
+
+Для распознанного текста (core.ocr) есть общий на файл шрифт TEXT_FONT:
+Type0 с Identity-H, коды — UTF-16 символов, ToUnicode отображает их сами
+в себя. Файл шрифта не встраивается: текст рисуется режимом 3 (невидимый),
+нужны только ширины для выделения и копирования.
+"""
+import zlib
+from dataclasses import dataclass, field
+
+
+@dataclass
+class ImageSpec:
+    key: str                      # ключ дедупликации (хэш исходных данных)
+    width: int
+    height: int
+    data: bytes
+    filter: str = 'FlateDecode'   # 'DCTDecode' — JPEG как есть
+    colorspace: str = 'DeviceRGB'
+    smask: 'ImageSpec | None' = None
+
+
+@dataclass
+class PageSpec:
+    width: float                  # pt
+    height: float
+    content: bytes                # операторы страницы (без сжатия)
+    images: dict = field(default_factory=dict)  # имя ресурса -> ImageSpec
+    text_layer: bool = False      # в content есть текст шрифтом /TEXT_FONT
+
+
+TEXT_FONT = 'Ocr'
+# Ширина любого символа шрифта TEXT_FONT в долях кегля
+TEXT_FONT_WIDTH = 0.5
+
+
+def _to_unicode_cmap() -> bytes:
+    # bfrange не должен пересекать старший байт — 256 диапазонов по 256 кодов
+    ranges = ''.join(f'<{hi:02x}00> <{hi:02x}ff> <{hi:02x}00>\n' for hi in range(256))
+    return (
+        '/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n'
+        '/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n'
+        '/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n'
+        '1 begincodespacerange\n<0000> <ffff>\nendcodespacerange\n'
+        f'256 beginbfrange\n{ranges}endbfrange\n'
+        'endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend\n'
+    ).encode('ascii')
+
+
+def num(v: float) -> str:
+    """Число для content stream: без экспоненты и лишних нулей"""
+    s = f'{v:.4f}'.rstrip('0').rstrip('.')
+    return '0' if s in ('', '-0') else s
+
+
+class PdfStreamWriter:
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, title=''):
+        self._offsets = {}
+        self._pos = 0
+        self._next = 3
+        self._kids = []
+        self._images = {}
+        self._font = None
+        self._title = title
+
+    def _alloc(self) -> int:
+        n = self._next
+        self._next += 1
+        return n
+
+    def _emit(self, data: bytes) -> bytes:
+        self._pos += len(data)
+        return data
+
+    def _obj(self, n: int, body: bytes, stream: bytes = None) -> bytes:
+        self._offsets[n] = self._pos
+        if stream is None:
+            return self._emit(b'%d 0 obj\n%s\nendobj\n' % (n, body))
+        return self._emit(
+            b'%d 0 obj\n%s\nstream\n%s\nendstream\nendobj\n' % (n, body, stream)
+        )
+
+    def header(self) -> bytes:
+        return self._emit(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def _image(self, img: ImageSpec, out: list) -> int:
+        if img.key in self._images:
+            return self._images[img.key]
+        smask = self._image(img.smask, out) if img.smask else None
+        n = self._alloc()
+        d = (
+            f'<< /Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} '
+            f'/ColorSpace /{img.colorspace} /BitsPerComponent 8 /Filter /{img.filter} '
+            f'/Length {len(img.data)}'
+        )
+        if smask:
+            d += f' /SMask {smask} 0 R'
+        out.append(self._obj(n, (d + ' >>').encode('ascii'), img.data))
+        self._images[img.key] = n
+        return n
+
+    def _text_font(self, out: list) -> int:
+        if self._font:
+            return self._font
+        desc, cid, cmap, font = self._alloc(), self._alloc(), self._alloc(), self._alloc()
+        out.append(self._obj(desc, (
+            '<< /Type /FontDescriptor /FontName /GlyphLessFont /Flags 5 /FontBBox [0 -200 500 800] '
+            '/ItalicAngle 0 /Ascent 800 /Descent -200 /CapHeight 700 /StemV 80 >>'
+        ).encode('ascii')))
+        out.append(self._obj(cid, (
+            '<< /Type /Font /Subtype /CIDFontType2 /BaseFont /GlyphLessFont '
+            '/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> '
+            f'/FontDescriptor {desc} 0 R /DW {round(TEXT_FONT_WIDTH * 1000)} /CIDToGIDMap /Identity >>'
+        ).encode('ascii')))
+        data = zlib.compress(_to_unicode_cmap(), 9)
+        out.append(self._obj(cmap, b'<< /Length %d /Filter /FlateDecode >>' % len(data), data))
+        out.append(self._obj(font, (
+            '<< /Type /Font /Subtype /Type0 /BaseFont /GlyphLessFont /Encoding /Identity-H '
+            f'/DescendantFonts [{cid} 0 R] /ToUnicode {cmap} 0 R >>'
+        ).encode('ascii')))
+        self._font = font
+        return font
+
+    def add_page(self, page: PageSpec) -> bytes:
+        out = []
+        xobjects = {name: self._image(img, out) for name, img in page.images.items()}
+        fonts = f' /Font << /{TEXT_FONT} {self._text_font(out)} 0 R >>' if page.text_layer else ''
+        content = zlib.compress(page.content, 6)
+        cn = self._alloc()
+        out.append(self._obj(cn, b'<< /Length %d /Filter /FlateDecode >>' % len(content), content))
+        res = ' '.join(f'/{name} {n} 0 R' for name, n in xobjects.items())
+        pn = self._alloc()
+        out.append(self._obj(pn, (
+            f'<< /Type /Page /Parent {self.PAGES} 0 R '
+            f'/MediaBox [0 0 {num(page.width)} {num(page.height)}] '
+            f'/Resources << /XObject << {res} >>{fonts} >> /Contents {cn} 0 R >>'
+        ).encode('ascii')))
+        self._kids.append(pn)
+        return b''.join(out)
+
+    def close(self) -> bytes:
+        out = []
+        kids = ' '.join(f'{k} 0 R' for k in self._kids)
+        out.append(self._obj(self.PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self._kids)} >>'.encode('ascii')))
+        out.append(self._obj(self.CATALOG, f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'.encode('ascii')))
+        info = self._alloc()
+        title = self._title.encode('utf-16-be')
+        out.append(self._obj(info, b'<< /Producer (ScannyRF) /Title <feff%s> >>' % title.hex().encode('ascii')))
+
+        xref_at = self._pos
+        rows = [b'xref\n0 %d\n' % self._next, b'0000000000 65535 f \n']
+        for n in range(1, self._next):
+            rows.append(b'%010d 00000 n \n' % self._offsets[n])
+        rows.append(
+            b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (self._next, self.CATALOG, info, xref_at)
+        )
+        out.append(self._emit(b''.join(rows)))
+        return b''.join(out)
+
+
+def single_page_pdf(page: PageSpec) -> bytes:
+    """Одностраничный PDF (для наложения на страницы другого документа)"""
+    w = PdfStreamWriter()
+    return w.header() + w.add_page(page) + w.close()
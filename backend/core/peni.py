@@ -0,0 +1,233 @@
+"""
+Пакетный расчёт пени с учётом истории ключевой ставки.
+
+Правила те же, что у калькулятора на фронтенде (Calculators.jsx), но ставка
+берётся на каждый день просрочки, а не одна текущая. Расчёт векторный:
+по истории ставки строится массив накопленных сумм дневных ставок, и пени
+за любой отрезок дней — разность двух элементов. Так все строки считаются
+одной серией операций NumPy, без цикла по строкам и по дням.
+"""
+import csv
+import io
+import re
+from datetime import date, datetime
+
+import numpy as np
+
+from . import key_rate
+
+MODES = ('tax', 'salary', 'utilities')
+ENTITIES = ('org', 'person')
+CSV_COLUMNS = ('amount', 'due', 'pay', 'days', 'peni', 'error')
+# Сколько строк CSV считать за один векторный проход (и держать в памяти)
+CHUNK_ROWS = 10000
+# Допустимые даты: ограничивают размер таблицы дневных ставок
+MIN_DATE = date(1992, 1, 1)
+MAX_DATE = date(2100, 12, 31)
+
+# Отрезки просрочки (с какого дня, по какой день не включая, знаменатель доли ставки);
+# знаменатель 0 — пени не начисляются
+_SEGMENTS = {
+    ('tax', 'person'): ((0, None, 300),),
+    ('tax', 'org'): ((0, 30, 300), (30, None, 150)),
+    ('salary', None): ((0, None, 150),),
+    ('utilities', None): ((0, 30, 0), (30, 90, 300), (90, None, 130)),
+}
+
+_DMY = re.compile(r'^(\d{1,2})\.(\d{1,2})\.(\d{4})$')
+
+
+class PeniError(ValueError):
+    pass
+
+
+def segments_for(mode: str, entity: str = 'org'):
+    if mode not in MODES:
+        raise PeniError('mode должен быть одним из: ' + ', '.join(MODES))
+    if mode == 'tax':
+        if entity not in ENTITIES:
+            raise PeniError('entity должен быть org или person')
+        return _SEGMENTS[(mode, entity)]
+    return _SEGMENTS[(mode, None)]
+
+
+def parse_date(s) -> date:
+    """YYYY-MM-DD или ДД.ММ.ГГГГ"""
+    if isinstance(s, date):
+        return s
+    s = str(s or '').strip()
+    m = _DMY.match(s)
+    if m:
+        return date(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+    return datetime.strptime(s[:10], '%Y-%m-%d').date()
+
+
+def parse_amount(s) -> float:
+    """Сумма: число или строка вида «1 234,56»"""
+    if isinstance(s, (int, float)):
+        v = float(s)
+    else:
+        v = float(str(s or '').replace('\u00a0', '').replace(' ', '').replace(',', '.'))
+    if not np.isfinite(v) or v < 0:
+        raise ValueError(v)
+    return v
+
+
+class RateTable:
+    """Дневные ставки (в долях) и их накопленные суммы от base до end включительно"""
+
+    def __init__(self, base: date, end: date, hist=None):
+        hist = key_rate.history() if hist is None else hist
+        self.base = base.toordinal()
+        n = max(0, end.toordinal() - self.base + 1)
+        if hist:
+            starts = np.array([d.toordinal() for d, _ in hist], dtype=np.int64)
+            rates = np.array([r for _, r in hist], dtype=np.float64) / 100.0
+            days = self.base + np.arange(n, dtype=np.int64)
+            # До первой известной записи действует самая ранняя ставка
+            idx = np.clip(np.searchsorted(starts, days, side='right') - 1, 0, None)
+            daily = rates[idx]
+        else:
+            daily = np.full(n, key_rate.FALLBACK_RATE / 100.0)
+        self.cum = np.concatenate(([0.0], np.cumsum(daily)))
+
+    def span(self, a, b):
+        """Сумма дневных ставок за дни [a, b) — смещения от base"""
+        return self.cum[b] - self.cum[a]
+
+
+def compute(amounts, due, pay, mode='tax', entity='org', hist=None):
+    """
+    Векторный расчёт. amounts — суммы долга, due/pay — даты как ordinal
+    (date.toordinal()), все одной длины. Просрочка — со дня после срока
+    уплаты по день погашения включительно.
+    Возвращает (days, peni) — массивы int64 и float64 (пени округлены до копеек).
+    """
+    segs = segments_for(mode, entity)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    due = np.asarray(due, dtype=np.int64)
+    pay = np.asarray(pay, dtype=np.int64)
+    if not len(amounts):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    start = due + 1
+    days = np.maximum(pay - start + 1, 0)
+    base = int(start.min())
+    end = max(int(pay.max()), base)
+    table = RateTable(date.fromordinal(base), date.fromordinal(end), hist)
+
+    s0 = start - base
+    peni = np.zeros(len(amounts))
+    for lo, hi, denom in segs:
+        if not denom:
+            continue
+        a = s0 + np.minimum(days, lo)
+        b = s0 + (days if hi is None else np.minimum(days, hi))
+        peni += table.span(a, b) / denom
+    peni = np.round(amounts * peni + 1e-9, 2)
+    return days, peni
+
+
+def compute_rows(rows, mode='tax', entity='org', hist=None):
+    """
+    Строки [{amount, due, pay}] -> [{amount, due, pay, days, peni, error}].
+    Ошибочные строки не прерывают расчёт: у них заполнен error.
+    """
+    out = []
+    amounts, dues, pays, ok_idx = [], [], [], []
+    for r in rows:
+        item = {
+            'amount': r.get('amount'), 'due': r.get('due'), 'pay': r.get('pay'),
+            'days': None, 'peni': None, 'error': '',
+        }
+        try:
+            amount = parse_amount(r.get('amount'))
+        except (TypeError, ValueError):
+            item['error'] = 'Некорректная сумма'
+        else:
+            try:
+                d, p = parse_date(r.get('due')), parse_date(r.get('pay'))
+            except (TypeError, ValueError):
+                item['error'] = 'Некорректная дата'
+            else:
+                if not (MIN_DATE <= d <= MAX_DATE and MIN_DATE <= p <= MAX_DATE):
+                    item['error'] = 'Дата вне допустимого диапазона'
+                elif p < d:
+                    item['error'] = 'Дата погашения раньше срока уплаты'
+                else:
+                    item['due'], item['pay'] = d.isoformat(), p.isoformat()
+                    amounts.append(amount)
+                    dues.append(d.toordinal())
+                    pays.append(p.toordinal())
+                    ok_idx.append(len(out))
+        out.append(item)
+
+    if ok_idx:
+        days, peni = compute(amounts, dues, pays, mode, entity, hist)
+        for i, dd, pp in zip(ok_idx, days.tolist(), peni.tolist()):
+            out[i]['days'] = dd
+            out[i]['peni'] = pp
+    return out
+
+
+def _sniff_reader(f):
+    head = f.readline()
+    f.seek(0)
+    # Excel в русской локали пишет «;», а запятая бывает десятичным разделителем
+    delimiter = ';' if ';' in head else ('\t' if '\t' in head else ',')
+    reader = csv.reader(f, delimiter=delimiter)
+    first = next(reader, None)
+    if first is None:
+        return iter(())
+    names = [c.strip().lower() for c in first]
+    if {'amount', 'due', 'pay'} <= set(names):
+        ia, idue, ipay = names.index('amount'), names.index('due'), names.index('pay')
+    else:
+        # Без заголовка: сумма; срок уплаты; дата погашения
+        ia, idue, ipay = 0, 1, 2
+        reader = _chain_first(first, reader)
+
+    def gen():
+        for rec in reader:
+            if not rec or not any(c.strip() for c in rec):
+                continue
+            get = lambda i: rec[i] if i < len(rec) else ''
+            yield {'amount': get(ia), 'due': get(idue), 'pay': get(ipay)}
+    return gen()
+
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
+
+
+def iter_csv(fileobj, mode='tax', entity='org', chunk_rows=CHUNK_ROWS):
+    """
+    Потоковый расчёт CSV-файла: читает строки порциями по chunk_rows,
+    считает каждую порцию векторно и отдаёт готовые строки CSV.
+    История ставки загружается один раз на весь файл.
+    """
+    segments_for(mode, entity)
+    hist = key_rate.history()
+    f = fileobj if isinstance(fileobj, io.TextIOBase) else io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    rows = _sniff_reader(f)
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    writer.writerow(CSV_COLUMNS)
+    yield buf.getvalue()
+
+    while True:
+        chunk = [r for _, r in zip(range(chunk_rows), rows)]
+        if not chunk:
+            break
+        buf.seek(0)
+        buf.truncate()
+        for r in compute_rows(chunk, mode, entity, hist):
+            writer.writerow([
+                r['amount'], r['due'], r['pay'],
+                '' if r['days'] is None else r['days'],
+                '' if r['peni'] is None else f"{r['peni']:.2f}",
+                r['error'],
+            ])
+        yield buf.getvalue()
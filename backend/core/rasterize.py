@@ -0,0 +1,67 @@
+"""
+Растеризация загруженных документов для редактора (в процессах core.workers).
+
+PDF-страницы рендерятся pypdfium2 с тем же масштабом, что pdf.js в редакторе
+(PDF_RENDER_SCALE), картинки поворачиваются по EXIF. Формат результата
+выбирает core.transcode по содержимому страницы, он кладётся в хранилище
+blob-ов.
+Модуль не зависит от Django.
+"""
+import io
+import math
+
+import pypdfium2
+from PIL import Image
+
+from . import transcode
+from .render import MAX_RASTER_PIXELS
+
+PDF_RENDER_SCALE = 3.0
+JPEG_QUALITY = 90
+# Огромные страницы растрируются мельче (до MAX_RASTER_PIXELS), но не мельче этого
+MIN_RENDER_SCALE = 0.5
+
+
+class PageTooLarge(ValueError):
+    pass
+
+
+def render_scale(width_pt: float, height_pt: float, scale: float) -> float:
+    """Масштаб растеризации страницы с учётом MAX_RASTER_PIXELS; PageTooLarge, если не укладывается"""
+    area = max(1.0, width_pt * height_pt)
+    scale = min(scale, (MAX_RASTER_PIXELS / area) ** 0.5)
+    # pdfium округляет размер растра вверх
+    while math.ceil(width_pt * scale) * math.ceil(height_pt * scale) > MAX_RASTER_PIXELS:
+        scale *= 0.999
+    if scale < MIN_RENDER_SCALE:
+        raise PageTooLarge(f'{width_pt:.0f}x{height_pt:.0f} pt')
+    return scale
+
+
+def pdf_page(args):
+    """args = (path, index, scale, quality) -> (width, height, data, ext)"""
+    path, index, scale, quality = args
+    doc = pypdfium2.PdfDocument(path)
+    try:
+        page = doc[index]
+        scale = render_scale(*page.get_size(), scale)
+        bitmap = page.render(scale=scale, fill_color=(255, 255, 255, 255))
+        img = bitmap.to_pil()
+    finally:
+        doc.close()
+    data, ext, _ = transcode.encode(img, quality)
+    return img.width, img.height, data, ext
+
+
+def image(args):
+    """args = (data, quality) -> (width, height, data, ext); JPEG без поворота — как есть"""
+    data, quality = args
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    if img.format == 'JPEG' and img.getexif().get(0x0112, 1) == 1 and img.mode in ('RGB', 'L'):
+        return img.width, img.height, data, 'jpg'
+    res = transcode.page((data, quality))
+    if res is None:
+        raise ValueError('not an image')
+    w, h, out, ext, _ = res
+    return w, h, out, ext
@@ -0,0 +1,436 @@
+"""
+Рендеринг страниц черновика (DocumentDraft) на сервере.
+
+Повторяет renderPageOffscreen из Editor.jsx: фон рисуется в координатах
+документа (docWidth x docHeight), оверлеи — со сдвигом в (cx, cy), поворотом
+angleRad и масштабом scaleX/scaleY (у текста масштаб всегда 1); при повороте
+страницы её ширина становится docH²/docW с центром в центре документа.
+
+Модуль не зависит от Django: функции выполняются в процессах core.workers.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import math
+import os
+import re
+import zlib
+from functools import lru_cache
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageOps
+
+from . import vectorize
+from .pdfwriter import ImageSpec, PageSpec, num
+
+# Пикселей документа на пункт PDF: фон PDF-страниц редактор рендерит
+# с PDF_RENDER_SCALE = 3, так исходные страницы сохраняют свой размер
+PX_PER_PT = 3.0
+# Межстрочный интервал текста (LH_FACTOR в редакторе)
+LH_FACTOR = 1.0
+# Во сколько раз текст растрируется детальнее пикселей документа
+TEXT_SUPERSAMPLE = 2
+BG_JPEG_QUALITY = 90
+# Ограничение растровой страницы (JPG-экспорт), пикселей
+MAX_RASTER_PIXELS = 60_000_000
+# Пределы чисел из черновика (его присылает клиент): координаты и размеры
+# в пикселях документа, масштаб оверлея, кегль
+DOC_MAX = 100_000.0
+MAX_OVERLAY_SCALE = 100.0
+MAX_FONT_SIZE = 2000.0
+
+_DATA_URL = re.compile(r'^data:([\w.+-]+/[\w.+-]+)?(;[\w=.-]+)*;base64,', re.I)
+
+# Семейства из FONTS редактора -> кандидаты файлов шрифтов (по имени без расширения)
+_FONT_CANDIDATES = {
+    'arial': ('arial', 'liberationsans', 'arimo', 'dejavusans'),
+    'times new roman': ('times', 'liberationserif', 'tinos', 'dejavuserif'),
+    'georgia': ('georgia', 'gelasio', 'liberationserif', 'dejavuserif'),
+    'segoe ui': ('segoeui', 'opensans', 'notosans', 'dejavusans'),
+    'roboto': ('roboto', 'notosans', 'dejavusans'),
+    'ermilov': ('ermilov',),
+}
+_FALLBACK_FONTS = ('dejavusans', 'liberationsans', 'notosans', 'arial')
+
+
+def decode_data_url(src):
+    """bytes из data:...;base64,...; для других адресов — None (в сеть не ходим)"""
+    if not isinstance(src, str):
+        return None
+    m = _DATA_URL.match(src)
+    if not m:
+        return None
+    try:
+        return base64.b64decode(src[m.end():], validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def page_background(page: dict):
+    """Байты фона страницы: файл из хранилища (bg_path) или data URL из bg_src"""
+    path = page.get('bg_path')
+    if path:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    return decode_data_url(page.get('bg_src'))
+
+
+def open_image(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return ImageOps.exif_transpose(img)
+
+
+def number(value, default=0.0, lo=-DOC_MAX, hi=DOC_MAX) -> float:
+    """Число из черновика: не число и nan/inf -> default, остальное зажимается в [lo, hi]"""
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(v):
+        return default
+    return min(hi, max(lo, v))
+
+
+def page_box(page: dict):
+    """(docW, docH, pageW, pageH, left, top) в пикселях документа"""
+    doc_w = number(page.get('docWidth') or 1000, 1000, 1, DOC_MAX)
+    doc_h = number(page.get('docHeight') or 1414, 1414, 1, DOC_MAX)
+    if page.get('rotation'):
+        page_w, page_h = (doc_h * doc_h / doc_w if doc_w > 0 else doc_h), doc_h
+    else:
+        page_w, page_h = doc_w, doc_h
+    return doc_w, doc_h, page_w, page_h, doc_w / 2 - page_w / 2, doc_h / 2 - page_h / 2
+
+
+# ---------- Шрифты ----------
+
+def _norm(s: str) -> str:
+    return re.sub(r'[^a-z0-9]', '', s.lower())
+
+
+@lru_cache(maxsize=8)
+def _font_index(font_dirs: tuple) -> dict:
+    idx = {}
+    for root in font_dirs:
+        for dirpath, _, files in os.walk(root):
+            for f in files:
+                stem, ext = os.path.splitext(f)
+                if ext.lower() in ('.ttf', '.otf', '.ttc'):
+                    idx.setdefault(_norm(stem), os.path.join(dirpath, f))
+    return idx
+
+
+def _pick_font(family: str, bold: bool, italic: bool, font_dirs: tuple):
+    """Путь к файлу и признак «нужен искусственный жирный»"""
+    idx = _font_index(font_dirs)
+    fam = (family or 'Arial').split(',')[0].strip().strip('"\'').lower()
+    cands = _FONT_CANDIDATES.get(fam, (_norm(fam),)) + _FALLBACK_FONTS
+    for c in cands:
+        names = [n for n in idx if n.startswith(c)]
+        if not names:
+            continue
+
+        def score(n):
+            rest = n[len(c):]
+            has_bold = 'bold' in rest or rest in ('bd', 'bi', 'z')
+            has_italic = 'italic' in rest or 'oblique' in rest or rest in ('i', 'bi', 'z')
+            return (has_bold != bold) * 2 + (has_italic != italic) + len(rest) / 100.0
+
+        best = min(names, key=score)
+        rest = best[len(c):]
+        return idx[best], bold and not ('bold' in rest or rest in ('bd', 'bi', 'z'))
+    return None, bold
+
+
+@lru_cache(maxsize=64)
+def load_font(family: str, size: int, bold: bool, italic: bool, font_dirs: tuple):
+    path, fake_bold = _pick_font(family, bold, italic, font_dirs)
+    if path:
+        try:
+            return ImageFont.truetype(path, size), fake_bold
+        except OSError:
+            pass
+    return ImageFont.load_default(size), bold
+
+
+# ---------- Оверлеи ----------
+
+def render_text(d: dict, w: float, h: float, scale: float, font_dirs: tuple) -> Image.Image:
+    """Текстовый оверлей в прозрачную картинку размером (w x h) * scale"""
+    W, H = max(1, round(w * scale)), max(1, round(h * scale))
+    img = Image.new('RGBA', (W, H), (0, 0, 0, 0))
+    size = number(d.get('fontSize') or 48, 48, 6, MAX_FONT_SIZE)
+    bold = str(d.get('fontWeight') or 'bold').lower() in ('bold', 'bolder', '600', '700', '800', '900')
+    italic = str(d.get('fontStyle') or 'normal').lower() in ('italic', 'oblique')
+    font, fake_bold = load_font(d.get('fontFamily') or 'Arial', max(1, round(size * scale)), bold, italic, font_dirs)
+    try:
+        fill = ImageColor.getrgb(d.get('fill') or '#000000')
+    except ValueError:
+        fill = (0, 0, 0)
+
+    align = d.get('textAlign') or 'left'
+    x = {'center': W / 2, 'right': W}.get(align, 0)
+    anchor = {'center': 'ma', 'right': 'ra'}.get(align, 'la')
+    lines = str(d.get('text') or '').split('\n')
+    lh = size * LH_FACTOR * scale
+    y = H / 2 - len(lines) * lh / 2
+    draw = ImageDraw.Draw(img)
+    stroke = max(1, round(size * scale / 40)) if fake_bold else 0
+    for line in lines:
+        draw.text((x, y), line, font=font, fill=fill, anchor=anchor, stroke_width=stroke, stroke_fill=fill)
+        y += lh
+    return img
+
+
+def image_spec(img: Image.Image, key: str, jpeg_quality=None, raw_jpeg: bytes = None) -> ImageSpec:
+    """
+    Картинка -> ImageSpec: JPEG передаётся как есть, с альфой — Flate + SMask,
+    иначе Flate (или JPEG, если задано качество — для фонов-фотографий).
+    """
+    if raw_jpeg is not None and img.mode in ('RGB', 'L'):
+        return ImageSpec(key, img.width, img.height, raw_jpeg, 'DCTDecode',
+                         'DeviceGray' if img.mode == 'L' else 'DeviceRGB')
+    if img.mode in ('P', 'LA', 'PA') or (img.mode == 'RGBA'):
+        img = img.convert('RGBA')
+        alpha = img.getchannel('A')
+        smask = None
+        if alpha.getextrema()[0] < 255:
+            smask = ImageSpec(key + ':a', img.width, img.height, zlib.compress(alpha.tobytes(), 6), colorspace='DeviceGray')
+        img = img.convert('RGB')
+    else:
+        smask = None
+        img = img.convert('L' if img.mode in ('1', 'L', 'I', 'I;16', 'F') else 'RGB')
+    cs = 'DeviceGray' if img.mode == 'L' else 'DeviceRGB'
+    if jpeg_quality and smask is None:
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=jpeg_quality, optimize=True)
+        return ImageSpec(key, img.width, img.height, buf.getvalue(), 'DCTDecode', cs)
+    return ImageSpec(key, img.width, img.height, zlib.compress(img.tobytes(), 6), colorspace=cs, smask=smask)
+
+
+def _source_image(data: bytes, key: str, jpeg_quality=None) -> ImageSpec:
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    rotated = img.getexif().get(0x0112, 1) != 1
+    # JPEG без EXIF-поворота встраивается без перекодирования
+    raw = data if img.format == 'JPEG' and img.mode in ('RGB', 'L') and not rotated else None
+    if rotated:
+        img = ImageOps.exif_transpose(img)
+    return image_spec(img, key, jpeg_quality, raw_jpeg=raw)
+
+
+def _overlay_cm(ov: dict) -> str:
+    """Сдвиг в центр оверлея, поворот и масштаб (в координатах документа, ось Y вниз)"""
+    a = float(ov.get('angleRad') or 0)
+    is_text = ov.get('type') == 'text'
+    sx = 1.0 if is_text else float(ov.get('scaleX') or 1)
+    sy = 1.0 if is_text else float(ov.get('scaleY') or 1)
+    c, s = math.cos(a), math.sin(a)
+    return (
+        f'1 0 0 1 {num(float(ov.get("cx") or 0))} {num(float(ov.get("cy") or 0))} cm '
+        f'{num(c)} {num(s)} {num(-s)} {num(c)} 0 0 cm '
+        f'{num(sx)} 0 0 {num(sy)} 0 0 cm '
+    )
+
+
+def overlay_ops(ov: dict, name: str) -> str:
+    """Операторы размещения оверлея-картинки"""
+    w, h = float(ov.get('w') or 0), float(ov.get('h') or 0)
+    return f'q {_overlay_cm(ov)}{num(w)} 0 0 {num(-h)} {num(-w / 2)} {num(h / 2)} cm /{name} Do Q\n'
+
+
+def vector_ops(ov: dict, vec: vectorize.Vector) -> str:
+    """Векторный оверлей (SVG подписи): путь заливается цветом прямо в потоке страницы"""
+    w, h = float(ov.get('w') or 0), float(ov.get('h') or 0)
+    r, g, b = (v / 255 for v in vec.color)
+    return (
+        f'q {_overlay_cm(ov)}{num(w / vec.width)} 0 0 {num(h / vec.height)} {num(-w / 2)} {num(-h / 2)} cm '
+        f'{num(r)} {num(g)} {num(b)} rg\n{vectorize.pdf_path(vec, num)}f* Q\n'
+    )
+
+
+def _vector(data):
+    """SVG подписи из core.vectorize -> Vector, иначе None"""
+    return vectorize.parse(data) if data and data.lstrip()[:4] == b'<svg' else None
+
+
+def _geometry(ov: dict) -> dict:
+    """Оверлей с проверенной геометрией: дальше её можно читать через float() без проверок"""
+    scale = (-MAX_OVERLAY_SCALE, MAX_OVERLAY_SCALE)
+    return dict(
+        ov,
+        cx=number(ov.get('cx')), cy=number(ov.get('cy')),
+        w=number(ov.get('w'), 0, 0), h=number(ov.get('h'), 0, 0),
+        scaleX=number(ov.get('scaleX') or 1, 1, *scale) or 1,
+        scaleY=number(ov.get('scaleY') or 1, 1, *scale) or 1,
+        angleRad=math.remainder(number(ov.get('angleRad'), 0, -DOC_MAX), 2 * math.pi),
+    )
+
+
+def _too_big(w: float, h: float) -> bool:
+    """Растр оверлея больше целой страницы — значит, геометрия бессмысленная"""
+    return max(1, round(w)) * max(1, round(h)) > MAX_RASTER_PIXELS
+
+
+def _drawable_overlays(page: dict):
+    """Оверлеи страницы, которые есть смысл рисовать: [(ov, data)] по порядку"""
+    for ov in page.get('overlays') or []:
+        if not isinstance(ov, dict):
+            continue
+        ov = _geometry(ov)
+        if ov['w'] <= 0 or ov['h'] <= 0:
+            continue
+        d = ov.get('data') or {}
+        if not isinstance(d, dict):
+            continue
+        if ov.get('type') == 'text' and str(d.get('text') or '').strip():
+            yield ov, d
+        elif ov.get('type') == 'image' and d.get('src'):
+            yield ov, d
+
+
+def overlay_images(page: dict, font_dirs: tuple):
+    """[(ov, ImageSpec | Vector)] для всех рисуемых оверлеев страницы по порядку"""
+    out = []
+    for ov, d in _drawable_overlays(page):
+        w, h = float(ov['w']), float(ov['h'])
+        if ov.get('type') == 'text':
+            if _too_big(w * TEXT_SUPERSAMPLE, h * TEXT_SUPERSAMPLE):
+                continue
+            img = render_text(d, w, h, TEXT_SUPERSAMPLE, font_dirs)
+            key = 't:' + hashlib.sha1(img.tobytes()).hexdigest()
+            out.append((ov, image_spec(img, key)))
+        else:
+            data = decode_data_url(d.get('src'))
+            if not data:
+                continue
+            vec = _vector(data)
+            if vec:
+                out.append((ov, vec))
+                continue
+            try:
+                out.append((ov, _source_image(data, 'i:' + hashlib.sha1(data).hexdigest())))
+            except Exception:
+                continue
+    return out
+
+
+# ---------- PDF ----------
+
+def pdf_page(args) -> PageSpec:
+    """
+    Страница черновика -> PageSpec: фон — JPEG в исходном разрешении,
+    оверлеи — отдельными картинками с матрицей преобразования (подписи
+    остаются чёткими при любом масштабе).
+    args = (page, font_dirs, opts); opts: background=False — только оверлеи
+    (для наложения на исходную PDF-страницу), px_per_pt — масштаб документа.
+    """
+    page, font_dirs, opts = args
+    doc_w, doc_h, page_w, page_h, left, top = page_box(page)
+    k = float(opts.get('px_per_pt') or PX_PER_PT)
+    images = {}
+    # Из пикселей документа (ось Y вниз) в пункты страницы
+    ops = [f'{num(1 / k)} 0 0 {num(-1 / k)} {num(-left / k)} {num((page_h + top) / k)} cm\n']
+
+    bg = page_background(page) if opts.get('background', True) else None
+    if bg:
+        try:
+            images['Bg'] = _source_image(bg, 'b:' + hashlib.sha1(bg).hexdigest(), BG_JPEG_QUALITY)
+            ops.append(f'q {num(doc_w)} 0 0 {num(-doc_h)} 0 {num(doc_h)} cm /Bg Do Q\n')
+        except Exception:
+            pass
+
+    for i, (ov, spec) in enumerate(overlay_images(page, font_dirs)):
+        if isinstance(spec, vectorize.Vector):
+            ops.append(vector_ops(ov, spec))
+            continue
+        name = f'Ov{i}'
+        images[name] = spec
+        ops.append(overlay_ops(ov, name))
+
+    return PageSpec(page_w / k, page_h / k, ''.join(ops).encode('ascii'), images)
+
+
+# ---------- Растр ----------
+
+def raster_scale(page: dict, scale: float) -> float:
+    """Масштаб растра с учётом MAX_RASTER_PIXELS"""
+    _, _, page_w, page_h, _, _ = page_box(page)
+    return min(scale, math.sqrt(MAX_RASTER_PIXELS / max(1.0, page_w * page_h)))
+
+
+def raster_page(page: dict, font_dirs: tuple, scale: float) -> Image.Image:
+    """
+    Страница черновика в RGB-картинку: scale — пикселей результата на пиксель
+    документа (как scaleMul в renderPageOffscreen редактора).
+    """
+    doc_w, doc_h, page_w, page_h, left, top = page_box(page)
+    scale = raster_scale(page, scale)
+    W, H = max(1, round(page_w * scale)), max(1, round(page_h * scale))
+    canvas = Image.new('RGB', (W, H), 'white')
+
+    bg = page_background(page)
+    if bg:
+        try:
+            img = open_image(bg)
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+            img = img.resize((max(1, round(doc_w * scale)), max(1, round(doc_h * scale))), Image.LANCZOS)
+            canvas.paste(img, (round(-left * scale), round(-top * scale)), img if img.mode == 'RGBA' else None)
+        except Exception:
+            pass
+
+    for ov, d in _drawable_overlays(page):
+        w, h = float(ov['w']), float(ov['h'])
+        vec = None
+        if ov.get('type') == 'text':
+            sx = sy = 1.0
+        else:
+            sx, sy = float(ov.get('scaleX') or 1), float(ov.get('scaleY') or 1)
+        if _too_big(w * abs(sx) * scale, h * abs(sy) * scale):
+            continue
+        if ov.get('type') == 'text':
+            img = render_text(d, w, h, scale, font_dirs)
+        else:
+            data = decode_data_url(d.get('src'))
+            vec = _vector(data)
+            try:
+                if vec:
+                    # Вектор растрируется сразу в нужном размере, без пересэмплирования
+                    img = vectorize.rasterize(vec, max(1, round(w * abs(sx) * scale)), max(1, round(h * abs(sy) * scale)))
+                else:
+                    img = open_image(data).convert('RGBA') if data else None
+            except Exception:
+                img = None
+            if img is None:
+                continue
+        if not vec:
+            img = img.resize((max(1, round(w * abs(sx) * scale)), max(1, round(h * abs(sy) * scale))), Image.LANCZOS)
+        if sx < 0:
+            img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        if sy < 0:
+            img = img.transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+        a = float(ov.get('angleRad') or 0)
+        if a:
+            # angleRad — по часовой стрелке (ось Y вниз), Image.rotate — против
+            img = img.rotate(-math.degrees(a), Image.BICUBIC, expand=True)
+        x = (float(ov.get('cx') or 0) - left) * scale - img.width / 2
+        y = (float(ov.get('cy') or 0) - top) * scale - img.height / 2
+        canvas.paste(img, (round(x), round(y)), img)
+    return canvas
+
+
+def jpg_page(args) -> bytes:
+    """args = (page, font_dirs, scale, quality) -> JPEG страницы"""
+    page, font_dirs, scale, quality = args
+    scale = raster_scale(page, scale)
+    return encode_jpg(raster_page(page, font_dirs, scale), scale, quality)
+
+
+def encode_jpg(img: Image.Image, scale: float, quality: int) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=quality, optimize=True, dpi=(72 * PX_PER_PT * scale,) * 2)
+    return buf.getvalue()
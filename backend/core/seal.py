@@ -0,0 +1,137 @@
+"""
+Круглая печать по параметрам (в процессах core.workers).
+
+Кольцо: название организации и ИНН/ОГРН по окружности, буквы ставятся
+по одной с поворотом к центру; в центре — до трёх строк текста. Размер
+шрифта кольца подбирается так, чтобы текст занял окружность целиком.
+Рисуется шрифтами EXPORT_FONT_DIRS (render.load_font), результат — PNG
+с прозрачным фоном заданной стороны. Модуль не зависит от Django.
+"""
+import hashlib
+import io
+import json
+import math
+import re
+
+from PIL import Image, ImageColor, ImageDraw
+
+from .render import load_font
+
+# Сторона картинки: превью в форме, библиотека, печать в высоком разрешении
+SIZES = (256, 600, 1200)
+LIBRARY_SIZE = 600
+DEFAULT_COLOR = '#1f3fa0'
+DEFAULT_FONT = 'Arial'
+MAX_ORG = 120
+MAX_CENTER_LINES = 3
+MAX_CENTER_LINE = 40
+# Радиусы в долях половины стороны: внешняя окружность, середина текста кольца, внутренняя
+R_OUTER, R_TEXT, R_INNER = 0.96, 0.80, 0.64
+# Толщина линий в долях стороны и рисование с запасом для сглаживания
+LINE_WIDTH = 0.012
+SUPERSAMPLE = 2
+SEPARATOR = ' • '
+
+
+def normalize(params: dict) -> dict:
+    """Проверенные параметры печати; ValueError с текстом для пользователя"""
+    org = ' '.join(str(params.get('org') or '').split())[:MAX_ORG]
+    if not org:
+        raise ValueError('Укажите название организации')
+    inn = re.sub(r'\D', '', str(params.get('inn') or ''))
+    if inn and len(inn) not in (10, 12):
+        raise ValueError('ИНН — 10 или 12 цифр')
+    ogrn = re.sub(r'\D', '', str(params.get('ogrn') or ''))
+    if ogrn and len(ogrn) not in (13, 15):
+        raise ValueError('ОГРН — 13 или 15 цифр')
+    center = [' '.join(line.split())[:MAX_CENTER_LINE] for line in str(params.get('center') or '').splitlines()]
+    center = [line for line in center if line][:MAX_CENTER_LINES]
+    color = str(params.get('color') or DEFAULT_COLOR)
+    try:
+        ImageColor.getrgb(color)
+    except ValueError:
+        raise ValueError('Некорректный цвет')
+    return {'org': org, 'inn': inn, 'ogrn': ogrn, 'center': center, 'color': color,
+            'font': str(params.get('font') or DEFAULT_FONT)[:40]}
+
+
+def params_hash(params: dict) -> str:
+    """Хэш нормализованных параметров — ключ кэша и ETag"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def ring_text(params: dict) -> str:
+    parts = [params['org']]
+    if params['inn']:
+        parts.append(f'ИНН {params["inn"]}')
+    if params['ogrn']:
+        parts.append(f'ОГРН {params["ogrn"]}')
+    # Разделитель и в конце: текст замыкается в кольцо
+    return SEPARATOR.join(parts) + SEPARATOR
+
+
+def _ring(img: Image.Image, text: str, radius: float, height: float, color, font_args):
+    """Текст по окружности по часовой стрелке, начиная сверху"""
+    family, font_dirs = font_args
+    circumference = 2 * math.pi * radius
+    size = max(6, round(height))
+    font, fake_bold = load_font(family, size, True, False, font_dirs)
+    width = font.getlength(text)
+    # Длинное название уменьшает шрифт, короткое растягивается интервалом
+    if width > circumference:
+        size = max(6, int(size * circumference / width))
+        font, fake_bold = load_font(family, size, True, False, font_dirs)
+        width = font.getlength(text)
+    spacing = (circumference - width) / max(1, len(text))
+    cx, cy = img.width / 2, img.height / 2
+    stroke = max(1, size // 30) if fake_bold else 0
+    pos = 0.0
+    for ch in text:
+        adv = font.getlength(ch)
+        angle = (pos + adv / 2) / radius  # от верхней точки по часовой
+        pos += adv + spacing
+        if not ch.strip():
+            continue
+        tile = Image.new('L', (size * 2, size * 2), 0)
+        ImageDraw.Draw(tile).text((size, size), ch, font=font, fill=255, anchor='mm',
+                                  stroke_width=stroke, stroke_fill=255)
+        tile = tile.rotate(-math.degrees(angle), Image.BICUBIC)
+        x = cx + radius * math.sin(angle) - size
+        y = cy - radius * math.cos(angle) - size
+        img.paste(Image.new('RGBA', tile.size, color), (round(x), round(y)), tile)
+
+
+def render(args) -> bytes:
+    """args = (нормализованные параметры, сторона, font_dirs) -> PNG"""
+    params, side, font_dirs = args
+    S = side * SUPERSAMPLE
+    img = Image.new('RGBA', (S, S), (0, 0, 0, 0))
+    color = ImageColor.getrgb(params['color'])[:3] + (255,)
+    draw = ImageDraw.Draw(img)
+    half, lw = S / 2, max(1, round(S * LINE_WIDTH))
+    for r, w in ((R_OUTER, lw * 2), (R_OUTER - 0.04, lw), (R_INNER, lw)):
+        draw.ellipse((half - r * half, half - r * half, half + r * half, half + r * half), outline=color, width=w)
+
+    # Высота букв кольца — почти весь зазор между окружностями
+    band = (R_OUTER - 0.04 - R_INNER) * half
+    _ring(img, ring_text(params), R_TEXT * half - band * 0.05, band * 0.62, color, (params['font'], font_dirs))
+
+    lines = params['center']
+    if lines:
+        inner = R_INNER * half * 2 * 0.78
+        size = round(inner / max(4, len(lines) * 2.2))
+        font, _ = load_font(params['font'], size, True, False, font_dirs)
+        longest = max(font.getlength(line) for line in lines)
+        if longest > inner:
+            size = max(6, int(size * inner / longest))
+            font, _ = load_font(params['font'], size, True, False, font_dirs)
+        lh = size * 1.2
+        y = half - lh * (len(lines) - 1) / 2
+        for line in lines:
+            draw.text((half, y), line, font=font, fill=color, anchor='mm')
+            y += lh
+
+    img = img.resize((side, side), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, 'PNG', optimize=True)
+    return buf.getvalue()
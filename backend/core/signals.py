@@ -0,0 +1,24 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import GlobalSignImage, KeyRate
+
+
+@receiver(post_save, sender=GlobalSignImage)
+@receiver(post_delete, sender=GlobalSignImage)
+def _reset_default_signs_cache(sender, **kwargs):
+    """
+    Любое изменение глобальной библиотеки (API, админка, shell) сбрасывает
+    закэшированный сериализованный список.
+    """
+    from .views import invalidate_default_signs_cache
+    invalidate_default_signs_cache()
+
+
+@receiver(post_save, sender=KeyRate)
+@receiver(post_delete, sender=KeyRate)
+def _reset_key_rate_cache(sender, **kwargs):
+    """Правка ставки (в т.ч. вручную в админке) сразу видна калькуляторам"""
+    from . import key_rate
+    cache.delete_many([key_rate.LATEST_CACHE_KEY, key_rate.HISTORY_CACHE_KEY])
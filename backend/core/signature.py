@@ -0,0 +1,107 @@
+"""
+Выделение подписи или печати из фото/скана (в процессах core.workers).
+
+Картинка без прозрачности превращается в PNG с альфа-каналом:
+
+- цвет бумаги оценивается по каждому участку страницы — уменьшенная копия,
+  максимум по окрестности и размытие (как фон в core.enhance), поэтому
+  тени и неравномерный свет телефона не становятся «чернилами»;
+- альфа — расстояние цвета пикселя от бумаги: ниже порога шума бумаги
+  пиксель прозрачный, дальше плавно растёт до полной непрозрачности;
+- цвет чернил восстанавливается вычитанием бумаги из полупрозрачных краёв
+  или заменяется на чистый синий/чёрный (ink);
+- картинка обрезается по рамке чернил с небольшим полем.
+
+Всё — операции над массивами NumPy на всю картинку. Модуль не зависит от Django.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+INK_COLORS = {'blue': (18, 42, 160), 'black': (0, 0, 0)}
+# Подписи хватает такой стороны и в экспорте; телефонные 12 Мп не нужны
+MAX_SIDE = 1600
+# Порог альфы: шум бумаги * NOISE_SIGMAS, но не меньше MIN_THRESHOLD;
+# от порога до полной непрозрачности — SOFT_RANGE единиц расстояния цвета
+NOISE_SIGMAS = 4.0
+MIN_THRESHOLD = 24.0
+SOFT_RANGE = 60.0
+# Пиксели с альфой ниже этой доли не расширяют рамку обрезки
+TRIM_ALPHA = 0.25
+TRIM_PAD = 8
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def paper_color(rgb: Image.Image) -> np.ndarray:
+    """Цвет бумаги под каждым пикселем, float32 (h, w, 3)"""
+    w, h = rgb.size
+    k = max(1, min(w, h) // 32)
+    bg = rgb.resize((max(1, w // k), max(1, h // k)), Image.BOX)
+    bg = bg.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.GaussianBlur(2))
+    return np.asarray(bg.resize((w, h), Image.BILINEAR), dtype=np.float32)
+
+
+def ink_alpha(px: np.ndarray, paper: np.ndarray) -> np.ndarray:
+    """Альфа 0..1 по расстоянию от бумаги; порог — по шуму самой бумаги"""
+    dist = np.sqrt(((paper - px) ** 2).sum(axis=-1))
+    # Бумага — нижняя половина расстояний: чернил на подписи заведомо меньше
+    quiet = dist[dist <= np.median(dist)]
+    noise = float(quiet.std()) if quiet.size else 0.0
+    t0 = max(MIN_THRESHOLD, NOISE_SIGMAS * noise)
+    return np.clip((dist - t0) / SOFT_RANGE, 0.0, 1.0)
+
+
+def extract(args):
+    """
+    args = (data, ink) — PNG/JPEG и '' | 'blue' | 'black' ->
+    (png, info) или None: картинка не читается, уже прозрачная или без чернил.
+    info = {"width", "height", "paper": [r, g, b]}
+    """
+    data, ink = args
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None
+    if _has_alpha(img):
+        # Подпись уже подготовлена (редактор вырезает фон сам)
+        return None
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    if max(img.size) > MAX_SIDE:
+        img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+
+    px = np.asarray(img, dtype=np.float32)
+    paper = paper_color(img)
+    alpha = ink_alpha(px, paper)
+
+    ys, xs = np.nonzero(alpha >= TRIM_ALPHA)
+    if not len(ys):
+        return None
+    y0, y1 = max(0, ys.min() - TRIM_PAD), min(img.height, ys.max() + 1 + TRIM_PAD)
+    x0, x1 = max(0, xs.min() - TRIM_PAD), min(img.width, xs.max() + 1 + TRIM_PAD)
+    px, paper, alpha = px[y0:y1, x0:x1], paper[y0:y1, x0:x1], alpha[y0:y1, x0:x1]
+
+    if ink in INK_COLORS:
+        color = np.broadcast_to(np.array(INK_COLORS[ink], dtype=np.float32), px.shape)
+    else:
+        # Пиксель = чернила * a + бумага * (1 - a) -> чернила
+        a = np.maximum(alpha, 1e-3)[..., None]
+        color = np.clip(paper + (px - paper) / a, 0, 255)
+    # Цвет под полностью прозрачными пикселями не виден — нули сжимаются лучше
+    color = np.where(alpha[..., None] > 0, color, 0)
+    out = np.dstack([color, alpha[..., None] * 255]).round().astype(np.uint8)
+
+    buf = io.BytesIO()
+    Image.fromarray(out, 'RGBA').save(buf, 'PNG', optimize=True)
+    info = {
+        'width': int(x1 - x0),
+        'height': int(y1 - y0),
+        'paper': [int(v) for v in np.median(paper.reshape(-1, 3), axis=0)],
+    }
+    return buf.getvalue(), info
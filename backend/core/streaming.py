@@ -0,0 +1,99 @@
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.http import content_disposition_header
+
+_END = object()
+
+
+async def _async_chunks(iterator):
+    # Каждый кусок считается в отдельном потоке: event loop daphne не блокируется
+    step = sync_to_async(lambda: next(iterator, _END), thread_sensitive=False)
+    while True:
+        chunk = await step()
+        if chunk is _END:
+            return
+        yield chunk
+
+
+def streaming_response(request, chunks, content_type, filename=None) -> StreamingHttpResponse:
+    """
+    Потоковый ответ из синхронного генератора. Под ASGI генератор
+    оборачивается в асинхронный — иначе Django соберёт весь ответ в память
+    перед отправкой.
+    """
+    iterator = iter(chunks)
+    raw = getattr(request, '_request', request)
+    content = _async_chunks(iterator) if isinstance(raw, ASGIRequest) else iterator
+    resp = StreamingHttpResponse(content, content_type=content_type)
+    if filename:
+        resp['Content-Disposition'] = content_disposition_header(True, filename)
+    resp['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+FILE_CHUNK = 256 * 1024
+
+
+def _file_chunks(f, start, length):
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(FILE_CHUNK, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def ranged_file_response(request, path, content_type, filename=None, etag=None) -> HttpResponseBase:
+    """
+    Файл с поддержкой Range (один диапазон): прерванная загрузка докачивается
+    с места обрыва. If-Range с устаревшим ETag — отдаётся весь файл.
+    Файл открывается сразу: если его успели удалить (вытеснение из кэша),
+    FileNotFoundError поднимается здесь, а не посреди ответа; открытый
+    дескриптор дочитывается и после удаления.
+    """
+    f = open(path, 'rb')
+    try:
+        return _ranged_response(request, f, os.fstat(f.fileno()).st_size, content_type, filename, etag)
+    except BaseException:
+        f.close()
+        raise
+
+
+def _ranged_response(request, f, size, content_type, filename, etag) -> HttpResponseBase:
+    raw = getattr(request, '_request', request)
+    header = raw.headers.get('Range', '')
+    if_range = raw.headers.get('If-Range')
+    m = _RANGE.match(header.strip()) if header and (not if_range or if_range == etag) else None
+    start, end = 0, size - 1
+    if m and (m.group(1) or m.group(2)):
+        if m.group(1):
+            start = int(m.group(1))
+            end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+        else:
+            start = max(0, size - int(m.group(2)))
+        if start > end or start >= size:
+            f.close()
+            resp = HttpResponse(status=416)
+            resp['Content-Range'] = f'bytes */{size}'
+            return resp
+    else:
+        m = None
+
+    resp = streaming_response(request, _file_chunks(f, start, end - start + 1), content_type, filename)
+    resp['X-Accel-Buffering'] = 'yes'
+    resp['Accept-Ranges'] = 'bytes'
+    resp['Content-Length'] = str(end - start + 1)
+    if etag:
+        resp['ETag'] = etag
+    if m:
+        resp.status_code = 206
+        resp['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return resp
@@ -1,3 +1,1053 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pypdfium2
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image, ImageDraw
+from pypdf import PdfReader, PdfWriter
+from rest_framework.test import APIClient, force_authenticate
+
+from core import autocrop, blobs, export, ingest, key_rate, ocr, office, peni, seal, signature, transcode, export_cache, export_jobs, rasterize, render, vectorize, views, watermark
+from core.management.commands.bench_export import _sample_pdf
+from core.models import ExportJob, GlobalSignImage, KeyRate, Operation, SignImage, SourceDocument, Subscription
+from core.streaming import ranged_file_response
+
+
+class ResolvePageTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.override = override_settings(PAGE_BLOB_DIR=self.tmp.name)
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def test_client_bg_path_is_dropped(self):
+        page = blobs.resolve_page({'bg_path': '/etc/hostname', 'bg_src': ''})
+        self.assertNotIn('bg_path', page)
+        self.assertIsNone(render.page_background(page))
+
+    def test_client_bg_path_is_replaced_by_blob_path(self):
+        sha = blobs.put(b'page', 'jpg')
+        page = blobs.resolve_page({'bg_path': '/etc/hostname', 'bg_src': f'/api/docs/blobs/{sha}.jpg'})
+        self.assertEqual(page['bg_path'], blobs.path_for(sha, 'jpg'))
+        self.assertEqual(render.page_background(page), b'page')
+
+    def test_missing_blob_has_no_path(self):
+        sha = hashlib.sha256(b'missing').hexdigest()
+        page = blobs.resolve_page({'bg_path': '/etc/hostname', 'bg_src': f'/api/docs/blobs/{sha}.png'})
+        self.assertNotIn('bg_path', page)
+
+    def test_non_blob_urls_are_ignored(self):
+        for src in ('/api/docs/blobs/../../etc/passwd.jpg', 'file:///etc/passwd', os.devnull):
+            self.assertNotIn('bg_path', blobs.resolve_page({'bg_src': src}))
+
+
+def _blank_pdf(width_pt, height_pt) -> bytes:
+    w = PdfWriter()
+    w.add_blank_page(width=width_pt, height=height_pt)
+    buf = io.BytesIO()
+    w.write(buf)
+    return buf.getvalue()
+
+
+class RasterizeLimitsTests(SimpleTestCase):
+    def _render(self, width_pt, height_pt):
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as f:
+            f.write(_blank_pdf(width_pt, height_pt))
+            f.flush()
+            return rasterize.pdf_page((f.name, 0, rasterize.PDF_RENDER_SCALE, rasterize.JPEG_QUALITY))
+
+    def test_regular_page_keeps_editor_scale(self):
+        w, h, _, _ = self._render(595, 842)
+        self.assertEqual((w, h), (1785, 2526))
+
+    def test_huge_page_is_scaled_down_to_pixel_cap(self):
+        w, h, _, _ = self._render(5000, 5000)
+        self.assertLessEqual(w * h, render.MAX_RASTER_PIXELS)
+        self.assertGreater(w * h, render.MAX_RASTER_PIXELS * 0.9)
+
+    def test_page_beyond_cap_is_rejected(self):
+        with self.assertRaises(rasterize.PageTooLarge):
+            self._render(14400, 14400 * 4)
+
+
+def _svg_overlay(view_box: str) -> dict:
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {view_box}">'
+           '<path fill="#102030" fill-rule="evenodd" d="M0 0q2 0 4 0 0 2 0 4-2 0-4 0z"/></svg>')
+    return {'id': 's', 'type': 'image', 'cx': 100, 'cy': 100, 'w': 50, 'h': 50, 'scaleX': 1, 'scaleY': 1,
+            'angleRad': 0, 'data': {'src': 'data:image/svg+xml;base64,' + base64.b64encode(svg.encode()).decode()}}
+
+
+class VectorOverlayTests(SimpleTestCase):
+    def test_parse_rejects_degenerate_view_box(self):
+        for vb in ('0 10', '10 0', '. 10', '1000000 10'):
+            svg = _svg_overlay(vb)['data']['src']
+            self.assertIsNone(vectorize.parse(render.decode_data_url(svg)), vb)
+
+    def test_degenerate_svg_does_not_break_export(self):
+        for vb in ('8 8', '0 8'):
+            page = {'docWidth': 200, 'docHeight': 200, 'overlays': [_svg_overlay(vb)]}
+            spec = render.pdf_page((page, (), {}))
+            self.assertNotIn(b'nan', spec.content)
+            self.assertNotIn(b'inf', spec.content)
+            self.assertEqual(render.raster_page(page, (), 1.0).size, (200, 200))
+
+
+class OverlayGeometryTests(SimpleTestCase):
+    page = {'docWidth': 200, 'docHeight': 200}
+
+    def _text(self, **kw):
+        ov = {'id': 't', 'type': 'text', 'cx': 100, 'cy': 100, 'w': 80, 'h': 30, 'scaleX': 1, 'scaleY': 1,
+              'angleRad': 0, 'data': {'text': 'Подпись', 'fontSize': 20}}
+        ov.update(kw)
+        return dict(self.page, overlays=[ov])
+
+    def _check(self, page):
+        spec = render.pdf_page((page, (), {}))
+        for bad in (b'nan', b'inf'):
+            self.assertNotIn(bad, spec.content.lower())
+        self.assertEqual(render.raster_page(page, (), 1.0).size, (200, 200))
+        return spec
+
+    def test_number(self):
+        self.assertEqual(render.number('12.5'), 12.5)
+        for bad in ('nan', 'inf', '-inf', 'abc', None, [], {}):
+            self.assertEqual(render.number(bad, 7), 7, bad)
+        self.assertEqual(render.number(1e300), render.DOC_MAX)
+        self.assertEqual(render.number(-5, lo=0), 0)
+
+    def test_garbage_geometry_is_sanitized(self):
+        for kw in ({'cx': 'nan'}, {'cy': float('inf')}, {'w': 'abc'}, {'scaleX': 'nan'}, {'angleRad': 'inf'},
+                   {'angleRad': 1e300}, {'data': {'text': 'x', 'fontSize': 'nan'}}, {'data': 'junk'}):
+            self._check(self._text(**kw))
+        vec = _svg_overlay('8 8')
+        vec.update(cx='nan', scaleY=float('-inf'))
+        self._check(dict(self.page, overlays=[vec]))
+
+    def test_oversized_overlay_is_skipped(self):
+        spec = self._check(self._text(w=90000, h=90000))
+        self.assertEqual(spec.images, {})
+        vec = _svg_overlay('8 8')
+        vec.update(w=10000, h=10000, scaleX=100, scaleY=100)
+        self._check(dict(self.page, overlays=[vec]))
+
+    def test_garbage_page_size_uses_default(self):
+        self.assertEqual(render.page_box({'docWidth': 'nan', 'docHeight': -5})[:2], (1000, 1))
+
+
+def _body(resp) -> bytes:
+    return b''.join(resp.streaming_content) if resp.streaming else resp.content
+
+
+class TempDirMixin:
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        override = override_settings(EXPORT_CACHE_DIR=os.path.join(self.dir, 'cache'), EXPORT_CACHE_MAX_BYTES=10 ** 9)
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+class RangedFileResponseTests(TempDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.dir, 'f.bin')
+        with open(self.path, 'wb') as f:
+            f.write(bytes(range(100)))
+        self.rf = RequestFactory()
+
+    def _get(self, **headers):
+        return ranged_file_response(self.rf.get('/', headers=headers), self.path, 'application/pdf', etag='"e"')
+
+    def test_full_file(self):
+        resp = self._get()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Length'], '100')
+        self.assertEqual(_body(resp), bytes(range(100)))
+
+    def test_ranges(self):
+        resp = self._get(Range='bytes=10-19')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(_body(resp), bytes(range(10, 20)))
+        self.assertEqual(_body(self._get(Range='bytes=90-')), bytes(range(90, 100)))
+        self.assertEqual(_body(self._get(Range='bytes=-5')), bytes(range(95, 100)))
+
+    def test_unsatisfiable_range(self):
+        resp = self._get(Range='bytes=100-')
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp['Content-Range'], 'bytes */100')
+
+    def test_stale_if_range_sends_whole_file(self):
+        resp = self._get(Range='bytes=10-19', **{'If-Range': '"old"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(_body(resp)), 100)
+
+    def test_missing_file_raises_before_response(self):
+        os.remove(self.path)
+        with self.assertRaises(FileNotFoundError):
+            self._get()
+
+    def test_file_removed_after_open_is_still_served(self):
+        resp = self._get()
+        os.remove(self.path)
+        self.assertEqual(_body(resp), bytes(range(100)))
+
+
+class ExportCacheTests(TempDirMixin, SimpleTestCase):
+    snap = {'pages': [{'id': 'p1', 'docWidth': 10, 'docHeight': 10}]}
+
+    def test_key_depends_on_params_and_pages(self):
+        k = export_cache.cache_key('pdf', self.snap, 'doc')
+        self.assertEqual(k, export_cache.cache_key('pdf', self.snap, 'doc'))
+        self.assertNotEqual(k, export_cache.cache_key('pdf', self.snap, 'doc', {'watermark': True}))
+        self.assertNotEqual(k, export_cache.cache_key('pdf', {'pages': [dict(self.snap['pages'][0], rotation=1)]}, 'doc'))
+
+    def test_store_only_when_fully_consumed(self):
+        chunks = export_cache.iter_store('a', 'pdf', iter([b'1', b'2']))
+        next(chunks)
+        chunks.close()
+        self.assertIsNone(export_cache.lookup('a', 'pdf'))
+        self.assertEqual(b''.join(export_cache.iter_store('a', 'pdf', iter([b'1', b'2']))), b'12')
+        with open(export_cache.lookup('a', 'pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'12')
+        self.assertEqual([e.name for e in os.scandir(export_cache._dir())], ['a.pdf'])
+
+    def test_evict_removes_least_recently_read(self):
+        for key in ('old', 'new'):
+            b''.join(export_cache.iter_store(key, 'pdf', iter([b'x' * 100])))
+        past = time.time() - 100
+        os.utime(export_cache.path_for('old', 'pdf'), (past, past))
+        os.utime(export_cache.path_for('new', 'pdf'), (past, past))
+        export_cache.lookup('old', 'pdf')  # попадание продлевает жизнь
+        self.assertEqual(export_cache.evict(max_bytes=150), 1)
+        self.assertIsNotNone(export_cache.lookup('old', 'pdf'))
+        self.assertIsNone(export_cache.lookup('new', 'pdf'))
+
+
+class ExportResponseTests(TempDirMixin, SimpleTestCase):
+    snap = {'pages': [{'id': 'p1', 'docWidth': 10, 'docHeight': 10}]}
+
+    def _response(self):
+        request = RequestFactory().post('/')
+        request.user = SimpleNamespace(pk=1)
+        return views._export_response(request, 'pdf', self.snap, 'doc', {}, lambda: iter([b'%PDF', b'-1.7']))
+
+    def test_miss_then_hit(self):
+        resp = self._response()
+        self.assertEqual((resp['X-Export-Cache'], _body(resp)), ('miss', b'%PDF-1.7'))
+        resp = self._response()
+        self.assertEqual((resp['X-Export-Cache'], _body(resp)), ('hit', b'%PDF-1.7'))
+
+    def test_evicted_between_lookup_and_open_renders_again(self):
+        b''.join(self._response().streaming_content)
+        real_lookup = export_cache.lookup
+
+        def lookup_then_evict(key, kind):
+            path = real_lookup(key, kind)
+            export_cache.evict(max_bytes=0)
+            return path
+
+        with mock.patch.object(export_cache, 'lookup', lookup_then_evict):
+            resp = self._response()
+        self.assertEqual((resp['X-Export-Cache'], _body(resp)), ('miss', b'%PDF-1.7'))
+
+
+class ExportJobMixin:
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(EXPORT_JOB_DIR=os.path.join(tmp.name, 'jobs'),
+                                     EXPORT_CACHE_DIR=os.path.join(tmp.name, 'cache'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = get_user_model().objects.create_user('jobs', 'jobs@example.com', 'pw')
+        self.sub = Subscription.objects.create(user=self.user, plan='single', downloads_left=0)
+
+    def _job(self, **kw):
+        op = Operation.objects.create(user=self.user, kind='download_pdf', pages=1)
+        fields = dict(user=self.user, kind='pdf', snapshot={'pages': [{'id': 'p1'}]}, pages=1,
+                      operation=op, subscription=self.sub)
+        fields.update(kw)
+        return ExportJob.objects.create(**fields)
+
+
+class ExportJobTests(ExportJobMixin, TestCase):
+    def test_process_writes_file(self):
+        self._job()
+        job = export_jobs.claim()
+        with mock.patch.object(export, 'iter_pdf', return_value=iter([b'%PDF', b'-1.7'])):
+            export_jobs.process(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        with open(job.file_path, 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF-1.7')
+        self.assertEqual(os.listdir(os.path.dirname(job.file_path)), [os.path.basename(job.file_path)])
+
+    def test_failed_job_is_refunded(self):
+        self._job()
+        job = export_jobs.claim()
+        with mock.patch.object(export, 'iter_pdf', side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.export_jobs', 'ERROR'):
+            export_jobs.process(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'boom'))
+        self.assertFalse(Operation.objects.exists())
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.downloads_left, 1)
+        self.assertEqual(os.listdir(settings.EXPORT_JOB_DIR), [])
+
+    def test_stale_job_is_requeued_then_failed(self):
+        job = self._job(status='running', attempts=1, heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(export_jobs.requeue_stale(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+
+        ExportJob.objects.filter(pk=job.pk).update(
+            status='running', attempts=export_jobs.MAX_ATTEMPTS, heartbeat_at=timezone.now() - timedelta(hours=1),
+        )
+        export_jobs.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(Operation.objects.exists())
+
+    def test_live_job_is_not_requeued(self):
+        self._job(status='running', attempts=1, heartbeat_at=timezone.now())
+        self.assertEqual(export_jobs.requeue_stale(), 0)
+
+    def test_lost_lease_drops_result(self):
+        self._job()
+        first = export_jobs.claim()
+        # Воркер завис, задачу вернули в очередь и взял другой воркер
+        ExportJob.objects.filter(pk=first.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        export_jobs.requeue_stale()
+        second = export_jobs.claim()
+        self.assertEqual(second.attempts, 2)
+
+        with mock.patch.object(export, 'iter_pdf', side_effect=RuntimeError('late')), \
+                self.assertLogs('core.export_jobs', 'WARNING') as logs:
+            export_jobs.process(first)
+        self.assertIn('lost its lease', logs.output[-1])
+        job = ExportJob.objects.get(pk=first.pk)
+        self.assertEqual(job.status, 'running')
+        self.assertTrue(Operation.objects.exists())
+
+        with mock.patch.object(export, 'iter_pdf', return_value=iter([b'%PDF'])):
+            export_jobs.process(second)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.downloads_left, 0)
+
+
+class ExportJobHeartbeatTests(ExportJobMixin, TransactionTestCase):
+    def test_heartbeat_while_finalizing(self):
+        self._job()
+        job = export_jobs.claim()
+        claimed_at = job.heartbeat_at
+
+        def slow_pdf(*args, **kwargs):
+            # Долгая сборка файла после последней страницы: прогресса нет
+            time.sleep(0.5)
+            yield b'%PDF'
+
+        with mock.patch.object(export_jobs, 'HEARTBEAT_INTERVAL', 0.1), \
+                mock.patch.object(export, 'iter_pdf', slow_pdf):
+            export_jobs.process(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertGreater(job.heartbeat_at, claimed_at)
+
+
+class ExportRefundTests(TempDirMixin, TestCase):
+    snap = {'pages': [{'id': 'p1', 'docWidth': 10, 'docHeight': 10}], 'client_id': 'c1'}
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user('refund', 'refund@example.com', 'pw')
+        self.sub = Subscription.objects.create(user=self.user, plan='single', downloads_left=1, single_client_id='c1')
+        for name, value in (('draft_snapshot', self.snap), ('source_shas', set()), ('load_sources', {})):
+            patcher = mock.patch.object(export, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _export(self, chunks):
+        request = RequestFactory().post('/', {'mode': 'paid'}, content_type='application/json')
+        force_authenticate(request, user=self.user)
+        with mock.patch.object(export, 'iter_pdf', side_effect=chunks):
+            resp = views.ExportPDFView.as_view()(request)
+            self.assertEqual(resp.status_code, 200)
+            return b''.join(resp.streaming_content)
+
+    def test_failed_render_is_refunded(self):
+        def broken(*args, **kw):
+            yield b'%PDF'
+            raise RuntimeError('boom')
+
+        with self.assertRaises(RuntimeError), self.assertLogs('core.views', 'ERROR'):
+            self._export(broken)
+        self.assertFalse(Operation.objects.exists())
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.downloads_left, 1)
+
+    def test_successful_render_is_charged(self):
+        self.assertEqual(self._export(lambda *a, **kw: iter([b'%PDF', b'-1.7'])), b'%PDF-1.7')
+        self.assertEqual(Operation.objects.get().kind, 'download_pdf')
+        self.sub.refresh_from_db()
+        self.assertEqual(self.sub.downloads_left, 0)
+
+
+class EnhanceStateTests(TestCase):
+    """Состояние улучшений в черновике присылает клиент — мусор отбрасывается, а не роняет сохранение"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('enh', 'enh@example.com', 'pw'))
+
+    def _page(self, enhance, **kw):
+        page = {'id': 'p1', 'docWidth': 400, 'docHeight': 300, 'enhance': enhance,
+                'overlays': [{'id': 'o', 'type': 'text', 'cx': 200, 'cy': 150, 'w': 10, 'h': 10}]}
+        page.update(kw)
+        return page
+
+    def test_garbage_state_is_saved(self):
+        for state in ({'modes': [], 'orig_size': 5},
+                      {'modes': ['deskew'], 'applied': 5},
+                      {'modes': [], 'applied': ['crop'], 'orig_size': [1]},
+                      {'modes': [], 'applied': ['crop'], 'orig_size': ['a', None]},
+                      {'modes': [], 'applied': ['crop'], 'orig_size': [800, 600]}):
+            resp = self.client.post('/api/draft/save/', {'data': {'pages': [self._page(state, docWidth='wide')]}},
+                                    format='json')
+            self.assertEqual(resp.status_code, 200, state)
+
+    def test_undo_restores_valid_orig_size_only(self):
+        page = self._page({'modes': [], 'applied': ['crop'], 'orig_size': [800, '600']}, bg_src='x')
+        ingest.apply_enhancements([page], '')
+        self.assertEqual((page['docWidth'], page['docHeight']), (800, 600))
+        self.assertEqual((page['overlays'][0]['cx'], page['overlays'][0]['cy']), (400, 300))
+        for bad in (5, [1], [0, 10], ['a', 10], [1, 2, 3]):
+            page = self._page({'modes': [], 'applied': ['crop'], 'orig_size': bad}, bg_src='x')
+            ingest.apply_enhancements([page], '')
+            self.assertEqual((page['docWidth'], page['docHeight'], page['enhance']), (400, 300, {'modes': []}), bad)
+
+
+FAKE_SOFFICE = """#!{python}
+import os, sys, time
+args = sys.argv[1:]
+mode = os.environ.get('FAKE_SOFFICE_MODE', '')
+with open(os.environ['FAKE_SOFFICE_LOG'], 'a') as f:
+    f.write(('init' if '--terminate_after_init' in args else 'convert') + '\\n')
+if '--terminate_after_init' in args:
+    time.sleep(5 if mode == 'hang_init' else 0)
+    sys.exit(0)
+if mode == 'hang':
+    time.sleep(5)
+if mode == 'fail':
+    sys.exit(1)
+src, outdir = args[-1], args[args.index('--outdir') + 1]
+with open(os.path.join(outdir, os.path.splitext(os.path.basename(src))[0] + '.pdf'), 'wb') as f:
+    f.write(b'%PDF-' + open(src, 'rb').read())
+"""
+
+
+@mock.patch.object(office, 'uno', None)
+class OfficePoolTests(SimpleTestCase):
+    """Пул без uno против фейкового soffice (скрипт, который пишет PDF или зависает)"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.binary, self.log = os.path.join(tmp.name, 'soffice'), os.path.join(tmp.name, 'calls')
+        with open(self.binary, 'w') as f:
+            f.write(FAKE_SOFFICE.format(python=sys.executable))
+        os.chmod(self.binary, 0o755)
+        env = mock.patch.dict(os.environ, {'FAKE_SOFFICE_LOG': self.log, 'FAKE_SOFFICE_MODE': ''})
+        env.start()
+        self.addCleanup(env.stop)
+        self.pool = office.OfficePool(1, self.binary, tmp.name)
+        self.addCleanup(self.pool.close)
+
+    def _calls(self):
+        with open(self.log) as f:
+            return f.read().split()
+
+    def test_converts_with_prepared_profile(self):
+        with override_settings(OFFICE_JOBS_PER_INSTANCE=2):
+            for i in range(3):
+                self.assertEqual(self.pool.convert(b'doc%d' % i, 'docx', timeout=10, wait=1), b'%%PDF-doc%d' % i)
+        self.assertEqual(self._calls(), ['init', 'convert', 'convert', 'init', 'convert'])
+
+    def test_start_timeout_is_office_error(self):
+        os.environ['FAKE_SOFFICE_MODE'] = 'hang_init'
+        with mock.patch.object(office, 'START_TIMEOUT', 0.3), self.assertRaises(office.OfficeError):
+            self.pool.convert(b'doc', 'docx', timeout=10, wait=1)
+
+    def test_missing_binary_is_unavailable(self):
+        pool = office.OfficePool(1, self.binary + '-missing', os.path.dirname(self.binary))
+        with self.assertRaises(office.OfficeUnavailable):
+            pool.convert(b'doc', 'docx', timeout=10, wait=1)
+
+    def test_failures_are_conversion_errors(self):
+        for mode in ('hang', 'fail'):
+            os.environ['FAKE_SOFFICE_MODE'] = mode
+            with self.assertRaises(office.ConversionError, msg=mode):
+                self.pool.convert(b'doc', 'docx', timeout=0.5, wait=1)
+
+    def test_busy_pool(self):
+        inst = self.pool._acquire(1)
+        self.addCleanup(self.pool._idle.put, inst)
+        with self.assertRaises(office.OfficeBusy):
+            self.pool.convert(b'doc', 'docx', timeout=10, wait=0.1)
+
+
+class TranscodeTests(SimpleTestCase):
+    """Штриховые и графические фоны перекодируются без потерь"""
+
+    def _roundtrip(self, img, kind):
+        data, ext, got = transcode.encode(img)
+        self.assertEqual((ext, got), ('png' if kind != 'photo' else 'jpg', kind))
+        out = Image.open(io.BytesIO(data))
+        if kind != 'photo':
+            self.assertTrue(np.array_equal(np.asarray(out.convert('RGB')), np.asarray(img.convert('RGB'))))
+        return out
+
+    def test_scan_keeps_gray_levels(self):
+        a = np.full((400, 300), 255, np.uint8)
+        a[50:60, 20:280] = 0
+        a[60:62, 20:280] = 140  # сглаженный край строки
+        a[100:110, 20:200] = 90
+        self.assertEqual(self._roundtrip(Image.fromarray(a), 'bilevel').mode, 'P')
+
+    def test_pure_black_and_white_is_one_bit(self):
+        a = np.full((400, 300), 255, np.uint8)
+        a[::7, :] = 0
+        self.assertEqual(self._roundtrip(Image.fromarray(a).convert('RGB'), 'bilevel').mode, '1')
+
+    def test_antialiased_graphics_keeps_all_colors(self):
+        a = np.zeros((300, 600, 3), np.uint8)
+        a[...] = (20, 90, 200)
+        a[:, :, 0] = np.arange(600, dtype=np.uint16)[None, :] * 255 // 599
+        a[:, :, 1] = (np.arange(300)[:, None] * 255 // 299).astype(np.uint8)
+        img = Image.fromarray(a)
+        self.assertIsNone(img.getcolors(256))
+        self.assertEqual(self._roundtrip(img, 'graphics').mode, 'RGB')
+
+    def test_few_colors_use_exact_palette(self):
+        a = np.zeros((200, 200, 3), np.uint8)
+        for i, color in enumerate([(250, 10, 10), (10, 250, 10), (17, 33, 201), (255, 255, 255)]):
+            a[i * 50:(i + 1) * 50] = color
+        self.assertEqual(self._roundtrip(Image.fromarray(a), 'graphics').mode, 'P')
+
+    def test_photo_is_jpeg(self):
+        rng = np.random.default_rng(0)
+        self._roundtrip(Image.fromarray(rng.integers(0, 255, (200, 200, 3), dtype=np.uint8)), 'photo')
+
+
+class KeyRateRefreshTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_fetch_runs_outside_transaction_single_flight(self):
+        started, release = threading.Event(), threading.Event()
+        seen = []
+
+        def slow_history(start, end):
+            seen.append(connection.in_atomic_block)
+            started.set()
+            release.wait(5)
+            return [(date(2024, 1, 1), Decimal('16')), (date(2024, 7, 29), Decimal('18'))]
+
+        with mock.patch.object(key_rate, 'fetch_history', slow_history), \
+                mock.patch.object(key_rate, 'fetch_current', return_value=(date(2024, 7, 29), Decimal('18'))):
+            results = []
+            t = threading.Thread(target=lambda: (results.append(key_rate.refresh()), connection.close()))
+            t.start()
+            self.assertTrue(started.wait(5))
+            # Второй процесс не ждёт и не ходит в ЦБ, пока идёт первый запрос
+            self.assertFalse(key_rate.refresh())
+            release.set()
+            t.join(5)
+        self.assertEqual(results, [True])
+        self.assertEqual(seen, [False])
+        self.assertEqual(list(KeyRate.objects.order_by('date').values_list('rate', flat=True)), [16, 18])
+        self.assertIsNone(cache.get(key_rate.REFRESH_LOCK_KEY))
+
+    def test_failed_fetch_releases_flag(self):
+        with mock.patch.object(key_rate, 'fetch_history', side_effect=RuntimeError('down')), \
+                mock.patch.object(key_rate, 'fetch_current', side_effect=RuntimeError('down')), \
+                self.assertLogs('core.key_rate', 'WARNING'):
+            self.assertFalse(key_rate.refresh())
+        self.assertIsNone(cache.get(key_rate.REFRESH_LOCK_KEY))
+
+    def test_history_view_reads_cache(self):
+        KeyRate.objects.create(date=date(2024, 1, 1), rate=Decimal('16'))
+        client = APIClient()
+        self.assertEqual(client.get('/api/utils/key-rate/history/').json(), [{'date': '2024-01-01', 'keyRate': 16.0}])
+        # update() минует сигнал сброса кэша — ответ остаётся прежним и без запросов к БД
+        KeyRate.objects.update(rate=Decimal('15'))
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/utils/key-rate/history/').json()[0]['keyRate'], 16.0)
+
+        with mock.patch.object(key_rate, 'fetch_history', return_value=[]), \
+                mock.patch.object(key_rate, 'fetch_current', return_value=(date(2024, 7, 29), Decimal('18'))):
+            self.assertTrue(key_rate.refresh())
+        # Обновление сбрасывает кэш
+        self.assertEqual(len(client.get('/api/utils/key-rate/history/').json()), 2)
+
+
+def _calculator_peni(amount, days, rate, mode, entity):
+    """Расчёт калькулятора Calculators.jsx: отрезки по одной ставке, каждый округлён до копеек"""
+    if mode == 'tax' and entity == 'person':
+        segs = [(days, 300)]
+    elif mode == 'tax':
+        segs = [(min(days, 30), 300), (max(days - 30, 0), 150)]
+    elif mode == 'salary':
+        segs = [(days, 150)]
+    else:
+        segs = [(min(days, 30), 0), (min(max(days - 30, 0), 60), 300), (max(days - 90, 0), 130)]
+    return round(sum(round(amount * rate / 100 * d / denom, 2) for d, denom in segs if denom), 2)
+
+
+class PeniTests(SimpleTestCase):
+    DAYS = (0, 1, 29, 30, 31, 60, 89, 90, 91, 365)
+
+    def test_matches_calculator_segments(self):
+        hist = [(date(2020, 1, 1), 16.0)]
+        due = date(2024, 1, 10)
+        pays = [due + timedelta(days=n) for n in self.DAYS]
+        for mode, entity in (('tax', 'org'), ('tax', 'person'), ('salary', 'org'), ('utilities', 'org')):
+            with self.subTest(mode=mode, entity=entity):
+                days, res = peni.compute([123456.78] * len(pays), [due.toordinal()] * len(pays),
+                                         [p.toordinal() for p in pays], mode, entity, hist)
+                self.assertEqual(days.tolist(), list(self.DAYS))
+                for n, got in zip(self.DAYS, res.tolist()):
+                    # Калькулятор округляет каждый отрезок отдельно — расхождение не больше копейки
+                    self.assertAlmostEqual(got, _calculator_peni(123456.78, n, 16.0, mode, entity), delta=0.011)
+
+    def test_rate_changes_inside_overdue(self):
+        hist = [(date(2024, 1, 1), 16.0), (date(2024, 2, 1), 20.0)]
+        due, pay = date(2024, 1, 10), date(2024, 3, 1)
+        _, res = peni.compute([1000.0], [due.toordinal()], [pay.toordinal()], 'tax', 'org', hist)
+        expected = 0.0
+        for n in range(1, (pay - due).days + 1):
+            day = due + timedelta(days=n)
+            rate = 20.0 if day >= date(2024, 2, 1) else 16.0
+            expected += 1000.0 * rate / 100 / (300 if n <= 30 else 150)
+        self.assertEqual(res.tolist(), [round(expected, 2)])
+
+    def test_rows_report_errors(self):
+        out = peni.compute_rows([
+            {'amount': '1 000,50', 'due': '10.01.2024', 'pay': '2024-01-20'},
+            {'amount': 'x', 'due': '2024-01-10', 'pay': '2024-01-20'},
+            {'amount': 1, 'due': '2024-01-20', 'pay': '2024-01-10'},
+        ], hist=[(date(2020, 1, 1), 16.0)])
+        self.assertEqual((out[0]['days'], out[0]['peni']), (10, _calculator_peni(1000.5, 10, 16.0, 'tax', 'org')))
+        self.assertEqual([r['error'] for r in out[1:]], ['Некорректная сумма', 'Дата погашения раньше срока уплаты'])
+
+
+class DefaultSignsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('signs', 'signs@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+        self.g1 = GlobalSignImage.objects.create(kind='signature', data=b'png-1')
+        self.g2 = GlobalSignImage.objects.create(kind='round_seal', data=b'png-2')
+
+    def _defaults(self):
+        return [i['gid'] for i in self.client.get('/api/library/signs/').json() if i['is_default']]
+
+    def test_library_is_cached_and_hidden_filtered_per_user(self):
+        self.assertEqual(self.client.post('/api/library/default-signs/hide/', {'sign_id': self.g1.pk, 'hide': True},
+                                          format='json').status_code, 200)
+        self.assertEqual(self._defaults(), [self.g2.pk])
+        # Из БД читаются только подписи пользователя и его скрытые элементы
+        with self.assertNumQueries(2):
+            self.assertEqual(self._defaults(), [self.g2.pk])
+
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user('other', 'other@example.com', 'pw'))
+        self.assertEqual(sorted(i['gid'] for i in other.get('/api/library/signs/').json()), [self.g1.pk, self.g2.pk])
+
+    def test_changes_reset_cache(self):
+        self._defaults()
+        g3 = GlobalSignImage.objects.create(kind='signature', data=b'png-3')
+        self.assertIn(g3.pk, self._defaults())
+        g3.mime = 'image/jpeg'
+        g3.save()
+        item = next(i for i in self.client.get('/api/library/signs/').json() if i.get('gid') == g3.pk)
+        self.assertTrue(item['url'].startswith('data:image/jpeg;'))
+        g3.delete()
+        self.assertNotIn(g3.pk, self._defaults())
+
+
+def _png_data_url(img: Image.Image) -> str:
+    buf = io.BytesIO()
+    img.save(buf, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+@override_settings(RENDER_WORKERS=0)
+class StampedExportTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('src', 'src@example.com', 'pw')
+        self.data = _sample_pdf(2)
+        self.sha = export.save_source(self.user, self.data, 'doc.pdf').sha256
+
+    def _page(self, i, **kw):
+        # Фон в редакторе — страница A4 при PDF_RENDER_SCALE = 3
+        page = {'id': f'p{i}', 'docWidth': 595 * 3, 'docHeight': 842 * 3, 'bg_src': '',
+                'src_pdf': {'sha': self.sha, 'index': i},
+                'overlays': [{'id': 's', 'type': 'image', 'cx': 300, 'cy': 300, 'w': 300, 'h': 300,
+                              'scaleX': 1, 'scaleY': 1, 'angleRad': 0,
+                              'data': {'src': _png_data_url(Image.new('RGB', (30, 30), 'red'))}}]}
+        page.update(kw)
+        return page
+
+    def _export(self, pages):
+        snap = {'pages': pages}
+        return b''.join(export.iter_pdf(snap, 'doc', export.load_sources(self.user, snap)))
+
+    def test_overlay_stamped_onto_source_page(self):
+        out = self._export([self._page(0), self._page(1)])
+        reader = PdfReader(io.BytesIO(out))
+        self.assertEqual(len(reader.pages), 2)
+        for i, page in enumerate(reader.pages):
+            self.assertEqual([float(v) for v in page.mediabox], [0, 0, 595, 842])
+            # Текстовый слой исходника сохранился
+            self.assertIn(f'Page {i + 1}, line 1:', page.extract_text())
+        # Оверлей 300x300 px в левом верхнем углу — это 100x100 pt от (0, 842)
+        doc = pypdfium2.PdfDocument(out)
+        self.addCleanup(doc.close)
+        img = doc[0].render(scale=1).to_pil().convert('RGB')
+        self.assertEqual(img.getpixel((50, 50)), (255, 0, 0))
+        self.assertNotEqual(img.getpixel((150, 150)), (255, 0, 0))
+
+    def test_mismatched_or_missing_source_falls_back_to_raster(self):
+        other = dict(self._page(0), src_pdf={'sha': 'f' * 64, 'index': 0})
+        reader = PdfReader(io.BytesIO(self._export([self._page(0, docWidth=1000, docHeight=1000), self._page(5), other])))
+        self.assertEqual(len(reader.pages), 3)
+        for page in reader.pages:
+            self.assertEqual(page.extract_text().strip(), '')
+
+    def test_source_is_deduplicated_and_pruned(self):
+        self.assertEqual(export.save_source(self.user, self.data).sha256, self.sha)
+        self.assertEqual(SourceDocument.objects.filter(user=self.user).count(), 1)
+        with override_settings(SOURCE_KEEP_PER_USER=2):
+            for n in (3, 4):
+                export.save_source(self.user, _sample_pdf(n))
+        self.assertEqual(sorted(SourceDocument.objects.values_list('pages', flat=True)), [3, 4])
+        with self.assertRaises(export.SourceError), self.assertLogs('pypdf', 'WARNING'):
+            export.save_source(self.user, b'not a pdf')
+
+
+@override_settings(RENDER_WORKERS=0)
+class JpgZipExportTests(SimpleTestCase):
+    snap = {'pages': [
+        {'id': 'p1', 'docWidth': 300, 'docHeight': 150, 'bg_src': _png_data_url(Image.new('RGB', (300, 150), 'red'))},
+        {'id': 'p2', 'docWidth': 150, 'docHeight': 300},
+    ]}
+
+    def test_pages_are_stored_in_order(self):
+        out = b''.join(export.iter_jpg_zip(self.snap, 'doc', dpi=72, quality=80))
+        with zipfile.ZipFile(io.BytesIO(out)) as zf:
+            infos = zf.infolist()
+            self.assertEqual([i.filename for i in infos], ['doc-p1.jpg', 'doc-p2.jpg'])
+            self.assertEqual({i.compress_type for i in infos}, {zipfile.ZIP_STORED})
+            first, second = (Image.open(io.BytesIO(zf.read(i))) for i in infos)
+        # 72 dpi — треть пикселя документа (PDF_RENDER_SCALE = 3)
+        self.assertEqual((first.format, first.size, second.size), ('JPEG', (100, 50), (50, 100)))
+        r, g, b = first.convert('RGB').getpixel((50, 25))
+        self.assertGreater(r, 200)
+        self.assertLess(max(g, b), 60)
+
+    def test_each_page_is_flushed_before_next_render(self):
+        rendered = []
+
+        def fake_page(args):
+            rendered.append(args[0]['id'])
+            return b'jpeg-' + args[0]['id'].encode()
+
+        with mock.patch.object(render, 'jpg_page', fake_page):
+            gen = export.iter_jpg_zip(self.snap, 'doc')
+            chunk = next(gen)
+            # Первая страница уже в потоке, вторая ещё не рендерилась
+            self.assertIn(b'doc-p1.jpgjpeg-p1', chunk)
+            self.assertEqual(rendered, ['p1'])
+            rest = b''.join(gen)
+        self.assertEqual(rendered, ['p1', 'p2'])
+        with zipfile.ZipFile(io.BytesIO(chunk + rest)) as zf:
+            self.assertEqual(zf.read('doc-p2.jpg'), b'jpeg-p2')
+            self.assertIsNone(zf.testzip())
+
+
+class ExportJpgParamsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user('jpg', 'jpg@example.com', 'pw'))
+        patcher = mock.patch.object(export, 'draft_snapshot', return_value=JpgZipExportTests.snap)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_out_of_range_params_are_rejected_before_charge(self):
+        for body in ({'dpi': 10}, {'dpi': 600}, {'quality': 20}, {'dpi': 'x'}):
+            resp = self.client.post('/api/export/jpg/', {'mode': 'paid', **body}, format='json')
+            self.assertEqual(resp.status_code, 400, body)
+        self.assertFalse(Operation.objects.exists())
+
+
+class AutocropTests(SimpleTestCase):
+    corners = [(400, 80), (820, 120), (860, 840), (360, 800)]
+
+    def _photo(self, corners, size=(1200, 900)):
+        img = Image.new('RGB', size, (70, 60, 50))
+        ImageDraw.Draw(img).polygon(corners, fill=(235, 235, 230))
+        return img
+
+    def test_finds_sheet_corners(self):
+        quad = autocrop.find_quad(self._photo(self.corners))
+        self.assertIsNotNone(quad)
+        # Анализ идёт на уменьшенной копии — точность в пределах пары её пикселей
+        self.assertLess(np.abs(quad - np.array(self.corners)).max(), 12)
+        self.assertTrue(((quad >= 0) & (quad <= [1199, 899])).all())
+
+    def test_crop_straightens_to_a4(self):
+        out, quad = autocrop.crop(self._photo(self.corners))
+        self.assertIsNotNone(quad)
+        self.assertAlmostEqual(out.height / out.width, autocrop.A4_RATIO, places=2)
+        # Стол в результат не попал: края — цвет листа
+        arr = np.asarray(out.convert('L'), dtype=np.float64)
+        self.assertGreater(arr[5:-5, 5:-5].min(), 200)
+
+    def test_leaves_page_without_sheet(self):
+        cases = {
+            'scan': Image.new('RGB', (800, 1100), 'white'),
+            'flat': Image.new('RGB', (800, 600), (120, 120, 120)),
+            'small sheet': self._photo([(550, 400), (650, 400), (650, 500), (550, 500)]),
+            'off-center': self._photo([(0, 0), (300, 0), (300, 300), (0, 300)]),
+        }
+        for name, img in cases.items():
+            with self.subTest(name):
+                out, quad = autocrop.crop(img)
+                self.assertIsNone(quad)
+                self.assertIs(out, img)
+
+
+class SignatureExtractTests(SimpleTestCase):
+    def _photo(self, fmt='JPEG'):
+        # Бумага с тенью слева направо и синий росчерк
+        shade = np.linspace(235, 165, 600, dtype=np.float32)
+        arr = np.stack([np.broadcast_to(shade, (400, 600))] * 3, axis=-1) * np.array([1.0, 0.98, 0.92])
+        img = Image.fromarray(arr.astype(np.uint8), 'RGB')
+        ImageDraw.Draw(img).line([(150, 250), (250, 150), (350, 250), (450, 150)], fill=(20, 40, 150), width=10)
+        buf = io.BytesIO()
+        img.save(buf, fmt, quality=92)
+        return buf.getvalue()
+
+    def _extract(self, data, ink=''):
+        png, info = signature.extract((data, ink))
+        return np.asarray(Image.open(io.BytesIO(png))), info
+
+    def test_paper_becomes_transparent(self):
+        out, info = self._extract(self._photo())
+        self.assertEqual(out.shape[2], 4)
+        # Обрезано по росчерку с полем TRIM_PAD
+        self.assertEqual((info['width'], info['height']), out.shape[1::-1])
+        self.assertLess(info['width'], 340)
+        self.assertLess(info['height'], 140)
+        alpha = out[..., 3]
+        self.assertEqual(alpha[0, 0], 0)
+        self.assertEqual(alpha[-1, -1], 0)
+        # Середина штрихов — непрозрачные чернила исходного синего цвета
+        ink = out[alpha == 255]
+        self.assertGreater(len(ink), 1500)
+        r, g, b = ink[:, :3].mean(axis=0)
+        self.assertGreater(b, 110)
+        self.assertLess(max(r, g), 80)
+        self.assertGreater(float((alpha == 0).mean()), 0.6)
+
+    def test_ink_recolor(self):
+        out, _ = self._extract(self._photo('PNG'), 'black')
+        opaque = out[out[..., 3] == 255]
+        self.assertTrue(len(opaque))
+        self.assertEqual(opaque[:, :3].max(), 0)
+
+    def test_nothing_to_extract(self):
+        blank = io.BytesIO()
+        Image.new('RGB', (200, 100), (240, 238, 230)).save(blank, 'PNG')
+        transparent = io.BytesIO()
+        Image.new('RGBA', (200, 100), (0, 0, 0, 0)).save(transparent, 'PNG')
+        for data in (blank.getvalue(), transparent.getvalue(), b'not an image'):
+            self.assertIsNone(signature.extract((data, '')))
+
+
+@override_settings(RENDER_WORKERS=0)
+class SealTests(TestCase):
+    params = {'org': '  ООО   «Ромашка» ', 'inn': '7701 234567', 'ogrn': '', 'center': 'Москва\n\nДля документов',
+              'color': '#1f3fa0'}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('seal', 'seal@example.com', 'pw')
+        self.client.force_authenticate(self.user)
+
+    def test_normalize(self):
+        p = seal.normalize(self.params)
+        self.assertEqual((p['org'], p['inn'], p['center']), ('ООО «Ромашка»', '7701234567', ['Москва', 'Для документов']))
+        self.assertEqual(seal.params_hash(p), seal.params_hash(seal.normalize(dict(reversed(self.params.items())))))
+        for bad in ({'org': ''}, {'inn': '123'}, {'ogrn': '1' * 14}, {'color': 'нет'}):
+            with self.subTest(bad), self.assertRaises(ValueError):
+                seal.normalize({**self.params, **bad})
+
+    def test_render(self):
+        img = Image.open(io.BytesIO(seal.render((seal.normalize(self.params), 256, export.font_dirs()))))
+        self.assertEqual((img.format, img.mode, img.size), ('PNG', 'RGBA', (256, 256)))
+        arr = np.asarray(img)
+        self.assertEqual(arr[0, 0, 3], 0)
+        # Верхняя точка внешней окружности — цвет печати
+        top = arr[:12, 128]
+        np.testing.assert_allclose(top[top[:, 3].argmax(), :3], (0x1f, 0x3f, 0xa0), atol=4)
+        self.assertGreater(int(arr[120:136, 100:156, 3].max()), 0)
+
+    def test_preview_is_cached(self):
+        with mock.patch.object(seal, 'render', wraps=seal.render) as rendered:
+            resp = self.client.get('/api/library/seal/', {**self.params, 'size': 256})
+            self.assertEqual((resp.status_code, resp['Content-Type']), (200, 'image/png'))
+            again = self.client.get('/api/library/seal/', {**self.params, 'size': 256}, HTTP_IF_NONE_MATCH=resp['ETag'])
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(self.client.get('/api/library/seal/', {**self.params, 'size': 256}).content, resp.content)
+        self.assertEqual(rendered.call_count, 1)
+        self.assertEqual(self.client.get('/api/library/seal/', {**self.params, 'size': 100}).status_code, 400)
+
+    def test_save_to_library_once(self):
+        first = self.client.post('/api/library/seal/', self.params, format='json')
+        self.assertEqual(first.status_code, 201)
+        second = self.client.post('/api/library/seal/', self.params, format='json')
+        self.assertEqual((second.status_code, second.json()['id']), (200, first.json()['id']))
+        self.assertEqual(SignImage.objects.get(user=self.user).kind, 'round_seal')
+
+
+class WatermarkTests(SimpleTestCase):
+    def test_blend_matches_formula(self):
+        rng = np.random.default_rng(1)
+        px = rng.integers(0, 256, (301, 457, 3), dtype=np.uint8)
+        out = np.asarray(watermark.apply(Image.fromarray(px, 'RGB'), ()))
+        t = watermark.tile(watermark.tile_side(457), ())
+        a = np.tile(t, (-(-301 // t.shape[0]), -(-457 // t.shape[1])))[:301, :457, None].astype(np.int32)
+        expected = (px.astype(np.int32) * (255 - a) + watermark.GRAY * a + 127) // 255
+        np.testing.assert_array_equal(out, expected)
+        self.assertTrue((out[a[..., 0] == 0] == px[a[..., 0] == 0]).all())
+        self.assertGreater(float((a > 0).mean()), 0.02)
+
+    def test_masks_are_cached_and_read_only(self):
+        self.assertIs(watermark.tile(200, ()), watermark.tile(200, ()))
+        self.assertIs(watermark._page_mask(400, 300, ())[0], watermark._page_mask(400, 300, ())[0])
+        with self.assertRaises(ValueError):
+            watermark.tile(200, ())[0, 0] = 1
+
+    def test_pdf_page_embeds_tile_once(self):
+        page = {'docWidth': 1000, 'docHeight': 1500}
+        spec = watermark.pdf_page((page, (), {}))
+        self.assertIs(spec.images['Wm'], watermark.pdf_image(()))
+        # Сетка COLUMNS плиток по ширине на всю высоту страницы
+        rows = math.ceil(1500 / watermark.tile_side(1000))
+        self.assertEqual(spec.content.count(b'/Wm Do'), watermark.COLUMNS * rows)
+        self.assertNotIn(b'/Wm Do', render.pdf_page((page, (), {})).content)
+
+    def test_free_and_paid_exports_are_cached_apart(self):
+        snap = {'pages': [{'id': 'p1'}]}
+        keys = {export_cache.cache_key('pdf', snap, 'doc', views._watermark_params(mode), set()) for mode in ('free', 'paid')}
+        self.assertEqual(len(keys), 2)
+
+
+FAKE_TESSERACT = """#!{python}
+import os, sys
+sys.stdin.buffer.read()
+with open(os.environ['FAKE_TESSERACT_LOG'], 'a') as f:
+    f.write('run\\n')
+if os.environ.get('FAKE_TESSERACT_MODE') == 'fail':
+    sys.stderr.write('Failed loading language')
+    sys.exit(1)
+rows = [
+    'level\\tpage_num\\tblock_num\\tpar_num\\tline_num\\tword_num\\tleft\\ttop\\twidth\\theight\\tconf\\ttext',
+    '4\\t1\\t1\\t1\\t1\\t0\\t20\\t30\\t260\\t40\\t-1\\t',
+    '5\\t1\\t1\\t1\\t1\\t1\\t20\\t30\\t140\\t40\\t96.5\\tДоговор',
+    '5\\t1\\t1\\t1\\t1\\t2\\t170\\t30\\t110\\t40\\t91\\tпоставки',
+    '5\\t1\\t1\\t1\\t1\\t3\\t290\\t30\\t10\\t40\\t12\\t~',
+    '5\\t1\\t1\\t1\\t2\\t1\\t20\\t100\\t80\\t30\\t88\\tN12',
+]
+sys.stdout.write('\\n'.join(rows) + '\\n')
+"""
+
+
+@override_settings(RENDER_WORKERS=0)
+class OcrTests(SimpleTestCase):
+    """Текстовый слой PDF против фейкового tesseract (скрипт, который печатает TSV)"""
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.binary, self.log = os.path.join(tmp.name, 'tesseract'), os.path.join(tmp.name, 'calls')
+        with open(self.binary, 'w') as f:
+            f.write(FAKE_TESSERACT.format(python=sys.executable))
+        os.chmod(self.binary, 0o755)
+        env = mock.patch.dict(os.environ, {'FAKE_TESSERACT_LOG': self.log, 'FAKE_TESSERACT_MODE': ''})
+        env.start()
+        self.addCleanup(env.stop)
+        override = override_settings(OCR_BINARY=self.binary)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.page = {'id': 'p1', 'docWidth': 800, 'docHeight': 400,
+                     'bg_src': _png_data_url(Image.new('RGB', (400, 200), 'white'))}
+
+    def _calls(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.read().split())
+
+    def test_recognize_keeps_confident_words_by_line(self):
+        res = ocr.recognize((self.page, self.binary, 'rus', 10))
+        self.assertEqual(res, {'size': [400, 200], 'lines': [
+            [[20, 30, 140, 40, 'Договор'], [170, 30, 110, 40, 'поставки']],
+            [[20, 100, 80, 30, 'N12']],
+        ]})
+        self.assertIsNone(ocr.recognize(({'docWidth': 10, 'docHeight': 10}, self.binary, 'rus', 10)))
+        os.environ['FAKE_TESSERACT_MODE'] = 'fail'
+        with self.assertLogs('core.ocr', 'WARNING') as logs:
+            self.assertIsNone(ocr.recognize((self.page, self.binary, 'rus', 10)))
+        self.assertIn('Failed loading language', logs.output[0])
+
+    def test_searchable_pdf_text_layer_is_cached(self):
+        for _ in range(2):
+            out = b''.join(export.iter_pdf({'pages': [self.page]}, 'doc', searchable=True))
+            text = PdfReader(io.BytesIO(out)).pages[0].extract_text()
+            self.assertIn('Договор поставки', text)
+            self.assertIn('N12', text)
+        # Фон не менялся — второй раз распознавание взято из кэша
+        self.assertEqual(self._calls(), 1)
+        plain = b''.join(export.iter_pdf({'pages': [self.page]}, 'doc'))
+        self.assertEqual(PdfReader(io.BytesIO(plain)).pages[0].extract_text().strip(), '')
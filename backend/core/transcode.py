@@ -0,0 +1,118 @@
+"""
+Выбор формата для фонов страниц (в процессах core.workers).
+
+Редактор сериализует страницы через toDataURL('image/png'): для
+сфотографированного документа это в 5–10 раз больше приличного JPEG.
+Страница классифицируется по статистике пикселей уменьшенной копии:
+
+- bilevel  — серая, почти все пиксели у чёрного или белого (текст, скан);
+- graphics — большие однотонные области или мало цветов (таблицы,
+             схемы, отрендеренный PDF с картинками);
+- photo    — всё остальное; JPEG (серый, если нет цвета).
+
+bilevel и graphics кодируются только без потерь: PNG в самом узком
+режиме, в который пиксели укладываются точно (1 бит, если есть только
+чёрный и белый; палитра, если цветов не больше 256; иначе L или RGB).
+Серые полутона скана и сглаживание графики не теряются — исходник после
+перекодирования не хранится. Размеры в пикселях не меняются, итог
+никогда не больше исходника.
+Модуль не зависит от Django.
+"""
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+PHOTO_QUALITY = 82
+# Сторона уменьшенной копии для статистики (ближайший сосед, без новых цветов)
+SAMPLE_SIDE = 512
+# Средняя «цветность» |R-G|+|G-B|, ниже которой страница считается серой
+GRAY_CHROMA = 6
+# bilevel: доля пикселей у краёв яркости и доля тёмных среди «чернил» (не фона)
+BILEVEL_SHARE = 0.94
+BILEVEL_INK_DARK = 0.5
+# graphics: доля пикселей, совпадающих с соседом слева (у фото и сканов — шум),
+# или не больше GRAPHICS_COLORS цветов у цветной страницы
+GRAPHICS_FLAT_SHARE = 0.5
+GRAPHICS_COLORS = 256
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA').getchannel('A').getextrema()[0] < 255
+    return False
+
+
+def classify(img: Image.Image) -> tuple:
+    """-> (kind, gray): kind — 'bilevel' | 'graphics' | 'photo'"""
+    sample = img.convert('RGB')
+    if max(sample.size) > SAMPLE_SIDE:
+        k = SAMPLE_SIDE / max(sample.size)
+        sample = sample.resize((max(1, round(sample.width * k)), max(1, round(sample.height * k))), Image.NEAREST)
+    a = np.asarray(sample, dtype=np.int32)
+    r, g, b = a[..., 0], a[..., 1], a[..., 2]
+    gray = float((np.abs(r - g) + np.abs(g - b)).mean()) < GRAY_CHROMA
+
+    luma = (r * 299 + g * 587 + b * 114) // 1000
+    if gray and float(((luma < 64) | (luma > 191)).mean()) >= BILEVEL_SHARE:
+        ink = int((luma < 192).sum())
+        if not ink or int((luma < 64).sum()) / ink >= BILEVEL_INK_DARK:
+            return 'bilevel', True
+
+    flat = float((a[:, 1:] == a[:, :-1]).all(axis=-1).mean()) if a.shape[1] > 1 else 1.0
+    if flat >= GRAPHICS_FLAT_SHARE or (not gray and len(np.unique((r << 16) | (g << 8) | b)) <= GRAPHICS_COLORS):
+        return 'graphics', gray
+    return 'photo', gray
+
+
+def _lossless(img: Image.Image) -> Image.Image:
+    """Та же картинка в самом узком точном режиме: '1', 'P' (до 256 цветов), 'L' или 'RGB'"""
+    rgb = img.convert('RGB')
+    colors = rgb.getcolors(GRAPHICS_COLORS)
+    a = np.asarray(rgb, dtype=np.uint32)
+    if colors is None:
+        exact_gray = (a[..., 0] == a[..., 1]).all() and (a[..., 1] == a[..., 2]).all()
+        return rgb.convert('L') if exact_gray else rgb
+    if {c for _, c in colors} <= {(0, 0, 0), (255, 255, 255)}:
+        return rgb.convert('L').convert('1', dither=Image.Dither.NONE)
+    palette = np.array(sorted((r << 16) | (g << 8) | b for _, (r, g, b) in colors), dtype=np.uint32)
+    index = np.searchsorted(palette, (a[..., 0] << 16) | (a[..., 1] << 8) | a[..., 2]).astype(np.uint8)
+    out = Image.fromarray(index, 'P')
+    out.putpalette([int(v) >> shift & 255 for v in palette for shift in (16, 8, 0)])
+    return out
+
+
+def encode(img: Image.Image, quality=PHOTO_QUALITY) -> tuple:
+    """-> (bytes, ext, kind) по классу страницы"""
+    buf = io.BytesIO()
+    if _has_alpha(img):
+        img.convert('RGBA').save(buf, 'PNG', optimize=True)
+        return buf.getvalue(), 'png', 'alpha'
+    kind, gray = classify(img)
+    if kind in ('bilevel', 'graphics'):
+        _lossless(img).save(buf, 'PNG', optimize=True)
+        return buf.getvalue(), 'png', kind
+    img.convert('L' if gray else 'RGB').save(buf, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buf.getvalue(), 'jpg', kind
+
+
+def page(args):
+    """
+    args = (data, quality) — закодированный фон страницы ->
+    (width, height, data, ext, kind): перекодированный фон или исходный, если он меньше;
+    None — не картинка
+    """
+    data, quality = args
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None
+    fmt = img.format
+    rotated = img.getexif().get(0x0112, 1) != 1
+    if rotated:
+        img = ImageOps.exif_transpose(img)
+    out, ext, kind = encode(img, quality)
+    if not rotated and len(data) <= len(out) and fmt in ('JPEG', 'PNG'):
+        out, ext = data, 'jpg' if fmt == 'JPEG' else 'png'
+    return img.width, img.height, out, ext, kind
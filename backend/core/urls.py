@@ -1,10 +1,12 @@
-from django.urls import path
+from django.urls import path, re_path
 from .views import (
-    KeyRateView,
-    BillingStatusView, BillingRecordView,
+    KeyRateView, KeyRateHistoryView, PeniBatchView,
+    BillingStatusView, BillingRecordView, ExportPDFView, ExportJPGView, SourceUploadView,
+    ExportJobListCreate, ExportJobDetail, ExportJobDownload, ExportFileView,
+    DocumentIngestView, PageBlobView,
     BillingConfigView, PublicBillingConfigView,
     PromoListCreate, PromoDetail, PromoValidateView,
-    UserSignsListCreate, UserSignDetail,
+    UserSignsListCreate, UserSignDetail, SealView,
     PaymentCreateView,
     DefaultSignsListCreate, DefaultSignDetail, HideDefaultSignView,
     UploadRecordView, UploadDeleteView,
@@ -14,11 +16,24 @@ from .views import (
 urlpatterns = [
     # Утилиты
     path('utils/key-rate/', KeyRateView.as_view()),
+    path('utils/key-rate/history/', KeyRateHistoryView.as_view()),
+    path('utils/peni/batch/', PeniBatchView.as_view()),
 
     # Биллинг и история
     path('billing/status/', BillingStatusView.as_view()),
     path('billing/record/', BillingRecordView.as_view()),
 
+    # Серверный экспорт черновика
+    path('export/pdf/', ExportPDFView.as_view()),
+    path('export/jpg/', ExportJPGView.as_view()),
+    path('export/files/<str:token>/', ExportFileView.as_view()),
+    path('export/jobs/', ExportJobListCreate.as_view()),
+    path('export/jobs/<int:pk>/', ExportJobDetail.as_view()),
+    path('export/jobs/<int:pk>/download/', ExportJobDownload.as_view()),
+    path('docs/sources/', SourceUploadView.as_view()),
+    path('docs/ingest/', DocumentIngestView.as_view()),
+    re_path(r'^docs/blobs/(?P<sha>[0-9a-f]{64})\.(?P<ext>jpg|png)$', PageBlobView.as_view()),
+
     # Конфигурация биллинга (админ) + публичные цены
     path('billing/config/', BillingConfigView.as_view()),
     path('billing/public/', PublicBillingConfigView.as_view()),
@@ -32,6 +47,7 @@ urlpatterns = [
     # Библиотека подписей/печати пользователя (+ глобальные дефолтные)
     path('library/signs/', UserSignsListCreate.as_view()),
     path('library/signs/<int:pk>/', UserSignDetail.as_view()),
+    path('library/seal/', SealView.as_view()),
 
     # Глобальные подписи/печати (админ)
     path('library/default-signs/', DefaultSignsListCreate.as_view()),
@@ -0,0 +1,282 @@
+"""
+Векторизация подписей и печатей (в процессах core.workers).
+
+Маска чернил (альфа или тёмные пиксели) обводится по границам пикселей:
+рёбра между чернилами и фоном находятся операциями над массивом, прямые
+отрезки одного направления сливаются, из оставшихся «углов» собираются
+замкнутые контуры. Ступеньки пикселей убираются упрощением
+Рамера–Дугласа–Пекера, контур сглаживается квадратичными кривыми через
+середины сторон. Итог — SVG из одного <path> с правилом even-odd и одним
+цветом (медиана цвета чернил).
+
+Для экспорта тот же SVG читается обратно (parse): PDF получает путь
+операторами m/c/h (pdf_path), растр — картинку нужного размера
+(rasterize). Читается только SVG, который строит этот модуль.
+Модуль не зависит от Django.
+"""
+import io
+import re
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Допуск упрощения контура, пикселей исходной картинки
+SIMPLIFY_EPS = 0.9
+# Контуры меньшей площади — пылинки и шум, пикселей
+MIN_LOOP_AREA = 6.0
+INK_ALPHA = 128
+INK_LUMA = 140
+# Точек на квадратичную кривую при растрировании и сглаживание краёв
+FLATTEN_STEPS = 6
+RASTER_SUPERSAMPLE = 3
+
+Vector = namedtuple('Vector', 'width height color subpaths')
+
+
+def _ink_mask(img: Image.Image):
+    """-> (маска чернил, цвет чернил (r, g, b))"""
+    if 'A' in img.getbands() or (img.mode == 'P' and 'transparency' in img.info):
+        rgba = np.asarray(img.convert('RGBA'))
+        mask = rgba[..., 3] >= INK_ALPHA
+        rgb = rgba[..., :3]
+    else:
+        rgb = np.asarray(img.convert('RGB'))
+        luma = (rgb[..., 0] * 299 + rgb[..., 1] * 587 + rgb[..., 2] * 114) // 1000
+        mask = luma < INK_LUMA
+    color = tuple(int(v) for v in np.median(rgb[mask], axis=0)) if mask.any() else (0, 0, 0)
+    return mask, color
+
+
+def _runs(line, pos, start, end) -> np.ndarray:
+    """
+    Рёбра одной линии сетки, идущие подряд, -> одно ребро. pos растёт по ходу
+    рёбер, start/end — их концы (x, y). -> (n, 2, 2)
+    """
+    order = np.lexsort((pos, line))
+    line, pos, start, end = line[order], pos[order], start[order], end[order]
+    brk = np.ones(len(pos), dtype=bool)
+    brk[1:] = (line[1:] != line[:-1]) | (pos[1:] != pos[:-1] + 1)
+    first = np.nonzero(brk)[0]
+    last = np.append(first[1:] - 1, len(pos) - 1)
+    return np.stack([start[first], end[last]], 1)
+
+
+def _edges(mask: np.ndarray) -> np.ndarray:
+    """
+    Направленные рёбра границы в координатах углов пикселей (ось Y вниз):
+    чернила снизу — вправо, сверху — влево, справа — вверх, слева — вниз.
+    -> (n, 2, 2): [начало, конец]
+    """
+    p = np.pad(mask, 1)
+    out = []
+    # Горизонтальные: линия y между строками y-1 и y
+    ys, xs = np.nonzero(p[1:, 1:-1] != p[:-1, 1:-1])
+    below = p[1:, 1:-1][ys, xs]
+    for ink, step in ((True, 1), (False, -1)):
+        y, x = ys[below == ink], xs[below == ink]
+        if len(x):
+            a, b = np.stack([x, y], 1), np.stack([x + 1, y], 1)
+            out.append(_runs(y, step * x, *((a, b) if ink else (b, a))))
+    # Вертикальные: линия x между столбцами x-1 и x
+    ys, xs = np.nonzero(p[1:-1, 1:] != p[1:-1, :-1])
+    right = p[1:-1, 1:][ys, xs]
+    for ink, step in ((True, -1), (False, 1)):
+        y, x = ys[right == ink], xs[right == ink]
+        if len(x):
+            a, b = np.stack([x, y + 1], 1), np.stack([x, y], 1)
+            out.append(_runs(x, step * y, *((a, b) if ink else (b, a))))
+    return np.concatenate(out) if out else np.empty((0, 2, 2), dtype=np.int64)
+
+
+def _loops(edges: np.ndarray) -> list:
+    """Рёбра -> замкнутые контуры (массивы вершин)"""
+    outgoing = defaultdict(list)
+    for i, (x, y) in enumerate(edges[:, 0].tolist()):
+        outgoing[(x, y)].append(i)
+    used = np.zeros(len(edges), dtype=bool)
+    ends = edges[:, 1].tolist()
+    loops = []
+    for i in range(len(edges)):
+        if used[i]:
+            continue
+        pts, j = [], i
+        while not used[j]:
+            used[j] = True
+            pts.append(edges[j, 0])
+            nxt = outgoing.get(tuple(ends[j]))
+            while nxt and used[nxt[-1]]:
+                nxt.pop()
+            if not nxt:
+                break
+            j = nxt.pop()
+        if len(pts) >= 3:
+            loops.append(np.array(pts, dtype=np.float64))
+    return loops
+
+
+def _area(pts: np.ndarray) -> float:
+    x, y = pts[:, 0], pts[:, 1]
+    return 0.5 * abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+
+
+def _simplify(pts: np.ndarray, eps: float) -> np.ndarray:
+    """Рамер–Дуглас–Пекер для открытой ломаной, без рекурсии"""
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = pts[b] - pts[a]
+        rel = pts[a + 1:b] - pts[a]
+        norm = float(np.hypot(*seg))
+        if norm:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / norm
+        else:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        k = int(dist.argmax())
+        if dist[k] > eps:
+            m = a + 1 + k
+            keep[m] = True
+            stack += [(a, m), (m, b)]
+    return pts[keep]
+
+
+def _simplify_loop(pts: np.ndarray, eps: float) -> np.ndarray:
+    # Замкнутый контур делится на две ломаные в самой дальней от начала точке
+    far = int(np.hypot(*(pts - pts[0]).T).argmax())
+    if far == 0:
+        return pts
+    a = _simplify(pts[:far + 1], eps)
+    b = _simplify(np.vstack([pts[far:], pts[:1]]), eps)
+    return np.vstack([a[:-1], b[:-1]])
+
+
+def _path_d(loops: list) -> str:
+    """
+    Контуры -> d: кривые через середины сторон, вершины — контрольные точки.
+    Координаты удвоены (viewBox 2w x 2h), поэтому середины тоже целые и
+    записываются относительными числами без дробей.
+    """
+    parts = []
+    for pts in loops:
+        pts = pts.astype(np.int64) * 2
+        mids = (pts + np.roll(pts, -1, axis=0)) // 2
+        # Кривая i: контрольная точка pts[i+1], конец mids[i+1]; начало — mids[0]
+        ctrl, end = np.roll(pts, -1, axis=0), np.roll(mids, -1, axis=0)
+        prev = np.vstack([mids[:1], end[:-1]])
+        rel = np.hstack([ctrl - prev, end - prev]).ravel().tolist()
+        parts.append(f'M{mids[0][0]} {mids[0][1]}q' + ' '.join(map(str, rel)).replace(' -', '-') + 'z')
+    return ''.join(parts)
+
+
+def trace(data: bytes):
+    """
+    PNG/JPEG подписи -> (svg, info) или None: картинка не читается или без чернил.
+    info = {"width", "height", "paths", "points"}
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return None
+    mask, color = _ink_mask(img)
+    if not mask.any():
+        return None
+    loops = [_simplify_loop(pts, SIMPLIFY_EPS) for pts in _loops(_edges(mask)) if _area(pts) >= MIN_LOOP_AREA]
+    loops = [pts for pts in loops if len(pts) >= 3]
+    if not loops:
+        return None
+    w, h = img.size
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {2 * w} {2 * h}">'
+        f'<path fill="#{color[0]:02x}{color[1]:02x}{color[2]:02x}" fill-rule="evenodd" d="{_path_d(loops)}"/></svg>'
+    )
+    return svg, {'width': w, 'height': h, 'paths': len(loops), 'points': int(sum(len(p) for p in loops))}
+
+
+# Больше не бывает у trace (сторона подписи — до signature.MAX_SIDE, координаты удвоены)
+MAX_VIEWBOX = 100_000
+_SVG_SIZE = re.compile(r'viewBox="0 0 ([\d.]+) ([\d.]+)"')
+_SVG_FILL = re.compile(r'fill="#([0-9a-fA-F]{6})"')
+_SVG_D = re.compile(r'\sd="([^"]*)"')
+_SUBPATH = re.compile(r'M(-?\d+) ?(-?\d+)q([-\d ]*)z')
+
+
+def parse(svg):
+    """SVG из trace -> Vector с абсолютными координатами; чужой SVG -> None"""
+    if isinstance(svg, bytes):
+        svg = svg.decode('utf-8', 'replace')
+    size, fill, d = _SVG_SIZE.search(svg), _SVG_FILL.search(svg), _SVG_D.search(svg)
+    if not (size and fill and d):
+        return None
+    try:
+        width, height = float(size.group(1)), float(size.group(2))
+    except ValueError:
+        return None
+    # Размеры — делители в матрицах render и rasterize; SVG из data URL может быть любым
+    if not (0 < width <= MAX_VIEWBOX and 0 < height <= MAX_VIEWBOX):
+        return None
+    subpaths = []
+    for x, y, rel in _SUBPATH.findall(d.group(1)):
+        q = np.array(re.findall(r'-?\d+', rel), dtype=np.float64)
+        if not len(q) or len(q) % 4:
+            continue
+        q = q.reshape(-1, 4)
+        start = np.array([float(x), float(y)])
+        ends = start + np.cumsum(q[:, 2:], axis=0)
+        prev = np.vstack([start, ends[:-1]])
+        subpaths.append((tuple(start), np.hstack([prev + q[:, :2], ends])))
+    if not subpaths:
+        return None
+    rgb = tuple(int(fill.group(1)[i:i + 2], 16) for i in (0, 2, 4))
+    return Vector(width, height, rgb, subpaths)
+
+
+def pdf_path(vec: Vector, num) -> str:
+    """
+    Путь в координатах viewBox операторами PDF (квадратичные кривые -> кубические);
+    num — форматирование чисел PDF (pdfwriter.num)
+    """
+    out = []
+    for (x0, y0), q in vec.subpaths:
+        out.append(f'{num(x0)} {num(y0)} m\n')
+        prev = np.vstack([[x0, y0], q[:-1, 2:]])
+        c1 = prev + (q[:, :2] - prev) * (2 / 3)
+        c2 = q[:, 2:] + (q[:, :2] - q[:, 2:]) * (2 / 3)
+        for a, b, e in zip(c1.tolist(), c2.tolist(), q[:, 2:].tolist()):
+            out.append(f'{num(a[0])} {num(a[1])} {num(b[0])} {num(b[1])} {num(e[0])} {num(e[1])} c\n')
+        out.append('h\n')
+    return ''.join(out)
+
+
+def _flatten(start, q: np.ndarray) -> np.ndarray:
+    """Квадратичные кривые -> ломаная, FLATTEN_STEPS точек на кривую"""
+    prev = np.vstack([start, q[:-1, 2:]])
+    t = np.linspace(0, 1, FLATTEN_STEPS + 1)[1:, None, None]
+    pts = (1 - t) ** 2 * prev + 2 * (1 - t) * t * q[:, :2] + t ** 2 * q[:, 2:]
+    return pts.transpose(1, 0, 2).reshape(-1, 2)
+
+
+def rasterize(vec: Vector, width: int, height: int) -> Image.Image:
+    """RGBA заданного размера: заливка even-odd — XOR масок контуров в их рамках"""
+    ss = RASTER_SUPERSAMPLE
+    W, H = max(1, width * ss), max(1, height * ss)
+    k = np.array([W / vec.width, H / vec.height])
+    acc = np.zeros((H, W), dtype=bool)
+    for start, q in vec.subpaths:
+        pts = _flatten(np.array(start), q) * k
+        x0, y0 = np.floor(pts.min(axis=0)).astype(int)
+        x1, y1 = np.ceil(pts.max(axis=0)).astype(int) + 1
+        x0, y0, x1, y1 = max(0, x0), max(0, y0), min(W, x1), min(H, y1)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        m = Image.new('1', (x1 - x0, y1 - y0), 0)
+        ImageDraw.Draw(m).polygon([tuple(p) for p in (pts - [x0, y0]).tolist()], fill=1)
+        acc[y0:y1, x0:x1] ^= np.asarray(m)
+    alpha = Image.fromarray(acc.astype(np.uint8) * 255, 'L').resize((max(1, width), max(1, height)), Image.BOX)
+    out = Image.new('RGBA', alpha.size, vec.color + (0,))
+    out.putalpha(alpha)
+    return out
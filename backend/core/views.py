@@ -3,7 +3,6 @@ import base64
 import copy
 import uuid  
 
-import requests
 from django.utils import timezone
 from django.db.models import Sum, Q
 from rest_framework import permissions
@@ -27,9 +26,12 @@ import os
 import json
 import logging
 from decimal import Decimal
-from datetime import timedelta
+from datetime import date, timedelta
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -55,39 +57,85 @@ from .models import (
     HiddenDefaultSign,
     Upload,
     DocumentDraft,
+    ExportJob,
 )
+from . import blobs, export, export_cache, export_jobs, ingest, key_rate, office, peni, seal, signature, vectorize, workers
+from .streaming import ranged_file_response, streaming_response
 
 logger = logging.getLogger(__name__)
 
 
 
 # ---------- Ключевая ставка ЦБ ----------
-_KEY_RATE_CACHE = {"data": None, "ts": 0, "ttl": 3600}  # 1 час
+class KeyRateView(APIView):
+    """
+    GET /utils/key-rate/             — текущая ставка
+    GET /utils/key-rate/?date=Y-m-d  — ставка, действовавшая на дату
+    Отвечает из кэша/БД и никогда не ждёт ЦБ: история обновляется в фоне
+    (manage.py refresh_key_rate), см. core/key_rate.py.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        day = (request.query_params.get('date') or '').strip()
+        if not day:
+            return Response(key_rate.latest())
+        try:
+            d = date.fromisoformat(day)
+        except ValueError:
+            return Response({'detail': 'date должен быть в формате YYYY-MM-DD'}, status=400)
+        data = key_rate.rate_on(d)
+        if data is None:
+            return Response({'detail': 'Нет данных о ставке на эту дату'}, status=404)
+        return Response(data)
 
 
-class KeyRateView(APIView):
+class KeyRateHistoryView(APIView):
+    """Периоды действия ставки: [{"date": "Y-m-d", "keyRate": float}, ...] по возрастанию"""
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        now = time.time()
-        if _KEY_RATE_CACHE["data"] and (now - _KEY_RATE_CACHE["ts"] < _KEY_RATE_CACHE["ttl"]):
-            return Response(_KEY_RATE_CACHE["data"])
+        return Response([{'date': d.isoformat(), 'keyRate': r} for d, r in key_rate.history()])
+
 
-        url = "https://www.cbr-xml-daily.ru/key-rate.json"
+PENI_BATCH_MAX_ROWS = 5000
+PENI_CSV_MAX_BYTES = 20 * 1024 * 1024
+
+
+class PeniBatchView(APIView):
+    """
+    POST /utils/peni/batch/ — пакетный расчёт пени по истории ключевой ставки.
+
+    JSON: {"mode": "tax|salary|utilities", "entity": "org|person",
+           "rows": [{"amount": 1000.5, "due": "2024-01-10", "pay": "2024-03-01"}, ...]}
+      -> {"rows": [{amount, due, pay, days, peni, error}], "total": float}
+    multipart: file=<CSV amount;due;pay> (+ mode, entity) -> потоковый CSV с результатом.
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request):
+        mode = str(request.data.get('mode') or 'tax').strip()
+        entity = str(request.data.get('entity') or 'org').strip()
         try:
-            r = requests.get(url, timeout=6)
-            r.raise_for_status()
-            j = r.json() if r.content else {}
-            key_rate = float(j.get("keyRate"))
-            date = j.get("date") or ""
-            data = {"keyRate": key_rate, "date": date}
-            _KEY_RATE_CACHE["data"] = data
-            _KEY_RATE_CACHE["ts"] = now
-            return Response(data)
-        except Exception:
-            if _KEY_RATE_CACHE["data"]:
-                return Response(_KEY_RATE_CACHE["data"])
-            return Response({"keyRate": 16.0, "date": ""})
+            peni.segments_for(mode, entity)
+        except peni.PeniError as e:
+            return Response({'detail': str(e)}, status=400)
+
+        upload = request.FILES.get('file')
+        if upload is not None:
+            if upload.size > PENI_CSV_MAX_BYTES:
+                return Response({'detail': 'Файл слишком большой'}, status=413)
+            return streaming_response(request, peni.iter_csv(upload.file, mode, entity), 'text/csv; charset=utf-8', 'peni.csv')
+
+        rows = request.data.get('rows')
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            return Response({'detail': 'rows должен быть списком объектов'}, status=400)
+        if len(rows) > PENI_BATCH_MAX_ROWS:
+            return Response({'detail': f'Не больше {PENI_BATCH_MAX_ROWS} строк за запрос, для больших объёмов загрузите CSV'}, status=400)
+        out = peni.compute_rows(rows, mode, entity)
+        total = round(sum(r['peni'] or 0 for r in out), 2)
+        return Response({'rows': out, 'total': total})
+
 
 # ---------- Вспомогательные ----------
 def _get_quota():
@@ -220,45 +268,396 @@ class BillingStatusView(APIView):
         return Response(_billing_status(request.user))
 
 
-class BillingRecordView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
-
-    def post(self, request):
-        kind = (request.data.get('kind') or '').lower()  # 'jpg' | 'pdf'
-        pages = max(1, int(request.data.get('pages') or 1))
-        mode = (request.data.get('mode') or 'free').lower()  # 'free'|'paid'
-        doc_name = (request.data.get('doc_name') or '')[:200]
-        client_id = (request.data.get('client_id') or '').strip()[:64]
+def _charge_download(user, kind: str, pages: int, mode: str, doc_name='', client_id='', job=None):
+    """
+    Проверяет право на скачивание и списывает его (Operation + скачивание
+    тарифа single) в одной транзакции. Строка пользователя блокируется,
+    поэтому параллельные выгрузки не превысят бесплатный лимит.
+    job (ExportJob) сохраняется в той же транзакции со ссылками на списание.
+    Возвращает None или текст ошибки для ответа 403.
+    """
+    return _charge(user, kind, pages, mode, doc_name, client_id, job)[0]
 
-        if kind not in ('jpg', 'pdf'):
-            return Response({'detail': 'kind должен быть jpg|pdf'}, status=400)
 
-        sub = _get_active_subscription(request.user)
+def _charge(user, kind: str, pages: int, mode: str, doc_name='', client_id='', job=None):
+    """_charge_download -> (ошибка, (id Operation, id списанной подписки | None)) для возврата"""
+    with transaction.atomic():
+        get_user_model().objects.select_for_update().filter(pk=user.pk).first()
+        sub = _get_active_subscription(user)
         has_paid_access = _has_paid_access_for_client(sub, client_id)
 
         if mode == 'free':
             if not has_paid_access:
-                st = _billing_status(request.user)
+                st = _billing_status(user)
                 if st['free_left'] < pages:
-                    return Response({'detail': 'Лимит бесплатных страниц на сегодня исчерпан'}, status=403)
+                    return 'Лимит бесплатных страниц на сегодня исчерпан', None
         else:
             if not has_paid_access:
-                return Response({'detail': 'Тариф не позволяет скачать этот документ'}, status=403)
+                return 'Тариф не позволяет скачать этот документ', None
 
-        Operation.objects.create(
-            user=request.user,
+        op = Operation.objects.create(
+            user=user,
             kind=f'download_{kind}',
             pages=pages,
             doc_name=doc_name,
             free=(mode == 'free'),
         )
 
-        if mode == 'paid' and sub and sub.plan == 'single':
+        consumed = mode == 'paid' and sub and sub.plan == 'single'
+        if consumed:
             _consume_single_subscription(sub)
+        if job is not None:
+            job.operation = op
+            job.subscription = sub if consumed else None
+            job.save()
+    return None, (op.pk, sub.pk if consumed else None)
+
+
+def _refunded_on_error(render, charge):
+    """Поток выгрузки, при ошибке рендеринга которого списание возвращается"""
+    try:
+        yield from render()
+    except Exception:
+        logger.exception('export render failed, refunding operation %s', charge[0])
+        export_jobs.refund(*charge)
+        raise
+
+
+class BillingRecordView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        kind = (request.data.get('kind') or '').lower()  # 'jpg' | 'pdf'
+        pages = max(1, int(request.data.get('pages') or 1))
+        mode = (request.data.get('mode') or 'free').lower()  # 'free'|'paid'
+        doc_name = (request.data.get('doc_name') or '')[:200]
+        client_id = (request.data.get('client_id') or '').strip()[:64]
+
+        if kind not in ('jpg', 'pdf'):
+            return Response({'detail': 'kind должен быть jpg|pdf'}, status=400)
+
+        error = _charge_download(request.user, kind, pages, mode, doc_name, client_id)
+        if error:
+            return Response({'detail': error}, status=403)
 
         return Response(_billing_status(request.user))
 
 
+# ---------- Серверный экспорт ----------
+def _export_request(request):
+    """
+    Общая часть экспорта: черновик, режим и имя файла.
+    Возвращает (snapshot, mode, name) или (None, Response с ошибкой).
+    """
+    snap = export.draft_snapshot(request.user)
+    if snap is None:
+        return None, Response({'detail': 'Черновик не найден — сохраните документ'}, status=404)
+    pages = len(snap['pages'])
+    if not pages:
+        return None, Response({'detail': 'В документе нет страниц'}, status=400)
+    if pages > settings.EXPORT_MAX_PAGES:
+        return None, Response({'detail': f'Не больше {settings.EXPORT_MAX_PAGES} страниц за выгрузку'}, status=400)
+    mode = (request.data.get('mode') or 'free').lower()
+    if mode not in ('free', 'paid'):
+        return None, Response({'detail': 'mode должен быть free|paid'}, status=400)
+    name = (request.data.get('doc_name') or snap.get('name') or 'document').strip()[:200]
+    return (snap, mode, name), None
+
+
+EXPORT_CONTENT_TYPES = {'pdf': 'application/pdf', 'jpg': 'application/zip'}
+
+
+def _watermark_params(mode: str) -> dict:
+    """Бесплатная выгрузка (Operation.free) идёт с водяным знаком — и в кэше лежит отдельно"""
+    return {'watermark': True} if mode == 'free' else {}
+
+
+def _searchable_params(request):
+    """
+    {'searchable': True} для PDF с текстовым слоем (searchable=1), {} без него
+    или (None, Response 503), если на сервере нет OCR.
+    """
+    if str(request.data.get('searchable', '')).lower() not in ('1', 'true', 'yes'):
+        return {}, None
+    if not export.ocr_binary():
+        return None, Response({'detail': 'Распознавание текста недоступно на сервере'}, status=503)
+    return {'searchable': True}, None
+
+
+def _export_response(request, kind, snap, name, params, render):
+    """
+    Выгрузка из кэша по хэшу содержимого, иначе — рендеринг потоком с записью
+    в кэш. X-Export-Url — ссылка для докачки того же файла с Range.
+    """
+    key = export_cache.cache_key(kind, snap, name, params, export.source_shas(request.user, snap))
+    filename = f'{name}.{export_cache.EXTENSIONS[kind]}'
+    resp = None
+    path = export_cache.lookup(key, kind)
+    if path:
+        try:
+            resp = ranged_file_response(request, path, EXPORT_CONTENT_TYPES[kind], filename, etag=f'"{key}"')
+            resp['X-Export-Cache'] = 'hit'
+        except FileNotFoundError:
+            # Вытеснен другим запросом между lookup и открытием — рендерим заново
+            pass
+    if resp is None:
+        resp = streaming_response(request, export_cache.iter_store(key, kind, render()), EXPORT_CONTENT_TYPES[kind], filename)
+        resp['X-Export-Cache'] = 'miss'
+    resp['X-Export-Url'] = f'/export/files/{export_cache.download_token(request.user, key, kind, name)}/'
+    resp['Access-Control-Expose-Headers'] = 'X-Export-Url, X-Export-Cache, Content-Range, Accept-Ranges'
+    return resp
+
+
+class ExportFileView(APIView):
+    """
+    GET /export/files/<token>/ — уже оплаченная выгрузка из кэша с поддержкой
+    Range (докачка прерванной загрузки). 404, если файл вытеснен из кэша.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, token):
+        parsed = export_cache.parse_token(request.user, token)
+        if not parsed:
+            return Response({'detail': 'Ссылка недействительна'}, status=404)
+        key, kind, name = parsed
+        path = export_cache.lookup(key, kind)
+        try:
+            if path:
+                return ranged_file_response(
+                    request, path, EXPORT_CONTENT_TYPES[kind], f'{name}.{export_cache.EXTENSIONS[kind]}',
+                    etag=f'"{key}"',
+                )
+        except FileNotFoundError:
+            pass
+        return Response({'detail': 'Файл больше не хранится, выгрузите документ заново'}, status=404)
+
+
+class ExportPDFView(APIView):
+    """
+    POST /export/pdf/ {mode: free|paid, doc_name?, searchable?} — PDF из сохранённого
+    черновика. Квота списывается в этом же запросе (и возвращается, если рендеринг
+    упадёт), файл отдаётся потоком по мере рендеринга; в режиме free на страницах водяной знак (core.watermark),
+    с searchable=1 — невидимый распознанный текст (core.ocr).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        params, error = _export_request(request)
+        if error:
+            return error
+        snap, mode, name = params
+        searchable, error = _searchable_params(request)
+        if error:
+            return error
+        error, charge = _charge(request.user, 'pdf', len(snap['pages']), mode, name, snap.get('client_id') or '')
+        if error:
+            return Response({'detail': error}, status=403)
+        params = {**_watermark_params(mode), **searchable}
+        return _export_response(
+            request, 'pdf', snap, name, params,
+            lambda: _refunded_on_error(lambda: export.iter_pdf(
+                snap, name, export.load_sources(request.user, snap),
+                watermarked=bool(params.get('watermark')), searchable=bool(searchable),
+            ), charge),
+        )
+
+
+class ExportJPGView(APIView):
+    """
+    POST /export/jpg/ {mode: free|paid, doc_name?, dpi?, quality?} — ZIP со
+    страницами черновика в JPEG. Квота списывается за весь архив одной транзакцией.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        params, error = _export_request(request)
+        if error:
+            return error
+        snap, mode, name = params
+        jpg, error = _jpg_params(request)
+        if error:
+            return error
+        dpi, quality = jpg
+        error, charge = _charge(request.user, 'jpg', len(snap['pages']), mode, name, snap.get('client_id') or '')
+        if error:
+            return Response({'detail': error}, status=403)
+        params = {'dpi': dpi, 'quality': quality, **_watermark_params(mode)}
+        return _export_response(
+            request, 'jpg', snap, name, params,
+            lambda: _refunded_on_error(
+                lambda: export.iter_jpg_zip(snap, name, dpi, quality, watermarked=bool(params.get('watermark'))), charge,
+            ),
+        )
+
+
+def _jpg_params(request):
+    """(dpi, quality) из запроса или (None, Response с ошибкой)"""
+    try:
+        dpi = int(request.data.get('dpi') or 200)
+        quality = int(request.data.get('quality') or 85)
+    except (TypeError, ValueError):
+        return None, Response({'detail': 'dpi и quality должны быть числами'}, status=400)
+    lo, hi = export.JPG_DPI_RANGE
+    if not lo <= dpi <= hi:
+        return None, Response({'detail': f'dpi от {lo} до {hi}'}, status=400)
+    lo, hi = export.JPG_QUALITY_RANGE
+    if not lo <= quality <= hi:
+        return None, Response({'detail': f'quality от {lo} до {hi}'}, status=400)
+    return (dpi, quality), None
+
+
+class ExportJobListCreate(APIView):
+    """
+    POST /export/jobs/ {format: pdf|jpg, mode, doc_name?, dpi?, quality?, searchable?} — поставить
+    выгрузку в очередь (202). Прогресс — в WebSocket редактора (export_progress /
+    export_done) или опросом GET /export/jobs/<id>/.
+    GET /export/jobs/ — последние выгрузки пользователя.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        jobs = ExportJob.objects.filter(user=request.user).defer('snapshot')[:20]
+        return Response([export_jobs.job_dict(j) for j in jobs])
+
+    def post(self, request):
+        kind = (request.data.get('format') or 'pdf').lower()
+        if kind not in ('pdf', 'jpg'):
+            return Response({'detail': 'format должен быть pdf|jpg'}, status=400)
+        params, error = _export_request(request)
+        if error:
+            return error
+        snap, mode, name = params
+        job_params = _watermark_params(mode)
+        if kind == 'jpg':
+            jpg, error = _jpg_params(request)
+            if error:
+                return error
+            job_params.update(dpi=jpg[0], quality=jpg[1])
+        else:
+            searchable, error = _searchable_params(request)
+            if error:
+                return error
+            job_params.update(searchable)
+        if export_jobs.active_count(request.user) >= settings.EXPORT_JOBS_PER_USER:
+            return Response({'detail': 'Дождитесь завершения текущих выгрузок'}, status=429)
+
+        job = ExportJob(
+            user=request.user, kind=kind, params=job_params, snapshot=snap,
+            doc_name=name, pages=len(snap['pages']),
+        )
+        error = _charge_download(request.user, kind, job.pages, mode, name, snap.get('client_id') or '', job=job)
+        if error:
+            return Response({'detail': error}, status=403)
+        return Response(export_jobs.job_dict(job), status=202)
+
+
+class ExportJobDetail(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        job = ExportJob.objects.filter(user=request.user, pk=pk).defer('snapshot').first()
+        if not job:
+            return Response({'detail': 'Не найдено'}, status=404)
+        return Response(export_jobs.job_dict(job))
+
+
+class ExportJobDownload(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        job = ExportJob.objects.filter(user=request.user, pk=pk, status='done').defer('snapshot').first()
+        try:
+            if job and job.file_path:
+                return ranged_file_response(
+                    request, job.file_path, EXPORT_CONTENT_TYPES[job.kind], export_jobs.file_name(job),
+                    etag=f'"job-{job.id}"',
+                )
+        except FileNotFoundError:
+            pass
+        return Response({'detail': 'Файл не найден или срок хранения истёк'}, status=404)
+
+
+def _api_base_url(request) -> str:
+    """Абсолютный адрес корня API (для ссылок на blob-ы страниц)"""
+    return request.build_absolute_uri('/api')
+
+
+class DocumentIngestView(APIView):
+    """
+    POST /docs/ingest/ file=<PDF|DOCX|XLS|XLSX|JPG|PNG> (+ client_id, doc_name,
+    enhance=режимы core.enhance через запятую) — страницы документа
+    растрируются на сервере и добавляются в конец черновика.
+    Ответ: {"pages": [страницы черновика с bg_src-ссылками], "total": n}.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'Нужен файл file'}, status=400)
+        base_url = _api_base_url(request)
+        try:
+            result = ingest.ingest(
+                request.user, upload, base_url,
+                client_id=(request.data.get('client_id') or '').strip()[:64],
+                name=(request.data.get('doc_name') or '').strip(),
+                ttl_hours=_get_ttl_hours(),
+                enhance_modes=(request.data.get('enhance') or '').split(','),
+            )
+        except ingest.IngestError as e:
+            return Response({'detail': str(e)}, status=400)
+        except office.OfficeError as e:
+            # Конвертер не установлен или занят — клиент разберёт файл сам
+            return Response({'detail': str(e)}, status=503)
+        return Response(result, status=201)
+
+
+class PageBlobView(APIView):
+    """
+    GET /docs/blobs/<sha256>.<jpg|png> — растровая страница. Адрес — хэш
+    содержимого (его знает только владелец черновика), файл неизменяем.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def get(self, request, sha, ext):
+        path = blobs.path_for(sha, ext)
+        if not os.path.exists(path):
+            return Response({'detail': 'Не найдено'}, status=404)
+        etag = f'"{sha}"'
+        if request.headers.get('If-None-Match') == etag:
+            resp = HttpResponse(status=304)
+        else:
+            try:
+                resp = ranged_file_response(request, path, blobs.CONTENT_TYPES[ext], etag=etag)
+            except FileNotFoundError:
+                # blobs.prune удалил файл после проверки
+                return Response({'detail': 'Не найдено'}, status=404)
+        resp['ETag'] = etag
+        resp['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return resp
+
+
+class SourceUploadView(APIView):
+    """
+    POST /docs/sources/ file=<PDF> — сохранить исходный PDF для векторного экспорта.
+    Страницы черновика ссылаются на него как src_pdf = {"sha": sha256, "index": n}.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'Нужен файл file'}, status=400)
+        if upload.size > settings.SOURCE_MAX_BYTES:
+            return Response({'detail': 'Файл слишком большой'}, status=413)
+        try:
+            obj = export.save_source(request.user, upload.read(), upload.name or '')
+        except export.SourceError as e:
+            return Response({'detail': str(e)}, status=400)
+        return Response({'id': obj.id, 'sha256': obj.sha256, 'pages': obj.pages}, status=201)
+
+
 # ---------- Конфигурация биллинга ----------
 class BillingConfigView(APIView):
     permission_classes = [permissions.IsAdminUser]
@@ -427,6 +826,13 @@ class PromoValidateView(APIView):
 
 
 # ---------- Библиотека подписей/печати ----------
+def _svg_url(obj):
+    """Векторная копия подписи data URL-ом (редактор и экспорт рисуют её в любом масштабе)"""
+    if not obj.svg:
+        return None
+    return "data:image/svg+xml;base64," + base64.b64encode(obj.svg.encode('utf-8')).decode('ascii')
+
+
 def _sign_to_dict(obj: SignImage):
     b64 = base64.b64encode(obj.data).decode('ascii')
     url = f"data:{obj.mime};base64,{b64}"
@@ -435,6 +841,7 @@ def _sign_to_dict(obj: SignImage):
         "kind": obj.kind,
         "mime": obj.mime,
         "url": url,
+        "svg_url": _svg_url(obj),
         "created_at": obj.created_at.isoformat(),
         "is_default": False,
     }
@@ -449,20 +856,79 @@ def _default_sign_to_dict(obj: GlobalSignImage):
         "kind": obj.kind,
         "mime": obj.mime,
         "url": url,
+        "svg_url": _svg_url(obj),
         "created_at": obj.created_at.isoformat(),
         "is_default": True,
     }
 
 
+# Глобальная библиотека одинакова для всех пользователей — сериализуем её один раз
+# и держим в кэше; скрытые пользователем элементы отфильтровываем уже в памяти.
+# Сброс — по сигналам GlobalSignImage (API и админка), см. core/signals.py.
+DEFAULT_SIGNS_CACHE_KEY = 'core:default_signs:v2'
+DEFAULT_SIGNS_CACHE_TTL = 600  # страховка для локального кэша в многопроцессном режиме
+
+
+def _cached_default_signs():
+    items = cache.get(DEFAULT_SIGNS_CACHE_KEY)
+    if items is None:
+        qs = GlobalSignImage.objects.all().order_by('-created_at')
+        items = [_default_sign_to_dict(i) for i in qs]
+        cache.set(DEFAULT_SIGNS_CACHE_KEY, items, DEFAULT_SIGNS_CACHE_TTL)
+    return items
+
+
+def invalidate_default_signs_cache():
+    cache.delete(DEFAULT_SIGNS_CACHE_KEY)
+
+
+def _clean_sign(request, data: bytes, mime: str):
+    """
+    Фон фото/скана подписи -> прозрачный (core.signature), если не передано
+    clean=0; ink=blue|black перекрашивает чернила. -> (data, mime, отчёт или None)
+    """
+    if str(request.data.get('clean', '1')).lower() in ('0', 'false', 'no'):
+        return data, mime, None
+    ink = (request.data.get('ink') or '').strip()
+    try:
+        res = workers.run(signature.extract, (data, ink if ink in signature.INK_COLORS else ''))
+    except Exception:
+        logger.exception('Signature extraction failed')
+        res = None
+    if res is None:
+        return data, mime, None
+    out, info = res
+    report = {**info, 'before': len(data), 'after': len(out)}
+    logger.info('Signature background removed: %s, %d -> %d bytes, %dx%d',
+                mime, len(data), len(out), info['width'], info['height'])
+    return out, 'image/png', report
+
+
+def _vectorize_sign(request, data: bytes) -> str:
+    """SVG-копия подписи (core.vectorize), если запрошено vectorize=1; иначе ''"""
+    if str(request.data.get('vectorize', '')).lower() not in ('1', 'true', 'yes'):
+        return ''
+    try:
+        res = workers.run(vectorize.trace, data)
+    except Exception:
+        logger.exception('Signature vectorization failed')
+        res = None
+    if res is None:
+        return ''
+    svg, info = res
+    logger.info('Signature vectorized: %d paths, %d points, %d -> %d bytes',
+                info['paths'], info['points'], len(data), len(svg))
+    return svg
+
+
 class UserSignsListCreate(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
         qs_user = SignImage.objects.filter(user=request.user).order_by('-created_at')[:200]
         user_items = [_sign_to_dict(i) for i in qs_user]
-        hidden_ids = HiddenDefaultSign.objects.filter(user=request.user).values_list('sign_id', flat=True)
-        qs_global = GlobalSignImage.objects.exclude(id__in=hidden_ids).order_by('-created_at')[:200]
-        default_items = [_default_sign_to_dict(i) for i in qs_global]
+        hidden_ids = set(HiddenDefaultSign.objects.filter(user=request.user).values_list('sign_id', flat=True))
+        default_items = [i for i in _cached_default_signs() if i['gid'] not in hidden_ids][:200]
         items = [*user_items, *default_items]
         return Response(items)
 
@@ -489,8 +955,10 @@ class UserSignsListCreate(APIView):
         if len(data) > 6 * 1024 * 1024:
             return Response({'detail': 'Изображение слишком большое (до 6 МБ)'}, status=400)
 
-        obj = SignImage.objects.create(user=request.user, kind=kind, mime=mime, data=data)
-        return Response(_sign_to_dict(obj), status=201)
+        data, mime, cleaned = _clean_sign(request, data, mime)
+        svg = _vectorize_sign(request, data)
+        obj = SignImage.objects.create(user=request.user, kind=kind, mime=mime, data=data, svg=svg)
+        return Response({**_sign_to_dict(obj), 'cleaned': cleaned}, status=201)
 
 
 class UserSignDetail(APIView):
@@ -504,13 +972,65 @@ class UserSignDetail(APIView):
         return Response(status=204)
 
 
+# Печать по параметрам рисуется один раз на размер: ключ — хэш нормализованных параметров
+SEAL_CACHE_TTL = 7 * 86400
+
+
+def _seal_png(params: dict, size: int) -> bytes:
+    key = f'seal:{seal.params_hash(params)}:{size}'
+    png = cache.get(key)
+    if png is None:
+        png = workers.run(seal.render, (params, size, export.font_dirs()))
+        cache.set(key, png, SEAL_CACHE_TTL)
+    return png
+
+
+class SealView(APIView):
+    """
+    Круглая печать по параметрам (core.seal): org, inn, ogrn, center (строки через перевод строки), color.
+    GET ?...&size=256|600|1200 — PNG для предпросмотра;
+    POST — сохранить в библиотеку пользователя (kind=round_seal), vectorize=1 — с SVG-копией.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            params = seal.normalize(request.query_params)
+            size = int(request.query_params.get('size') or seal.SIZES[0])
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        if size not in seal.SIZES:
+            return Response({'detail': f'size: {", ".join(map(str, seal.SIZES))}'}, status=400)
+        etag = f'"{seal.params_hash(params)}-{size}"'
+        if request.headers.get('If-None-Match') == etag:
+            resp = HttpResponse(status=304)
+        else:
+            resp = HttpResponse(_seal_png(params, size), content_type='image/png')
+        resp['ETag'] = etag
+        resp['Cache-Control'] = 'private, max-age=86400'
+        return resp
+
+    def post(self, request):
+        try:
+            params = seal.normalize(request.data)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
+        data = _seal_png(params, seal.LIBRARY_SIZE)
+        # Та же печать уже в библиотеке — вторую копию не заводим
+        obj = SignImage.objects.filter(user=request.user, kind='round_seal', data=data).first()
+        if obj:
+            return Response(_sign_to_dict(obj))
+        svg = _vectorize_sign(request, data)
+        obj = SignImage.objects.create(user=request.user, kind='round_seal', mime='image/png', data=data, svg=svg)
+        return Response(_sign_to_dict(obj), status=201)
+
+
 # ---------- Глобальные подписи/печати (админ) ----------
 class DefaultSignsListCreate(APIView):
     permission_classes = [permissions.IsAdminUser]
 
     def get(self, request):
-        qs = GlobalSignImage.objects.all().order_by('-created_at')
-        return Response([_default_sign_to_dict(i) for i in qs])
+        return Response(_cached_default_signs())
 
     def post(self, request):
         kind = (request.data.get('kind') or 'signature').strip()
@@ -535,8 +1055,10 @@ class DefaultSignsListCreate(APIView):
         if len(data) > 6 * 1024 * 1024:
             return Response({'detail': 'Изображение слишком большое (до 6 МБ)'}, status=400)
 
-        obj = GlobalSignImage.objects.create(kind=kind, mime=mime, data=data)
-        return Response(_default_sign_to_dict(obj), status=201)
+        data, mime, cleaned = _clean_sign(request, data, mime)
+        svg = _vectorize_sign(request, data)
+        obj = GlobalSignImage.objects.create(kind=kind, mime=mime, data=data, svg=svg)
+        return Response({**_default_sign_to_dict(obj), 'cleaned': cleaned}, status=201)
 
 
 class DefaultSignDetail(APIView):
@@ -899,6 +1421,7 @@ def _apply_patch_ops(snapshot: dict, ops: list[dict]) -> dict:
       - {"op":"page_set_meta", "page": int, "meta": {...}}  # полная замена метаданных страницы (с сохранением overlays/landscape)
       - {"op":"page_add", "index": int, "page": {...}}      # опционально
       - {"op":"page_remove", "index": int}                  # опционально
+      - {"op":"page_enhance", "page": int, "modes": [...]}  # улучшение скана (core.enhance), [] — исходник
     """
     if not isinstance(snapshot, dict):
         return snapshot or {}
@@ -974,6 +1497,13 @@ def _apply_patch_ops(snapshot: dict, ops: list[dict]) -> dict:
                 if 0 <= idx < len(pages):
                     pages.pop(idx)
 
+            elif kind == 'page_enhance':
+                # Только запрос: фон пересчитывает ingest.apply_enhancements
+                i = int(op.get('page'))
+                if 0 <= i < len(pages):
+                    state = pages[i].get('enhance') if isinstance(pages[i].get('enhance'), dict) else {}
+                    pages[i]['enhance'] = {**state, 'modes': list(op.get('modes') or [])}
+
         except Exception:
             # Пропускаем битые операции
             continue
@@ -982,6 +1512,24 @@ def _apply_patch_ops(snapshot: dict, ops: list[dict]) -> dict:
     return snapshot
 
 
+def _process_backgrounds(pages: list, request):
+    """
+    Фоны страниц черновика: data URL -> blob-ы, затем запрошенные улучшения.
+    -> (отчёт о перекодировании с urls,
+        {id: {"enhance", "src_pdf", "docWidth", "docHeight"}} улучшенных страниц)
+    """
+    base_url = _api_base_url(request)
+    report = ingest.offload_backgrounds(pages, base_url)
+    changed = ingest.apply_enhancements(pages, base_url)
+    for pid, page in changed.items():
+        report['urls'][pid] = page['bg_src']
+    return report, {
+        pid: {'enhance': page['enhance'], 'src_pdf': page.get('src_pdf'),
+              'docWidth': page.get('docWidth'), 'docHeight': page.get('docHeight')}
+        for pid, page in changed.items()
+    }
+
+
 class DraftGetView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -1018,6 +1566,8 @@ class DraftSaveView(APIView):
         snap = copy.deepcopy(data)
         for p in (snap.get('pages') or []):
             _ensure_overlay_ids(p)
+        # PNG data URL фонов -> blob-ы; клиент подставит ссылки из bg_urls
+        report, enhanced = _process_backgrounds(snap.get('pages') or [], request)
 
         d, _ = DocumentDraft.objects.update_or_create(
             user=request.user,
@@ -1027,6 +1577,9 @@ class DraftSaveView(APIView):
             "saved": True,
             "updated_at": d.updated_at.isoformat(),
             "expires_at": d.expires_at.isoformat(),
+            "bg_urls": report.pop('urls'),
+            "transcoded": report,
+            "enhanced": enhanced,
         })
 
 
@@ -1055,6 +1608,7 @@ class DraftPatchView(APIView):
             snap['pages'] = []
 
         new_snap = _apply_patch_ops(snap, ops)
+        report, enhanced = _process_backgrounds(new_snap['pages'], request)
 
         d.data = new_snap
         d.save(update_fields=['data', 'expires_at', 'updated_at'])
@@ -1063,6 +1617,9 @@ class DraftPatchView(APIView):
             "patched": True,
             "updated_at": d.updated_at.isoformat(),
             "expires_at": d.expires_at.isoformat(),
+            "bg_urls": report.pop('urls'),
+            "transcoded": report,
+            "enhanced": enhanced,
         })
 
 
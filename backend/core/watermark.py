@@ -0,0 +1,124 @@
+"""
+Водяной знак бесплатных выгрузок (в процессах core.workers).
+
+Знак — плитка с диагональной надписью, повторённая по странице сеткой
+COLUMNS плиток по ширине. Плитка рисуется один раз на процесс и размер
+(lru_cache), маска целой страницы собирается из неё np.tile и тоже
+кэшируется: страницы документа обычно одного размера. В растр знак
+смешивается целочисленной арифметикой numpy только в пикселях под
+надписью (индексы из маски), в PDF плитка
+встраивается один раз картинкой с SMask и ставится на страницы
+операторами Do. pdf_page / jpg_page — те же задачи пула, что в
+core.render, но со знаком. Модуль не зависит от Django.
+"""
+import math
+import zlib
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from . import render
+from .pdfwriter import ImageSpec, PageSpec, num
+
+TEXT = 'ScannyRF'
+# Серый цвет надписи и её непрозрачность (0..255)
+GRAY = 128
+OPACITY = 56
+ANGLE = 30
+# Плиток по ширине страницы; сторона плитки в PDF, пикселей
+COLUMNS = 2
+PDF_TILE_PX = 512
+FONT = 'Arial'
+
+
+@lru_cache(maxsize=8)
+def tile(side: int, font_dirs: tuple) -> np.ndarray:
+    """Маска плитки side x side (uint8, 0..OPACITY)"""
+    side = max(8, side)
+    # Надпись с высотой букв должна уместиться в плитку: ~70% диагонали
+    span = side * math.sqrt(2) * 0.7
+    font, _ = render.load_font(FONT, 100, True, False, font_dirs)
+    size = max(6, int(100 * span / max(1.0, font.getlength(TEXT))))
+    font, fake_bold = render.load_font(FONT, size, True, False, font_dirs)
+    big = side * 2
+    img = Image.new('L', (big, big), 0)
+    stroke = max(1, size // 30) if fake_bold else 0
+    ImageDraw.Draw(img).text((big / 2, big / 2), TEXT, font=font, fill=255, anchor='mm',
+                             stroke_width=stroke, stroke_fill=255)
+    img = img.rotate(ANGLE, Image.BICUBIC).crop((side // 2, side // 2, side // 2 + side, side // 2 + side))
+    mask = np.asarray(img, dtype=np.uint16) * OPACITY // 255
+    mask = mask.astype(np.uint8)
+    mask.setflags(write=False)
+    return mask
+
+
+def tile_side(page_w: float) -> int:
+    return max(8, round(page_w / COLUMNS))
+
+
+@lru_cache(maxsize=4)
+def _page_mask(width: int, height: int, font_dirs: tuple):
+    """
+    Маска страницы в разреженном виде: индексы пикселей под надписью (~10%
+    страницы) и веса смешивания для них — 255 - a и GRAY * a + 127 (с округлением).
+    """
+    t = tile(tile_side(width), font_dirs)
+    reps = (-(-height // t.shape[0]), -(-width // t.shape[1]))
+    mask = np.tile(t, reps)[:height, :width].ravel()
+    idx = np.flatnonzero(mask)
+    a = mask[idx].astype(np.uint16)[:, None]
+    inv, add = 255 - a, a * GRAY + 127
+    for arr in (idx, inv, add):
+        arr.setflags(write=False)
+    return idx, inv, add
+
+
+def apply(img: Image.Image, font_dirs: tuple) -> Image.Image:
+    """Растровая страница (RGB) со знаком: px = (px * (255 - a) + GRAY * a) / 255 под надписью"""
+    idx, inv, add = _page_mask(img.width, img.height, font_dirs)
+    px = np.array(img if img.mode == 'RGB' else img.convert('RGB'))
+    flat = px.reshape(-1, 3)
+    sel = flat[idx].astype(np.uint16)
+    sel *= inv
+    sel += add
+    sel //= 255
+    flat[idx] = sel
+    return Image.fromarray(px, 'RGB')
+
+
+@lru_cache(maxsize=4)
+def pdf_image(font_dirs: tuple) -> ImageSpec:
+    """Плитка для PDF: серая заливка с маской прозрачности (встраивается один раз на файл)"""
+    mask = tile(PDF_TILE_PX, font_dirs)
+    smask = ImageSpec('wm:a', PDF_TILE_PX, PDF_TILE_PX, zlib.compress(mask.tobytes(), 9), colorspace='DeviceGray')
+    fill = zlib.compress(bytes([GRAY]) * (PDF_TILE_PX * PDF_TILE_PX), 9)
+    return ImageSpec('wm', PDF_TILE_PX, PDF_TILE_PX, fill, colorspace='DeviceGray', smask=smask)
+
+
+def pdf_ops(name: str, page_w: float, page_h: float, left: float, top: float) -> str:
+    """Операторы сетки плиток в координатах документа (ось Y вниз), от угла страницы"""
+    side = tile_side(page_w) * 1.0
+    ops = []
+    for row in range(math.ceil(page_h / side)):
+        for col in range(math.ceil(page_w / side)):
+            x, y = left + col * side, top + row * side
+            ops.append(f'q {num(side)} 0 0 {num(-side)} {num(x)} {num(y + side)} cm /{name} Do Q\n')
+    return ''.join(ops)
+
+
+def pdf_page(args) -> PageSpec:
+    """render.pdf_page со знаком поверх оверлеев"""
+    page, font_dirs, _ = args
+    spec = render.pdf_page(args)
+    _, _, page_w, page_h, left, top = render.page_box(page)
+    spec.images['Wm'] = pdf_image(font_dirs)
+    spec.content += pdf_ops('Wm', page_w, page_h, left, top).encode('ascii')
+    return spec
+
+
+def jpg_page(args) -> bytes:
+    """render.jpg_page со знаком"""
+    page, font_dirs, scale, quality = args
+    scale = render.raster_scale(page, scale)
+    return render.encode_jpg(apply(render.raster_page(page, font_dirs, scale), font_dirs), scale, quality)
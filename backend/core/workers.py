@@ -0,0 +1,92 @@
+"""
+Общий ограниченный пул процессов для тяжёлой обработки изображений
+(рендеринг страниц при экспорте, растеризация, фильтры).
+
+Число процессов задаётся RENDER_WORKERS и одинаково для всех запросов
+процесса: сколько бы экспортов ни шло одновременно, CPU занимают не больше
+RENDER_WORKERS задач, остальные ждут в очереди пула. Функции задач должны
+быть в модулях без зависимостей от Django (core/render.py и т.п.).
+"""
+import logging
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def workers_count() -> int:
+    return max(0, int(getattr(settings, 'RENDER_WORKERS', 1)))
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # forkserver: дочерние процессы не наследуют потоки и соединения веб-сервера
+                _pool = ProcessPoolExecutor(
+                    max_workers=max(1, workers_count()),
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    max_tasks_per_child=getattr(settings, 'RENDER_TASKS_PER_CHILD', None) or None,
+                )
+    return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def run(fn, *args, timeout=None):
+    """Выполняет одну задачу в пуле и ждёт результат"""
+    if not workers_count():
+        return fn(*args)
+    pool = get_pool()
+    try:
+        return pool.submit(fn, *args).result(timeout=timeout)
+    except BrokenProcessPool:
+        logger.warning('Render pool is broken, restarting')
+        _reset_pool(pool)
+        raise
+
+
+def imap(fn, items, window=None):
+    """
+    Как map(), но задачи считаются в пуле, а результаты отдаются по порядку
+    по мере готовности. В полёте не больше window задач, поэтому память не
+    растёт с количеством элементов. Если потребитель бросил генератор
+    (клиент оборвал скачивание), невыполненные задачи отменяются.
+    """
+    if not workers_count():
+        for it in items:
+            yield fn(it)
+        return
+
+    pool = get_pool()
+    window = window or workers_count() * 2
+    pending = deque()
+    try:
+        for it in items:
+            pending.append(pool.submit(fn, it))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        logger.warning('Render pool is broken, restarting')
+        _reset_pool(pool)
+        raise
+    finally:
+        for f in pending:
+            f.cancel()
@@ -7,6 +7,7 @@ from django.utils import timezone
 from django.contrib.auth.models import AnonymousUser
 from django.db import transaction
 
+from .export_jobs import user_group
 from .models import DocumentDraft, BillingConfig
 
 
@@ -133,6 +134,10 @@ class EditorConsumer(AsyncJsonWebsocketConsumer):
 
     Ответы:
       - welcome / ack / committed / pong / error
+
+    События фоновых выгрузок пользователя (core.export_jobs):
+      - { "type":"export_progress", "job": id, "done": n, "total": n }
+      - { "type":"export_done", "job": {...} }
     """
 
     async def connect(self):
@@ -147,12 +152,22 @@ class EditorConsumer(AsyncJsonWebsocketConsumer):
             await self.close(code=4001)
             return
 
+        self.export_group = user_group(self.user.pk)
+        await self.channel_layer.group_add(self.export_group, self.channel_name)
         await self.accept()
         await self.send_json({"type": "welcome", "client_id": self.client_id})
 
     async def disconnect(self, code):
-        # Ничего дополнительного — “мгновенные” патчи уже применены
-        return
+        # “Мгновенные” патчи уже применены — только отписываемся от событий выгрузок
+        group = getattr(self, 'export_group', None)
+        if group:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def export_progress(self, event):
+        await self.send_json({"type": "export_progress", "job": event["job"], "done": event["done"], "total": event["total"]})
+
+    async def export_done(self, event):
+        await self.send_json({"type": "export_done", "job": event["job"]})
 
     async def receive_json(self, content, **kwargs):
         msg_type = (content.get("type") or content.get("action") or "").lower()
@@ -1,5 +1,7 @@
 // src/api.js
 
+import { EditorWS } from './utils/wsClient';
+
 const API = import.meta.env.VITE_API_URL || 'http://127.0.0.1:8000/api';
 
 function hasAccess() {
@@ -93,6 +95,46 @@ async function requestAuthed(path, options = {}) {
   return request(path, { ...options, headers });
 }
 
+const DOWNLOAD_RESUME_TRIES = 3;
+
+// Скачивание файла с авторизацией и повтором после обновления токена.
+// Оборванная загрузка докачивается с места обрыва (Range) по X-Export-Url
+async function fetchBlob(path, options, onBytes = null) {
+  const send = (p, opts) => fetch(API + p, {
+    ...opts,
+    headers: { ...(opts.headers || {}), Authorization: `Bearer ${getAccess()}` },
+  });
+  let res = await send(path, options);
+  if (res.status === 401 && await refreshAccessToken()) res = await send(path, options);
+  if (!res.ok) throw buildError(await res.text());
+  const type = res.headers.get('Content-Type') || 'application/octet-stream';
+  const resumeUrl = res.headers.get('X-Export-Url') || (res.headers.get('Accept-Ranges') === 'bytes' ? path : '');
+  const etag = res.headers.get('ETag');
+  if (!res.body || !res.body.getReader) return await res.blob();
+  const parts = [];
+  let got = 0;
+  for (let tries = 0; ; ) {
+    try {
+      const reader = res.body.getReader();
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) return new Blob(parts, { type });
+        parts.push(value);
+        got += value.length;
+        if (onBytes) onBytes(got);
+      }
+    } catch (e) {
+      if (!resumeUrl || ++tries > DOWNLOAD_RESUME_TRIES) throw e;
+      const headers = { Range: `bytes=${got}-` };
+      if (etag) headers['If-Range'] = etag;
+      res = await send(resumeUrl, { method: 'GET', headers });
+      if (res.status === 401 && await refreshAccessToken()) res = await send(resumeUrl, { method: 'GET', headers });
+      if (res.status === 200) { parts.length = 0; got = 0; } // файл изменился — заново
+      else if (res.status !== 206) throw buildError(await res.text());
+    }
+  }
+}
+
 function clearTokens() {
   localStorage.removeItem('access');
   localStorage.removeItem('refresh');
@@ -347,15 +389,34 @@ export const AuthAPI = {
     if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
     return requestAuthed('/library/signs/');
   },
-  addSign({ kind = 'signature', data_url = null, file = null }) {
+  // Фон фото подписи сервер делает прозрачным; ink: 'blue' | 'black' перекрашивает чернила,
+  // vectorize — сохранить и SVG-копию (svg_url в списке)
+  addSign({ kind = 'signature', data_url = null, file = null, ink = '', vectorize = false }) {
     if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
     const fd = new FormData();
     fd.append('kind', kind);
     if (file) fd.append('image', file);
     else if (data_url) fd.append('data_url', data_url);
     else throw new Error('Ожидается file или data_url');
+    if (ink) fd.append('ink', ink);
+    if (vectorize) fd.append('vectorize', '1');
     return requestAuthed('/library/signs/', { method: 'POST', body: fd });
   },
+  // Круглая печать по параметрам: PNG для предпросмотра (кэшируется сервером) и сохранение в библиотеку
+  sealPreview({ org, inn = '', ogrn = '', center = '', color = '' }, size = 256) {
+    if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
+    const q = new URLSearchParams({ org, inn, ogrn, center, size: String(size) });
+    if (color) q.set('color', color);
+    return fetchBlob(`/library/seal/?${q}`, { method: 'GET' });
+  },
+  saveSeal(params) {
+    if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
+    return requestAuthed('/library/seal/', {
+      method: 'POST',
+      headers: { 'Content-Type':'application/json' },
+      body: JSON.stringify({ ...params, vectorize: '1' }),
+    });
+  },
   deleteSign(id) {
     if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
     return requestAuthed(`/library/signs/${id}/`, { method: 'DELETE' });
@@ -382,13 +443,15 @@ export const AuthAPI = {
     if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
     return requestAuthed('/library/default-signs/');
   },
-  adminAddDefault({ kind = 'signature', data_url = null, file = null }) {
+  adminAddDefault({ kind = 'signature', data_url = null, file = null, ink = '', vectorize = false }) {
     if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
     const fd = new FormData();
     fd.append('kind', kind);
     if (file) fd.append('image', file);
     else if (data_url) fd.append('data_url', data_url);
     else throw new Error('Ожидается file или data_url');
+    if (ink) fd.append('ink', ink);
+    if (vectorize) fd.append('vectorize', '1');
     return requestAuthed('/library/default-signs/', { method: 'POST', body: fd });
   },
   adminDeleteDefault(id) {
@@ -401,6 +464,79 @@ export const AuthAPI = {
     return requestAuthed('/draft/get/');
   },
 
+  // Серверный экспорт сохранённого черновика: квота списывается сервером,
+  // файл приходит потоком (onBytes — сколько байт уже получено);
+  // searchable — PDF с распознанным текстом
+  async exportDraft(format, mode = 'free', doc_name = '', onBytes = null, searchable = false) {
+    if (!hasAccess()) throw new Error('Требуется авторизация');
+    return fetchBlob(`/export/${format}/`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ mode, doc_name, searchable: searchable ? 1 : 0 }),
+    }, onBytes);
+  },
+
+  // Фоновая выгрузка больших документов: задача в очереди сервера, прогресс
+  // приходит по WebSocket редактора (export_progress/export_done), опрос — запасной путь
+  async runExportJob(format, { mode = 'free', doc_name = '', clientId = '', searchable = false, onProgress = null, onBytes = null } = {}) {
+    if (!hasAccess()) throw new Error('Требуется авторизация');
+    let job = await requestAuthed('/export/jobs/', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ format, mode, doc_name, searchable: searchable ? 1 : 0 }),
+    });
+    const ws = clientId ? new EditorWS({ clientId, token: getAccess(), apiBase: API }) : null;
+    let wake = null;
+    if (ws) {
+      ws.onmessage = (ev) => {
+        const msg = parseJsonSafe(ev.data);
+        if (msg.type === 'export_progress' && msg.job === job.id) {
+          job = { ...job, status: 'running', done_pages: msg.done };
+          if (onProgress) onProgress(msg.done, msg.total);
+        } else if (msg.type === 'export_done' && msg.job && msg.job.id === job.id) {
+          job = msg.job;
+          if (wake) wake();
+        }
+      };
+      ws.connect();
+    }
+    try {
+      while (!['done', 'failed', 'expired'].includes(job.status)) {
+        // С открытым сокетом опрашиваем редко — только на случай потерянного события
+        await new Promise(r => { wake = r; setTimeout(r, ws && ws.ready ? 10000 : 2000); });
+        wake = null;
+        if (['done', 'failed', 'expired'].includes(job.status)) break;
+        job = await requestAuthed(`/export/jobs/${job.id}/`);
+        if (onProgress) onProgress(job.done_pages, job.pages);
+      }
+    } finally {
+      if (ws) ws.close();
+    }
+    if (job.status !== 'done') throw new Error(job.error || 'Не удалось выполнить выгрузку');
+    return fetchBlob(job.download_url, { method: 'GET' }, onBytes);
+  },
+
+  // Исходный PDF для векторного экспорта: сервер дописывает подписи поверх
+  // оригинальных страниц, страницы черновика ссылаются на него по sha256
+  uploadSource(file) {
+    if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
+    const fd = new FormData();
+    fd.append('file', file);
+    return requestAuthed('/docs/sources/', { method: 'POST', body: fd });
+  },
+
+  // Растрирование PDF/DOCX/XLSX/JPG/PNG на сервере: страницы сразу дописываются
+  // в черновик, в ответе — их описания со ссылками bg_src на /docs/blobs/
+  ingestDocument(file, { clientId = '', docName = '', enhance = [] } = {}) {
+    if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
+    const fd = new FormData();
+    fd.append('file', file);
+    if (clientId) fd.append('client_id', clientId);
+    if (docName) fd.append('doc_name', docName);
+    if (enhance.length) fd.append('enhance', enhance.join(','));
+    return requestAuthed('/docs/ingest/', { method: 'POST', body: fd });
+  },
+
   saveDraft(data) {
     if (!hasAccess()) return Promise.reject(new Error('Требуется авторизация'));
     return requestAuthed('/draft/save/', {
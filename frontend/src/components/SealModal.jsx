@@ -0,0 +1,76 @@
+import { useEffect, useState } from 'react'
+import { AuthAPI } from '../api'
+import { toast } from './Toast.jsx'
+
+/**
+ * Создание круглой печати по реквизитам (рисует сервер).
+ * Props:
+ * - open: boolean
+ * - onClose(): void
+ * - onSaved(item): void — элемент библиотеки (как в listSigns)
+ */
+export default function SealModal({ open, onClose, onSaved }) {
+  const [org, setOrg] = useState('')
+  const [inn, setInn] = useState('')
+  const [ogrn, setOgrn] = useState('')
+  const [center, setCenter] = useState('')
+  const [preview, setPreview] = useState('')
+  const [busy, setBusy] = useState(false)
+
+  // Предпросмотр — после паузы в наборе; одинаковые параметры сервер отдаёт из кэша
+  useEffect(() => {
+    if (!open || !org.trim()) { setPreview(''); return }
+    let url = ''
+    let cancelled = false
+    const t = window.setTimeout(async () => {
+      try {
+        const blob = await AuthAPI.sealPreview({ org, inn, ogrn, center }, 256)
+        if (cancelled) return
+        url = URL.createObjectURL(blob)
+        setPreview(url)
+      } catch {
+        if (!cancelled) setPreview('')
+      }
+    }, 400)
+    return () => {
+      cancelled = true
+      window.clearTimeout(t)
+      if (url) URL.revokeObjectURL(url)
+    }
+  }, [open, org, inn, ogrn, center])
+
+  const save = async () => {
+    setBusy(true)
+    try {
+      const item = await AuthAPI.saveSeal({ org, inn, ogrn, center })
+      onSaved?.(item)
+    } catch (e) {
+      toast(e.message || 'Не удалось создать печать', 'error')
+    } finally {
+      setBusy(false)
+    }
+  }
+
+  if (!open) return null
+
+  return (
+    <div className="modal-overlay" onClick={onClose}>
+      <div className="modal" onClick={e => e.stopPropagation()} style={{ width: 'min(420px,92vw)' }}>
+        <button className="modal-x" onClick={onClose}>×</button>
+        <h3 className="modal-title">Круглая печать</h3>
+        <div style={{ display: 'flex', flexDirection: 'column', gap: 8, padding: 8 }}>
+          <input placeholder="Название организации" value={org} onChange={e => setOrg(e.target.value)} />
+          <input placeholder="ИНН" inputMode="numeric" value={inn} onChange={e => setInn(e.target.value)} />
+          <input placeholder="ОГРН" inputMode="numeric" value={ogrn} onChange={e => setOgrn(e.target.value)} />
+          <textarea placeholder="Текст в центре" rows={2} value={center} onChange={e => setCenter(e.target.value)} />
+          <div style={{ height: 200, display: 'flex', alignItems: 'center', justifyContent: 'center' }}>
+            {preview && <img src={preview} alt="" style={{ width: 200, height: 200 }} />}
+          </div>
+          <button className={`btn ${org.trim() && !busy ? '' : 'disabled'}`} disabled={!org.trim() || busy} onClick={save}>
+            <span className="label">Сохранить в библиотеку</span>
+          </button>
+        </div>
+      </div>
+    </div>
+  )
+}
@@ -8,12 +8,11 @@ import {
   ensurePDFJS,
   ensureHtml2Canvas,
   ensureMammothCDN,
-  ensureSheetJS,
-  ensureJSZip,
-  ensureScripts
+  ensureSheetJS
 } from '../utils/scriptLoader'
 import { CustomCanvasEngine } from '../utils/customCanvasEngine'
 import CropModal from '../components/CropModal.jsx'
+import SealModal from '../components/SealModal.jsx'
 import ProgressOverlay from '../components/ProgressOverlay.jsx'
 
 import icMore from '../assets/icons/kebab.png'
@@ -41,6 +40,8 @@ const FONTS = ['Arial', 'Times New Roman', 'Ermilov', 'Segoe UI', 'Roboto', 'Geo
 const PDF_RENDER_SCALE = 3.0
 const RASTER_RENDER_SCALE = 3.0
 const LH_FACTOR = 1
+// С этого числа страниц выгрузка идёт фоновой задачей сервера, а не одним запросом
+const EXPORT_JOB_MIN_PAGES = 30
 const PENDING_EXPORT_KEY = 'pending_export'
 
 function randDocId () { return String(Math.floor(1e15 + Math.random() * 9e15)) }
@@ -134,13 +135,6 @@ function measureTextBoxDom (text, fontFamily, fontSize, fontWeight, fontStyle) {
   }
 }
 
-async function ensurePDFLib () {
-  if (window.PDFLib) return window.PDFLib
-  await ensureScripts(['https://cdn.jsdelivr.net/npm/pdf-lib@1.17.1/dist/pdf-lib.min.js'])
-  if (!window.PDFLib) throw new Error('Не удалось загрузить pdf-lib')
-  return window.PDFLib
-}
-
 function isDrawableForExport (img) {
   if (!img) return false
   if (typeof HTMLImageElement !== 'undefined' && img instanceof HTMLImageElement) return true
@@ -456,6 +450,10 @@ export default function Editor () {
   const [payOpen, setPayOpen] = useState(false)
   const [payTargetFormat, setPayTargetFormat] = useState(null)
   const [cropOpen, setCropOpen] = useState(false)
+  const [sealOpen, setSealOpen] = useState(false)
+  // PDF с распознанным текстом; ref — для выгрузки, запущенной после оплаты
+  const [pdfSearchable, setPdfSearchable] = useState(false)
+  const pdfSearchableRef = useRef(false)
   const [cropSrc, setCropSrc] = useState('')
   const [cropKind, setCropKind] = useState('signature')
   const [cropThresh, setCropThresh] = useState(40)
@@ -559,6 +557,66 @@ export default function Editor () {
     setMenuOpen(prev => (prev === name ? null : name))
   }, [])
 
+  // Сервер переносит data URL фонов в хранилище и возвращает ссылки (bg_urls):
+  // подставляем их, чтобы следующие сохранения не пересылали картинки.
+  // bgSrc нужен только для снимка черновика, поэтому страницы правятся на месте.
+  // Для улучшенных страниц (enhanced) меняется и сама картинка фона, а после
+  // обрезки по краям (crop) — и размер страницы: центры оверлеев сдвигаются
+  // пропорционально, как это сделал сервер
+  async function saveDraftNow (snap) {
+    const res = await AuthAPI.saveDraft(snap)
+    const urls = res?.bg_urls || {}
+    const enhanced = res?.enhanced || {}
+    for (const p of pagesRef.current) {
+      if (urls[p.id] && !enhanced[p.id]) p.bgSrc = urls[p.id]
+    }
+    const images = {}
+    for (const id of Object.keys(enhanced)) {
+      try { images[id] = await loadImageEl(urls[id]) } catch {}
+    }
+    if (Object.keys(images).length) {
+      setPagesSync(pagesRef.current.map(p => {
+        if (!images[p.id]) return p
+        const e = enhanced[p.id]
+        const w = e.docWidth || p.docWidth
+        const h = e.docHeight || p.docHeight
+        const kx = w / (p.docWidth || w)
+        const ky = h / (p.docHeight || h)
+        return {
+          ...p,
+          bgImage: images[p.id],
+          bgSrc: urls[p.id],
+          srcPdf: e.src_pdf || null,
+          enhance: e.enhance,
+          docWidth: w,
+          docHeight: h,
+          overlays: (kx === 1 && ky === 1)
+            ? p.overlays
+            : (p.overlays || []).map(o => ({ ...o, cx: o.cx * kx, cy: o.cy * ky }))
+        }
+      }))
+      forceLayoutSyncRef.current?.()
+    }
+    setDraftHint(true)
+    return res
+  }
+
+  async function enhancePage (modes) {
+    const page = pagesRef.current[cur]
+    if (!page) return
+    if (!isAuthed) { toast('Улучшение сканов доступно после входа', 'error'); return }
+    page.enhance = { ...(page.enhance || {}), modes }
+    setProgress({ active: true, mode: 'upload', label: 'Обработка страницы', val: 0, max: 1, suffix: 'стр.' })
+    try {
+      const snap = buildDraftSnapshot()
+      if (snap) await saveDraftNow(snap)
+    } catch (e) {
+      toast(e.message || 'Не удалось обработать страницу', 'error')
+    } finally {
+      setProgress(p => ({ ...p, active: false }))
+    }
+  }
+
   const scheduleSaveDraft = useCallback(() => {
     if (!isAuthed) return
     window.clearTimeout(saveTimerRef.current)
@@ -566,8 +624,7 @@ export default function Editor () {
       const snap = buildDraftSnapshot()
       if (!snap) return
       try {
-        await AuthAPI.saveDraft(snap)
-        setDraftHint(true)
+        await saveDraftNow(snap)
       } catch {}
     }, 400)
     // eslint-disable-next-line react-hooks/exhaustive-deps
@@ -670,6 +727,8 @@ export default function Editor () {
         docHeight: p.docHeight,
         rotation: p.rotation || 0,
         bg_src: bgSrc,
+        src_pdf: p.srcPdf || null,
+        enhance: p.enhance || null,
         overlays
       }
     })
@@ -1096,7 +1155,8 @@ export default function Editor () {
     if (!isAuthed) { setSignLib([]); return }
     try {
       const list = await AuthAPI.listSigns()
-      setSignLib(Array.isArray(list) ? list : [])
+      // SVG-копия подписи не мылится при увеличении и весит меньше PNG — ставим её
+      setSignLib(Array.isArray(list) ? list.map(it => ({ ...it, url: it.svg_url || it.url })) : [])
     } catch { setSignLib([]) }
   }
   useEffect(() => { if (isAuthed) loadLibrary() }, [isAuthed])
@@ -1226,6 +1286,8 @@ export default function Editor () {
           docHeight,
           bgImage: img,
           bgSrc,
+          srcPdf: pg.src_pdf || null,
+          enhance: pg.enhance || null,
           overlays,
           rotation
         })
@@ -1295,6 +1357,37 @@ export default function Editor () {
     return Math.max(1, total)
   }
 
+  async function ingestOnServer (file, clientId) {
+    try {
+      const res = await AuthAPI.ingestDocument(file, {
+        clientId,
+        docName: sanitizeName(fileNameRef.current || file.name.replace(/\.[^.]+$/, '')),
+        // Фото документа обрезается по краям листа; если лист не найден, страница не меняется
+        enhance: /\.(jpe?g|png)$/i.test(file.name) ? ['crop', 'blank'] : ['blank']
+      })
+      const out = []
+      for (const pg of (res?.pages || [])) {
+        const img = await loadImageEl(pg.bg_src)
+        out.push({
+          id: pg.id,
+          docWidth: pg.docWidth,
+          docHeight: pg.docHeight,
+          bgImage: img,
+          bgSrc: pg.bg_src,
+          srcPdf: pg.src_pdf || null,
+          enhance: pg.enhance || null,
+          overlays: [],
+          rotation: 0
+        })
+      }
+      const blank = out.filter(p => p.enhance?.blank).length
+      if (blank) toast(`Похоже, в документе есть пустые страницы: ${blank}`, 'error')
+      return out.length ? out : null
+    } catch {
+      return null
+    }
+  }
+
   async function handleFiles (files) {
     try {
       const totalUnits = await estimateUnits(files)
@@ -1325,6 +1418,19 @@ export default function Editor () {
           setFileName(sanitizeName(f.name.replace(/\.[^.]+$/, '')))
         }
 
+        if (isAuthed && ['pdf', 'docx', 'xls', 'xlsx', 'jpg', 'jpeg', 'png'].includes(ext)) {
+          // Сервер растрирует страницы сам и хранит их по хэшу: в черновик
+          // уходят ссылки, а не мегабайты data URL. При ошибке — разбор в браузере
+          const ingested = await ingestOnServer(f, curDocId)
+          if (ingested) {
+            newPages.push(...ingested)
+            addedPages += ingested.length
+            if (ext === 'pdf') tick(ingested.length)
+            else tick(['docx', 'xls', 'xlsx'].includes(ext) ? 2 : 1)
+            continue
+          }
+        }
+
         if (['jpg', 'jpeg', 'png'].includes(ext)) {
           const url = await readAsDataURL(f)
           const img = await loadImageEl(url)
@@ -1339,10 +1445,14 @@ export default function Editor () {
           })
           addedPages++; tick(1)
         } else if (ext === 'pdf') {
+          // Оригинал уходит на сервер параллельно с рендерингом: экспорт
+          // наложит оверлеи на векторные страницы, а не на их растровые копии
+          const srcUpload = isAuthed ? AuthAPI.uploadSource(f).catch(() => null) : Promise.resolve(null)
           await ensurePDFJS()
           // eslint-disable-next-line no-undef
           const pdf = await pdfjsLib.getDocument({ data: await f.arrayBuffer() }).promise
           const num = pdf.numPages
+          const firstNew = newPages.length
           for (let i = 1; i <= num; i++) {
             const cv = await renderPDFPageToCanvas(pdf, i, PDF_RENDER_SCALE)
             const url = cv.toDataURL('image/png')
@@ -1357,6 +1467,10 @@ export default function Editor () {
             })
             addedPages++; tick(1)
           }
+          const src = await srcUpload
+          if (src && src.sha256 && src.pages === num) {
+            for (let i = 0; i < num; i++) newPages[firstNew + i].srcPdf = { sha: src.sha256, index: i }
+          }
         } else if (ext === 'docx') {
           const big = await renderDOCXToCanvas(f)
           const slices = sliceCanvasToPages(big)
@@ -1821,8 +1935,7 @@ export default function Editor () {
       const snap = buildDraftSnapshot()
       if (snap) {
         try {
-          await AuthAPI.saveDraft(snap)
-          setDraftHint(true)
+          await saveDraftNow(snap)
         } catch {}
       }
 
@@ -1862,6 +1975,26 @@ export default function Editor () {
     return sanitizeName(nm)
   }
 
+  // Файл выгрузки с сервера: небольшие документы — потоком в ответе,
+  // большие — через очередь с прогрессом по страницам
+  function downloadExport (format, mode, bn, pageCount) {
+    const label = format.toUpperCase()
+    const onBytes = (n) => {
+      setProgress(pr => ({ ...pr, label: `Скачивание ${label}: ${Math.round(n / 1024)} КБ` }))
+    }
+    const searchable = format === 'pdf' && pdfSearchableRef.current
+    if (pageCount < EXPORT_JOB_MIN_PAGES) return AuthAPI.exportDraft(format, mode, bn, onBytes, searchable)
+    setProgress(pr => ({ ...pr, label: `Подготовка ${label}`, val: 0, max: pageCount, suffix: 'стр.' }))
+    return AuthAPI.runExportJob(format, {
+      mode,
+      doc_name: bn,
+      clientId: docIdRef.current || '',
+      searchable,
+      onProgress: (done) => setProgress(pr => ({ ...pr, val: done || 0 })),
+      onBytes
+    })
+  }
+
   async function exportJPG (mode = 'free') {
     try {
       if (!pagesRef.current.length) return
@@ -1875,35 +2008,18 @@ export default function Editor () {
         mode: 'export',
         label: 'Подготовка JPG',
         val: 0,
-        max: pageCount,
-        suffix: 'стр.'
-      })
-
-      await ensureJSZip()
-      // eslint-disable-next-line no-undef
-      const zip = new JSZip()
-
-      for (let i = 0; i < pagesRef.current.length; i++) {
-        const p = pagesRef.current[i]
-        const off = renderPageOffscreen(p, 2)
-        const blob = await new Promise(r => off.toBlob(r, 'image/jpeg', 0.95))
-        zip.file(`${bn}-p${i + 1}.jpg`, blob)
-        setProgress(pr => ({ ...pr, val: i + 1 }))
-        await new Promise(r => requestAnimationFrame(r))
-      }
-
-      const out = await zip.generateAsync({ type: 'blob', compression: 'DEFLATE' })
-
-      setProgress({
-        active: true,
-        mode: 'export',
-        label: 'Скачивание JPG',
-        val: 1,
         max: 1,
         suffix: ''
       })
 
-      await AuthAPI.recordDownload('jpg', pageCount, bn, mode, docIdRef.current || '')
+      // ZIP собирает сервер из сохранённого черновика: страницы рендерятся
+      // параллельно и приходят потоком, квота списывается за весь архив
+      const snap = buildDraftSnapshot()
+      if (!snap) return
+      await saveDraftNow(snap)
+
+      const out = await downloadExport('jpg', mode, bn, pageCount)
+      refreshBillingStatus()
 
       const a = document.createElement('a')
       const href = URL.createObjectURL(out)
@@ -1937,40 +2053,18 @@ export default function Editor () {
         mode: 'export',
         label: 'Подготовка PDF',
         val: 0,
-        max: pageCount,
-        suffix: 'стр.'
-      })
-
-      const PDFLib = await ensurePDFLib()
-      const pdfDoc = await PDFLib.PDFDocument.create()
-
-      for (let i = 0; i < pagesRef.current.length; i++) {
-        const p = pagesRef.current[i]
-        const off = renderPageOffscreen(p, 2)
-        const blob = await new Promise(r => off.toBlob(r, 'image/jpeg', 0.95))
-        const buf = await blob.arrayBuffer()
-        const img = await pdfDoc.embedJpg(buf)
-        const page = pdfDoc.addPage([img.width, img.height])
-        page.drawImage(img, { x: 0, y: 0, width: img.width, height: img.height })
-
-        setProgress(pr => ({ ...pr, val: i + 1 }))
-        await new Promise(r => requestAnimationFrame(r))
-      }
-
-      const pdfBytes = await pdfDoc.save()
-
-      setProgress({
-        active: true,
-        mode: 'export',
-        label: 'Скачивание PDF',
-        val: 1,
         max: 1,
         suffix: ''
       })
 
-      await AuthAPI.recordDownload('pdf', pageCount, bn, mode, docIdRef.current || '')
+      // PDF собирает сервер из сохранённого черновика — сначала сохраняем актуальное состояние
+      const snap = buildDraftSnapshot()
+      if (!snap) return
+      await saveDraftNow(snap)
+
+      const blob = await downloadExport('pdf', mode, bn, pageCount)
+      refreshBillingStatus()
 
-      const blob = new Blob([pdfBytes], { type: 'application/pdf' })
       const a = document.createElement('a')
       const href = URL.createObjectURL(blob)
       a.href = href
@@ -2394,6 +2488,13 @@ export default function Editor () {
             >
               <img className="ico" src={icSign} alt="" /><span>Загрузить подпись</span>
             </button>
+            <button
+              className={`ed-tool ${isAuthed ? '' : 'disabled'}`}
+              onMouseDown={e => e.preventDefault()}
+              onClick={() => { if (isAuthed) setSealOpen(true); else toast('Создание печати доступно после входа', 'error') }}
+            >
+              <img className="ico" src={icSign} alt="" /><span>Создать печать</span>
+            </button>
           </div>
 
           <div className="ed-sign-list">
@@ -2574,6 +2675,14 @@ export default function Editor () {
                 <img src={icPdfFree} alt="" style={{ width: 18, height: 18, marginRight: 8 }} />PDF
               </button>
             </div>
+            <label className="agree-line">
+              <input
+                type="checkbox"
+                checked={pdfSearchable}
+                onChange={e => { pdfSearchableRef.current = e.target.checked; setPdfSearchable(e.target.checked) }}
+              />
+              <span>PDF с поиском по тексту</span>
+            </label>
           </div>
         </aside>
       </div>
@@ -2626,6 +2735,41 @@ export default function Editor () {
             <img src={icRotate} alt="" style={{ width: 18, height: 18, marginRight: 10 }} />Повернуть страницу
           </button>
 
+          {(pagesRef.current[cur]?.enhance?.applied || []).some(m => m !== 'blank')
+            ? (
+              <button
+                onMouseDown={e => e.preventDefault()}
+                onClick={() => { closeMenus(); enhancePage([]) }}
+              >
+                <img src={icUndo} alt="" style={{ width: 18, height: 18, marginRight: 10 }} />Вернуть исходный скан
+              </button>
+              )
+            : (
+              <>
+                <button
+                  className={pagesRef.current.length ? '' : 'disabled'}
+                  onMouseDown={e => e.preventDefault()}
+                  onClick={() => { closeMenus(); enhancePage(['deskew', 'shadows', 'auto_contrast']) }}
+                >
+                  <img src={icRotate} alt="" style={{ width: 18, height: 18, marginRight: 10 }} />Улучшить скан
+                </button>
+                <button
+                  className={pagesRef.current.length ? '' : 'disabled'}
+                  onMouseDown={e => e.preventDefault()}
+                  onClick={() => { closeMenus(); enhancePage(['deskew', 'shadows', 'binarize']) }}
+                >
+                  <img src={icRotate} alt="" style={{ width: 18, height: 18, marginRight: 10 }} />Чёрно-белый скан
+                </button>
+                <button
+                  className={pagesRef.current.length ? '' : 'disabled'}
+                  onMouseDown={e => e.preventDefault()}
+                  onClick={() => { closeMenus(); enhancePage(['crop', 'deskew', 'shadows', 'auto_contrast']) }}
+                >
+                  <img src={icRotate} alt="" style={{ width: 18, height: 18, marginRight: 10 }} />Обрезать по краям листа
+                </button>
+              </>
+              )}
+
           <button
             className={(pagesRef.current.length && pagesRef.current.length > 1) ? '' : 'disabled'}
             onMouseDown={e => e.preventDefault()}
@@ -2853,6 +2997,16 @@ export default function Editor () {
         }}
       />
 
+      <SealModal
+        open={sealOpen}
+        onClose={() => setSealOpen(false)}
+        onSaved={async (item) => {
+          setSealOpen(false)
+          await loadLibrary()
+          if (pagesRef.current[cur]) placeFromLib(item.svg_url || item.url)
+        }}
+      />
+
       <CropModal
         open={cropOpen}
         src={cropSrc}
@@ -2861,7 +3015,7 @@ export default function Editor () {
         onClose={() => setCropOpen(false)}
         onConfirm={async (kind, dataUrl) => {
           try {
-            try { await AuthAPI.addSign({ kind, data_url: dataUrl }); await loadLibrary() } catch {}
+            try { await AuthAPI.addSign({ kind, data_url: dataUrl, vectorize: true }); await loadLibrary() } catch {}
             const page = pagesRef.current[cur]
             if (page && engineRef.current) {
               const img = await loadImageEl(dataUrl)
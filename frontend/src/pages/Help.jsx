@@ -24,6 +24,7 @@ export default function Help() {
   const [editorOpen, setEditorOpen] = useState(false)
   const [editRow, setEditRow] = useState(null)
   const [detail, setDetail] = useState(null)
+  const [found, setFound] = useState(null)   // результаты серверного поиска или null
 
   useEffect(() => {
     const u = JSON.parse(localStorage.getItem('user') || 'null')
@@ -58,14 +59,35 @@ export default function Help() {
     } finally { setLoading(false) }
   }
 
+  // Поиск — на сервере (полнотекстовый индекс), с задержкой на время набора
+  useEffect(() => {
+    const s = q.trim()
+    if (!s) { setFound(null); return }
+    const ctrl = new AbortController()
+    const t = setTimeout(() => {
+      fetch(AuthAPI.getApiBase() + '/cms/faq/search/?q=' + encodeURIComponent(s), { signal: ctrl.signal })
+        .then(r => r.ok ? r.json() : null)
+        .then(d => setFound(Array.isArray(d?.results) ? d.results : []))
+        .catch(() => {})
+    }, 250)
+    return () => { clearTimeout(t); ctrl.abort() }
+  }, [q])
+
   const filtered = useMemo(() => {
-    const s = q.trim().toLowerCase()
-    if (!s) return items
-    return items.filter(x => x.title.toLowerCase().includes(s))
-  }, [q, items])
+    if (!q.trim() || found === null) return items
+    return found
+  }, [q, items, found])
 
   const openNew = () => { setEditRow(null); setEditorOpen(true) }
-  const openEdit = (row) => { setEditRow(row); setEditorOpen(true) }
+  const openEdit = async (row) => {
+    // в результатах поиска нет полного текста — догружаем вопрос целиком
+    if (row.body === undefined) {
+      const r = await fetch(AuthAPI.getApiBase() + `/cms/faq/${row.id}/`)
+      if (!r.ok) { toast('Не удалось загрузить вопрос','error'); return }
+      row = await r.json()
+    }
+    setEditRow(row); setEditorOpen(true)
+  }
   const remove = async (row) => {
     if (!confirm('Удалить вопрос?')) return
     try {
@@ -153,8 +175,12 @@ export default function Help() {
             const text = htmlToText(row.body || '')
             return (
               <div className="help-card" key={row.id} onClick={()=>nav(`/help/${row.id}`)} title="Открыть">
-                <div className="help-card-title">{row.title}</div>
-                <div className="help-card-text">{text}</div>
+                {row.title_hl
+                  ? <div className="help-card-title" dangerouslySetInnerHTML={{__html: row.title_hl}} />
+                  : <div className="help-card-title">{row.title}</div>}
+                {row.snippet !== undefined
+                  ? <div className="help-card-text" dangerouslySetInnerHTML={{__html: row.snippet}} />
+                  : <div className="help-card-text">{text}</div>}
                 <div className="help-card-go" aria-hidden="true">›</div>
                 {admin && (
                   <div style={{position:'absolute', right:52, bottom:12, display:'flex', gap:8}}>
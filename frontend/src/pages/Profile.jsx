@@ -564,19 +564,27 @@ function InfoSection({user,onUpdated}){
 
 function AdminUsers(){
   const [list,setList]=useState([])
+  const [next,setNext]=useState(null)
+  const [q,setQ]=useState('')
   const [modalOpen, setModalOpen] = useState(false)
   const [editUser, setEditUser] = useState(null)
 
-  const load=async()=>{
+  // Список постраничный: первая страница по поиску, дальше — по ссылке next
+  const load=async(url)=>{
     try{
-      const d = await AuthAPI.authed('/admin/users/')
-      setList(Array.isArray(d)?d:[])
+      const d = await AuthAPI.authed(url || `/admin/users/?q=${encodeURIComponent(q.trim())}`)
+      const items = Array.isArray(d?.results) ? d.results : []
+      setList(prev => url ? [...prev, ...items] : items)
+      setNext(d?.next || null)
     }catch(e){
-      setList([])
+      if(!url) setList([])
       toast(e.message || 'Ошибка загрузки пользователей','error')
     }
   }
-  useEffect(()=>{ load() },[])
+  useEffect(()=>{
+    const t = setTimeout(()=>load(), 300)
+    return ()=>clearTimeout(t)
+  },[q])
 
   const openCreate = () => { setEditUser(null); setModalOpen(true) }
   const openEdit = (u) => { setEditUser(u); setModalOpen(true) }
@@ -598,6 +606,9 @@ function AdminUsers(){
         <h3 style={{margin:'6px 0'}}>Пользователи</h3>
         <button className="btn btn-lite" onClick={openCreate}><span className="label">Создать</span></button>
       </div>
+      <div className="form-row">
+        <input className="text-input" placeholder="Поиск по email или логину" value={q} onChange={e=>setQ(e.target.value)} />
+      </div>
       <div className="admin-grid">
         <div className="admin-list">
           {list.map(u=>(
@@ -612,6 +623,7 @@ function AdminUsers(){
             </div>
           ))}
           {list.length===0 && <p>Пользователи не найдены.</p>}
+          {next && <button className="link-btn" onClick={()=>load(next)}>Показать ещё</button>}
         </div>
       </div>
 
@@ -765,7 +777,7 @@ function DefaultSignsAdmin(){
         onClose={()=>setCropOpen(false)}
         onConfirm={async (kind, dataUrl) => {
           try {
-            await AuthAPI.adminAddDefault({ kind, data_url: dataUrl })
+            await AuthAPI.adminAddDefault({ kind, data_url: dataUrl, vectorize: true })
             toast('Добавлено','success')
             setCropOpen(false)
             load()
@@ -62,13 +62,19 @@ case "$CMD" in
     cd "$BACKEND"
     python_venv -m daphne -b 0.0.0.0 -p 8000 backend.config.asgi:application &
     BACK_PID=$!
+    python_venv manage.py send_outbox &
+    OUTBOX_PID=$!
+    python_venv manage.py refresh_key_rate --loop &
+    RATE_PID=$!
+    python_venv manage.py run_export_jobs &
+    EXPORT_PID=$!
 
     cd "$FRONTEND"
     npm run dev &
     FRONT_PID=$!
 
-    echo "[dev] backend pid: $BACK_PID, frontend pid: $FRONT_PID"
-    wait $BACK_PID $FRONT_PID
+    echo "[dev] backend pid: $BACK_PID, outbox pid: $OUTBOX_PID, key-rate pid: $RATE_PID, export pid: $EXPORT_PID, frontend pid: $FRONT_PID"
+    wait $BACK_PID $OUTBOX_PID $RATE_PID $EXPORT_PID $FRONT_PID
     ;;
 
   build)
@@ -102,8 +108,22 @@ case "$CMD" in
     python_venv -m daphne -b 0.0.0.0 -p "$PORT" backend.config.asgi:application
     ;;
 
+  worker)
+    echo "[worker] === outbox sender, key-rate refresh & export jobs ==="
+    create_venv_if_needed
+    export PYTHONPATH="$ROOT"
+    cd "$BACKEND"
+    python_venv manage.py send_outbox &
+    OUTBOX_PID=$!
+    python_venv manage.py refresh_key_rate --loop &
+    RATE_PID=$!
+    python_venv manage.py run_export_jobs &
+    EXPORT_PID=$!
+    wait $OUTBOX_PID $RATE_PID $EXPORT_PID
+    ;;
+
   *)
-    echo "Usage: ./manage.sh [dev|build|start]"
+    echo "Usage: ./manage.sh [dev|build|start|worker]"
     exit 1
     ;;
 esac
\ No newline at end of file